@@ -24,7 +24,7 @@ setup(
         ('share/icons/hicolor/64x64/apps/', ['data/icons/64x64/apps/ubuntu-cleaner.png']),
         ('share/icons/hicolor/48x48/apps/', ['data/icons/48x48/apps/ubuntu-cleaner.png']),
         ('share/icons/hicolor/32x32/apps/', ['data/icons/32x32/apps/ubuntu-cleaner.png']),
-        ('share/ubuntu-cleaner/', ['data/ubuntu-cleaner-daemon']),
+        ('share/ubuntu-cleaner/', ['data/ubuntu-cleaner-daemon', 'data/devcaches.ini']),
     ],
     python_requires='>=3.6',
     license='GNU GPL',
@@ -31,3 +31,16 @@ class TestDaemonService(unittest.TestCase):
             mocked_service.p = mock.Mock()
             mocked_service.p.stdout.readlines.return_value = [b'test', b'stdout']
             assert mocked_service.get_cmd_pipe()[0] == b'test stdout'
+
+    def test_remove_snap_revisions(self):
+        with mock.patch.object(DaemonService, '__init__') as mocked_service:
+            mocked_service.return_value = None
+
+            mocked_service = DaemonService()
+            with mock.patch.object(DaemonService, '_check_permission'), \
+                    mock.patch('ubuntucleaner.daemon.service.subprocess.call') as mocked_call:
+                mocked_call.return_value = 0
+                removed = mocked_service.remove_snap_revisions(['core_100', 'bad name; rm -rf /_1'])
+
+            assert removed == ['core_100']
+            mocked_call.assert_called_once_with(['snap', 'remove', '--revision=100', 'core'])
@@ -0,0 +1,56 @@
+import mock
+import unittest
+
+from ubuntucleaner.gui.gtk import UiDispatcher, post_dialog
+
+
+class TestUiDispatcher(unittest.TestCase):
+    def setUp(self):
+        self.dispatcher = UiDispatcher()
+
+    def test_post(self):
+        calls = []
+        with mock.patch('ubuntucleaner.gui.gtk.GLib.idle_add', return_value=1) as m_idle_add:
+            self.dispatcher.post(calls.append, 1)
+            self.dispatcher.post(calls.append, 2)
+
+        m_idle_add.assert_called_once_with(self.dispatcher._drain)
+        self.assertEqual(calls, [])
+
+        self.assertFalse(self.dispatcher._drain())
+        self.assertEqual(calls, [1, 2])
+        self.assertIsNone(self.dispatcher._source)
+
+    def test_drain_in_batches(self):
+        calls = []
+        self.dispatcher.batch_time = -1
+        with mock.patch('ubuntucleaner.gui.gtk.GLib.idle_add', return_value=1):
+            self.dispatcher.post(calls.append, 1)
+            self.dispatcher.post(calls.append, 2)
+
+        self.assertTrue(self.dispatcher._drain())
+        self.assertEqual(calls, [1])
+        self.assertFalse(self.dispatcher._drain())
+        self.assertEqual(calls, [1, 2])
+
+    def test_error_does_not_stop_the_queue(self):
+        calls = []
+        with mock.patch('ubuntucleaner.gui.gtk.GLib.idle_add', return_value=1):
+            self.dispatcher.post(mock.Mock(side_effect=ValueError))
+            self.dispatcher.post(calls.append, 1)
+
+        self.assertFalse(self.dispatcher._drain())
+        self.assertEqual(calls, [1])
+
+
+class TestPostDialog(unittest.TestCase):
+    def test_post_dialog(self):
+        calls = []
+        func = post_dialog(mock.Mock(side_effect=lambda *args, **kwargs: calls.append((args, kwargs))))
+        with mock.patch('ubuntucleaner.gui.gtk.GLib.idle_add', return_value=1) as m_idle_add:
+            func(1, key=2)
+
+        self.assertEqual(calls, [])
+        idle_func, args, kwargs = m_idle_add.call_args[0]
+        self.assertFalse(idle_func(args, kwargs))
+        self.assertEqual(calls, [((1,), {'key': 2})])
@@ -0,0 +1,14 @@
+import os
+
+
+class AgedFilesMixin(object):
+    '''Writes files below self.root, last used age_days before self.now.'''
+
+    def _write(self, path, age_days=0):
+        path = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write('data')
+        used = self.now - age_days * 86400
+        os.utime(path, (used, used))
+        return path
@@ -0,0 +1,67 @@
+import json
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from ubuntucleaner.janitor.chromium import (SIMPLE_INDEX_ENTRY, SIMPLE_INDEX_HEADER,
+                                            SIMPLE_INDEX_MAGIC, SIMPLE_INDEX_PICKLE_HEADER,
+                                            WINDOWS_EPOCH_DELTA, read_simple_cache_index)
+from ubuntucleaner.janitor.chrome_plugin import ChromeCachePlugin
+
+
+def write_index(path, entries, version=9):
+    os.makedirs(os.path.dirname(path))
+    payload = SIMPLE_INDEX_HEADER.pack(SIMPLE_INDEX_MAGIC, version, len(entries), 0, 0)
+    for key, last_used, size in entries:
+        payload += SIMPLE_INDEX_ENTRY.pack(key, (last_used + WINDOWS_EPOCH_DELTA) * 1000000, size)
+    payload += struct.pack('<q', 0)
+    with open(path, 'wb') as f:
+        f.write(SIMPLE_INDEX_PICKLE_HEADER.pack(len(payload), 0) + payload)
+
+
+class TestChromiumCache(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_read_simple_cache_index(self):
+        path = os.path.join(self.root, 'index-dir', 'the-real-index')
+        write_index(path, [(1, 1000, 4 << 8), (2, 3000, 1 << 8)])
+
+        self.assertEqual(read_simple_cache_index(path), (2, 5 * 256, 3000))
+
+    def test_read_simple_cache_index_unpacked_size(self):
+        path = os.path.join(self.root, 'index-dir', 'the-real-index')
+        write_index(path, [(1, 1000, 1234)], version=8)
+
+        self.assertEqual(read_simple_cache_index(path), (1, 1234, 1000))
+
+    def test_read_simple_cache_index_invalid(self):
+        path = os.path.join(self.root, 'the-real-index')
+        with open(path, 'wb') as f:
+            f.write(b'\0' * 64)
+
+        self.assertIsNone(read_simple_cache_index(path))
+        self.assertIsNone(read_simple_cache_index(os.path.join(self.root, 'missing')))
+
+    def test_discover_profiles(self):
+        config = os.path.join(self.root, 'config')
+        cache = os.path.join(self.root, 'cache')
+        os.makedirs(config)
+        with open(os.path.join(config, 'Local State'), 'w') as f:
+            json.dump({'profile': {'info_cache': {'Profile 1': {}, 'Default': {}}}}, f)
+        os.makedirs(os.path.join(cache, 'Profile 1', 'Cache'))
+        os.makedirs(os.path.join(cache, 'Old Profile', 'Code Cache'))
+        os.makedirs(os.path.join(config, 'Default', 'GPUCache'))
+
+        class TestPlugin(ChromeCachePlugin):
+            root_path = cache
+            config_path = config
+
+        self.assertEqual(TestPlugin._discover_profiles(), ['Default', 'Profile 1', 'Old Profile'])
+        self.assertEqual([name for name, path in TestPlugin._get_cache_items()],
+                         ['Default/GPUCache', 'Profile 1/Cache', 'Old Profile/Code Cache'])
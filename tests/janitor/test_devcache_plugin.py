@@ -0,0 +1,86 @@
+import os
+import shutil
+import stat
+import tempfile
+import time
+import unittest
+
+import mock
+
+from ubuntucleaner.janitor.devcache_plugin import DeveloperCachePlugin, load_catalogue
+from tests.janitor.helpers import AgedFilesMixin
+
+CATALOGUE = '''
+[Go modules]
+paths = $UC_TEST_UNSET/mod:%(root)s/go/pkg/mod
+pattern = cache/download:*.*
+max_age_days = 30
+
+[Bazel]
+paths = %(root)s/bazel
+pattern = *
+exclude = install
+skip_if = server/server.pid.txt
+
+[Outside]
+paths = /tmp
+'''
+
+
+class TestDeveloperCachePlugin(AgedFilesMixin, unittest.TestCase):
+    def setUp(self):
+        # The caches must be below the home directory, use a temporary one.
+        self.home = tempfile.mkdtemp()
+        self.home_patcher = mock.patch.dict(os.environ, {'HOME': self.home})
+        self.home_patcher.start()
+        self.root = tempfile.mkdtemp(dir=self.home)
+        self.now = time.time()
+        self.catalogue = os.path.join(self.root, 'devcaches.ini')
+        with open(self.catalogue, 'w') as f:
+            f.write(CATALOGUE % {'root': self.root})
+
+    def tearDown(self):
+        for directory, dirs, files in os.walk(self.root):
+            os.chmod(directory, 0o755)
+        self.home_patcher.stop()
+        shutil.rmtree(self.home)
+
+    def test_load_catalogue(self):
+        override = os.path.join(self.root, 'override.ini')
+        with open(override, 'w') as f:
+            f.write('[Bazel]\npaths = ~/bazel\n')
+
+        entries = load_catalogue([self.catalogue, override, os.path.join(self.root, 'missing.ini')])
+
+        self.assertEqual([entry.name for entry in entries], ['Go modules', 'Bazel', 'Outside'])
+        self.assertEqual(entries[0].patterns, ['cache/download', '*.*'])
+        self.assertEqual(entries[0].max_age_days, 30)
+        self.assertEqual(entries[1].paths, ['~/bazel'])
+
+    def test_get_cruft_and_clean(self):
+        self._write('go/pkg/mod/cache/download/golang.org/x/text/@v/v0.3.0.zip', 40)
+        module = os.path.dirname(self._write('go/pkg/mod/golang.org/x/text@v0.3.0/LICENSE', 40))
+        self._write('go/pkg/mod/github.com/recent/mod@v1.0.0/LICENSE', 1)
+        self._write('bazel/install/a/bazel', 40)
+        self._write('bazel/1234/server/server.pid.txt')
+        self._write('bazel/5678/execroot/out', 40)
+        # Go modules are read-only.
+        os.chmod(module, stat.S_IRUSR | stat.S_IXUSR)
+
+        with mock.patch.object(DeveloperCachePlugin, 'catalogue_paths', (self.catalogue,)):
+            plugin = DeveloperCachePlugin()
+            with mock.patch.object(plugin, 'emit') as emit:
+                plugin.get_cruft()
+
+            crufts = [call[0][1] for call in emit.call_args_list if call[0][0] == 'find_object']
+            self.assertEqual([cruft.get_name().split(' (')[0] for cruft in crufts],
+                             ['Go modules: cache/download', 'Go modules: golang.org', 'Bazel: 5678'])
+
+            plugin.clean_cruft(crufts)
+            self.assertFalse(os.path.exists(os.path.join(self.root, 'go/pkg/mod/golang.org')))
+            self.assertTrue(os.path.exists(os.path.join(self.root, 'go/pkg/mod/github.com')))
+            self.assertTrue(os.path.exists(os.path.join(self.root, 'bazel/1234')))
+
+
+if __name__ == '__main__':
+    unittest.main()
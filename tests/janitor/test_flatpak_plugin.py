@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from ubuntucleaner.janitor.flatpak_plugin import FlatpakCachePlugin
+
+
+class TestFlatpakCachePlugin(unittest.TestCase):
+    def setUp(self):
+        self.base = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.base)
+
+    def _deploy(self, kind, ref, metadata, files=None):
+        ref_id, arch, branch = ref.split('/')
+        commit = os.path.join(self.base, kind, ref_id, arch, branch, 'abc123')
+        os.makedirs(os.path.join(commit, 'files'))
+        os.symlink('abc123', os.path.join(self.base, kind, ref_id, arch, branch, 'active'))
+        with open(os.path.join(commit, 'metadata'), 'w') as f:
+            f.write(metadata)
+        for name, content in (files or {}).items():
+            with open(os.path.join(commit, 'files', name), 'w') as f:
+                f.write(content)
+        return os.path.join(commit, 'files')
+
+    def test_find_unused_runtimes(self):
+        self._deploy('app', 'org.example.App/x86_64/stable',
+                     '[Application]\nname=org.example.App\n'
+                     'runtime=org.gnome.Platform/x86_64/45\n'
+                     '[Extension org.example.App.Locale]\ndirectory=share/runtime/locale\n')
+        self._deploy('runtime', 'org.gnome.Platform/x86_64/45',
+                     '[Runtime]\nname=org.gnome.Platform\n'
+                     '[Extension org.freedesktop.Platform.GL]\nversions=23.08;23.08-extra\n'
+                     'subdirectories=true\n')
+        self._deploy('runtime', 'org.example.App.Locale/x86_64/stable', '[Runtime]\n')
+        self._deploy('runtime', 'org.freedesktop.Platform.GL.default/x86_64/23.08', '[Runtime]\n')
+        self._deploy('runtime', 'org.gnome.Platform/x86_64/43', '[Runtime]\nname=org.gnome.Platform\n'
+                     '[Extension org.gnome.Platform.Locale]\n')
+        self._deploy('runtime', 'org.gnome.Platform.Locale/x86_64/43', '[Runtime]\n')
+
+        unused = FlatpakCachePlugin._find_unused_runtimes([('user', self.base)])
+
+        self.assertEqual([ref for installation, ref, path in unused],
+                         [('org.gnome.Platform', 'x86_64', '43'),
+                          ('org.gnome.Platform.Locale', 'x86_64', '43')])
+
+    def test_pinned_runtime_is_used(self):
+        self._deploy('runtime', 'org.gnome.Sdk/x86_64/45', '[Runtime]\nname=org.gnome.Sdk\n')
+        os.makedirs(os.path.join(self.base, 'repo'))
+        with open(os.path.join(self.base, 'repo', 'config'), 'w') as f:
+            f.write('[core]\nxa.pinned=runtime/org.gnome.Sdk/x86_64/45;\n')
+
+        self.assertEqual(FlatpakCachePlugin._find_unused_runtimes([('user', self.base)]), [])
+
+    def test_unreadable_deployments(self):
+        self._deploy('runtime', 'org.gnome.Platform/x86_64/45', '[Runtime]\n')
+        self._deploy('runtime', 'org.gnome.Sdk/x86_64/45', '[Runtime]\n')
+        listdir = os.listdir
+        unreadable = os.path.join(self.base, 'runtime', 'org.gnome.Sdk', 'x86_64')
+
+        def guarded_listdir(path):
+            if path == unreadable:
+                raise PermissionError(path)
+            return listdir(path)
+
+        with mock.patch('ubuntucleaner.janitor.flatpak_plugin.os.listdir', side_effect=guarded_listdir):
+            unused = FlatpakCachePlugin._find_unused_runtimes([('user', self.base),
+                                                               ('system', os.path.join(self.base, 'missing'))])
+
+        self.assertEqual([ref for installation, ref, path in unused], [('org.gnome.Platform', 'x86_64', '45')])
+
+    def test_get_cruft_counts_shared_files_once(self):
+        self._deploy('app', 'org.example.App/x86_64/stable',
+                     '[Application]\nname=org.example.App\nruntime=org.gnome.Platform/x86_64/45\n')
+        used = self._deploy('runtime', 'org.gnome.Platform/x86_64/45', '[Runtime]\n')
+        unused = self._deploy('runtime', 'org.gnome.Platform/x86_64/43', '[Runtime]\n',
+                              {'own': 'x' * 10, 'shared': 'x' * 100})
+        objects = os.path.join(self.base, 'repo', 'objects')
+        os.makedirs(objects)
+        os.link(os.path.join(unused, 'own'), os.path.join(objects, 'own.file'))
+        os.link(os.path.join(unused, 'shared'), os.path.join(objects, 'shared.file'))
+        os.link(os.path.join(unused, 'shared'), os.path.join(used, 'shared'))
+
+        plugin = FlatpakCachePlugin()
+        with mock.patch.object(FlatpakCachePlugin, '_discover_cache_paths', return_value=[]), \
+                mock.patch.object(FlatpakCachePlugin, '_discover_installations',
+                                  return_value=[('user', self.base)]), \
+                mock.patch.object(plugin, 'emit') as emit:
+            plugin.get_cruft()
+
+        runtime = emit.call_args_list[0][0][1]
+        self.assertEqual(runtime.get_ref(), 'runtime/org.gnome.Platform/x86_64/43')
+        # The metadata file and the file only linked from the repo.
+        self.assertEqual(runtime.get_size(), len('[Runtime]\n') + 10)
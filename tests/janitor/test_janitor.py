@@ -3,7 +3,8 @@ import unittest
 from gi.repository import Gtk
 
 import mock
-from ubuntucleaner.janitor import JanitorPage
+from ubuntucleaner.gui.gtk import dispatcher
+from ubuntucleaner.janitor import CacheColumns, CruftObject, JanitorPage
 
 
 class TestJanitorPage(unittest.TestCase):
@@ -20,3 +21,58 @@ class TestJanitorPage(unittest.TestCase):
 
         m_set_busy.assert_called_once_with()
         m_do_real_clean_task.assert_called_once_with()
+
+    def test_stopped_scan_drops_late_signals(self):
+        plugin = mock.Mock()
+        plugin.get_property.return_value = False
+        self.janitor_page._next_scan_task = mock.Mock()
+
+        with mock.patch.object(dispatcher, 'post', side_effect=lambda func, *args, **kwargs: func(*args, **kwargs)), \
+                mock.patch.object(self.janitor_page, 'result_model') as result_model, \
+                mock.patch.object(self.janitor_page, 'janitor_model'):
+            result_model.get_plugin_path.return_value = None
+            self.janitor_page._on_scan_stopped(plugin, None)
+            self.janitor_page.on_find_object(plugin, CruftObject('late'), 1, (None, None))
+            self.janitor_page.on_scan_finished(plugin, True, 1, 10, (None, None))
+
+        result_model.append_cruft.assert_not_called()
+        self.assertEqual(self.janitor_page._total_count, 0)
+        self.janitor_page._next_scan_task.assert_called_once_with()
+
+
+    def test_scan_tasks_run_side_by_side(self):
+        plugins = [mock.Mock(get_setting=mock.Mock(return_value=False)) for index in range(3)]
+        rows = dict((index, {JanitorPage.JANITOR_PLUGIN: plugin}) for index, plugin in enumerate(plugins))
+        self.janitor_page.max_scan_tasks = 2
+        self.janitor_page.scan_tasks = [(index, True) for index in rows]
+
+        with mock.patch.object(self.janitor_page, 'janitor_model') as janitor_model, \
+                mock.patch.object(self.janitor_page, 'result_model'), \
+                mock.patch.object(self.janitor_page, 'janitor_view'), \
+                mock.patch.object(self.janitor_page, '_set_spinner_active'), \
+                mock.patch.object(self.janitor_page, '_new_task_thread') as new_task_thread, \
+                mock.patch('ubuntucleaner.janitor.GObject.timeout_add'):
+            janitor_model.__getitem__.side_effect = rows.__getitem__
+            self.janitor_page.do_scan_task()
+
+            self.assertEqual([call[0][0] for call in new_task_thread.call_args_list], plugins[:2])
+            self.assertEqual(self.janitor_page.scan_tasks, [(2, True)])
+
+            plugins[0].get_property.return_value = True
+            self.assertFalse(self.janitor_page._on_spinner_timeout(0, None))
+            self.assertEqual([call[0][0] for call in new_task_thread.call_args_list], plugins)
+
+
+class TestCacheColumns(unittest.TestCase):
+    def test_append(self):
+        columns = CacheColumns()
+        first = columns.append('/var/cache/apt/archives/a.deb', '10')
+        second = columns.append('/var/cache/apt/archives/b.deb', 20)
+
+        self.assertEqual(len(columns), 2)
+        self.assertEqual(columns.get_total_size(), 30)
+        self.assertEqual(first.get_name(), 'a.deb')
+        self.assertEqual(second.get_path(), '/var/cache/apt/archives/b.deb')
+        self.assertEqual(first.get_size(), 10)
+        self.assertIs(columns.dirs[0], columns.dirs[1])
+        self.assertFalse(hasattr(first, '__dict__'))
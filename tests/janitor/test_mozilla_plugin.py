@@ -1,8 +1,12 @@
+import math
 import os
+import shutil
+import tempfile
 import unittest
 
 import mock
-from ubuntucleaner.janitor.mozilla_plugin import FirefoxCachePlugin
+from ubuntucleaner.janitor.mozilla_plugin import (INDEX_HEADER, INDEX_RECORDS, CacheIndexEntry,
+                                                  FirefoxCachePlugin, read_cache_index)
 
 
 class TestMozillaCachePlugin(unittest.TestCase):
@@ -22,3 +26,93 @@ class TestMozillaCachePlugin(unittest.TestCase):
             os.path.expanduser('~/.mozilla/firefox/5tzbwjwa.default'),
             self.firefox_plugin.get_path()
         )
+
+
+class TestMozillaProfileDiscovery(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.app_path = os.path.join(self.root, 'app')
+        self.cache_path = os.path.join(self.root, 'cache')
+        os.makedirs(self.app_path)
+        for profile in ('b.default', 'a.other'):
+            os.makedirs(os.path.join(self.cache_path, profile, 'cache2'))
+        with open(os.path.join(self.app_path, 'profiles.ini'), 'w') as f:
+            f.write('[Profile0]\nPath=b.default\nIsRelative=1\n')
+
+        class TestPlugin(FirefoxCachePlugin):
+            app_path = self.app_path
+            cache_path = self.cache_path
+
+        self.plugin = TestPlugin
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_discover_cache_roots(self):
+        self.assertEqual(self.plugin._discover_cache_roots(),
+                         [os.path.join(self.cache_path, 'b.default'),
+                          os.path.join(self.cache_path, 'a.other')])
+
+    def test_discover_cache_roots_is_memoised(self):
+        self.plugin._discover_cache_roots()
+        with mock.patch.object(self.plugin, '_do_discover_cache_roots') as mocked_discover:
+            self.plugin._discover_cache_roots()
+            self.assertFalse(mocked_discover.called)
+
+            os.utime(os.path.join(self.app_path, 'profiles.ini'), ns=(0, 0))
+            self.plugin._discover_cache_roots()
+            self.assertTrue(mocked_discover.called)
+
+    def test_get_path_does_not_compute_size(self):
+        with mock.patch.object(self.plugin, 'measure_path') as mocked_size:
+            self.assertEqual(self.plugin.get_path(), os.path.join(self.cache_path, 'b.default'))
+        self.assertFalse(mocked_size.called)
+
+
+class TestMozillaCacheIndex(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.index_path = os.path.join(self.root, 'index')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _write_index(self, records, version=10):
+        with open(self.index_path, 'wb') as f:
+            f.write(INDEX_HEADER.pack(version, 0, 0, 0))
+            for key, frecency, flags in records:
+                f.write(INDEX_RECORDS[version].pack(key, frecency, 0, 0, 0, 0, flags))
+            f.write(b'\0' * 4)
+
+    def test_read_cache_index(self):
+        self._write_index([
+            (b'\x01' * 20, 100, 0x80000000 | 2),
+            (b'\x02' * 20, 200, 0x80000000 | 0x20000000 | 3),
+            (b'\x03' * 20, 300, 0x80000000 | 0x04000000 | 4),
+            (b'\x04' * 20, 400, 5),
+        ])
+
+        self.assertEqual(read_cache_index(self.index_path), [
+            CacheIndexEntry('01' * 20, 100, 2048, False),
+            CacheIndexEntry('03' * 20, 300, 4096, True),
+        ])
+
+    def test_read_cache_index_unknown_version(self):
+        self._write_index([(b'\x01' * 20, 100, 0x80000000 | 2)])
+        with open(self.index_path, 'r+b') as f:
+            f.write(INDEX_HEADER.pack(99, 0, 0, 0))
+
+        self.assertIsNone(read_cache_index(self.index_path))
+
+    def test_select_cache_entries(self):
+        now = 1000 * 24 * 60 * 60
+        day = 24 * 60 * 60
+        old = CacheIndexEntry('OLD', int((now - 40 * day) * math.log(2)), 10, False)
+        warm = CacheIndexEntry('WARM', int((now - 5 * day) * math.log(2)), 30, False)
+        hot = CacheIndexEntry('HOT', int((now - day) * math.log(2)), 20, False)
+        pinned = CacheIndexEntry('PINNED', 1, 50, True)
+        entries = [hot, pinned, warm, old]
+
+        self.assertEqual(FirefoxCachePlugin._select_cache_entries(entries, 30, 0, now), [old])
+        self.assertEqual(FirefoxCachePlugin._select_cache_entries(entries, 0, 70, now), [old, warm])
+        self.assertEqual(FirefoxCachePlugin._select_cache_entries(entries, 30, 80, now), [old, warm])
@@ -0,0 +1,50 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import mock
+
+from ubuntucleaner.janitor.nodemodules_plugin import NodeModulesPlugin
+from tests.janitor.helpers import AgedFilesMixin
+
+
+class TestNodeModulesPlugin(AgedFilesMixin, unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.now = time.time()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_get_node_modules_cruft(self):
+        self._write('old/package.json', 40)
+        self._write('old/yarn.lock', 35)
+        shared = self._write('old/node_modules/left-pad/index.js')
+        self._write('old/node_modules/dep/node_modules/nested/package.json')
+        self._write('new/packages/app/package.json', 1)
+        self._write('new/packages/app/node_modules/right-pad/index.js')
+        os.link(shared, os.path.join(self.root, 'new/packages/app/node_modules/left-pad.js'))
+        stored = self._write('old/node_modules/.pnpm/lodash/index.js')
+        os.link(stored, os.path.join(self.root, 'store-index.js'))
+
+        with mock.patch.object(NodeModulesPlugin, 'get_setting', return_value=self.root):
+            plugin = NodeModulesPlugin()
+            crufts = plugin._get_node_modules_cruft(0)
+
+            self.assertEqual([cruft.get_path() for cruft in crufts],
+                             [os.path.join(self.root, 'old', 'node_modules'),
+                              os.path.join(self.root, 'new', 'packages', 'app', 'node_modules')])
+            # The hardlink is only counted for the recent project, the one
+            # into the store not at all.
+            self.assertEqual([cruft.get_size() for cruft in crufts], [4, 8])
+
+            crufts = plugin._get_node_modules_cruft(self.now - 30 * 86400)
+            self.assertEqual(len(crufts), 1)
+            self.assertIn(time.strftime('%Y-%m-%d', time.localtime(self.now - 35 * 86400)),
+                          crufts[0].get_name())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import base64
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from ubuntucleaner.janitor.npm_plugin import NPMCachePlugin, get_cacache_content_path
+
+
+class TestNPMCachePlugin(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.cache = os.path.join(self.root, '_cacache')
+        self.now = time.time()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _add(self, key, data, age_days, bucket='aa'):
+        digest = hashlib.sha512(data).digest()
+        integrity = 'sha512-' + base64.b64encode(digest).decode()
+        blob = get_cacache_content_path(self.cache, integrity)
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        with open(blob, 'wb') as f:
+            f.write(data)
+
+        entry = json.dumps({'key': key, 'integrity': integrity,
+                            'time': (self.now - age_days * 86400) * 1000, 'size': len(data)})
+        bucket_dir = os.path.join(self.cache, 'index-v5', bucket[:2])
+        os.makedirs(bucket_dir, exist_ok=True)
+        with open(os.path.join(bucket_dir, bucket), 'a') as f:
+            f.write('%s\t%s\n' % (hashlib.sha1(entry.encode()).hexdigest(), entry))
+        return blob
+
+    def test_get_cacache_eviction(self):
+        old = self._add('old', b'old content', 40, 'aa')
+        shared = self._add('old-shared', b'shared', 40, 'aa')
+        self._add('new-shared', b'shared', 1, 'bb')
+        new = self._add('new', b'new content', 1, 'bb')
+
+        plugin = NPMCachePlugin()
+        cruft = plugin._get_cacache_eviction(self.cache, 30, now=self.now)
+
+        self.assertEqual(cruft.get_entries(), [old])
+        self.assertEqual(cruft.get_size(), len(b'old content'))
+        self.assertEqual(cruft.get_buckets(), [os.path.join(self.cache, 'index-v5', 'aa', 'aa')])
+
+        plugin._evict_cacache(cruft)
+
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(shared))
+        self.assertTrue(os.path.exists(new))
+        self.assertIsNone(plugin._get_cacache_eviction(self.cache, 30, now=self.now))
+
+    def test_evict_cacache_keeps_new_entries(self):
+        old = self._add('old', b'old content', 40, 'aa')
+        reused = self._add('old-reused', b'reused', 40, 'aa')
+
+        plugin = NPMCachePlugin()
+        cruft = plugin._get_cacache_eviction(self.cache, 30, now=self.now)
+        self.assertEqual(sorted(cruft.get_entries()), sorted([old, reused]))
+
+        # Written by npm between the scan and the clean.
+        self._add('new', b'new content', 0, 'aa')
+        self._add('new-reused', b'reused', 0, 'bb')
+        plugin._evict_cacache(cruft)
+
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(reused))
+        with open(os.path.join(self.cache, 'index-v5', 'aa', 'aa')) as f:
+            self.assertEqual([json.loads(line.split('\t', 1)[1])['key'] for line in f], ['new'])
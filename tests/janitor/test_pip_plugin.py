@@ -0,0 +1,66 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from ubuntucleaner.janitor import CacheEntriesObject
+from ubuntucleaner.janitor.pip_plugin import PipCachePlugin
+from tests.janitor.helpers import AgedFilesMixin
+
+
+class TestPipCachePlugin(AgedFilesMixin, unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.now = time.time()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_get_category_cruft_keeps_recent_files(self):
+        old = self._write('wheels/a/old.whl', 40)
+        self._write('wheels/b/new.whl', 1)
+
+        plugin = PipCachePlugin()
+        path = os.path.join(self.root, 'wheels')
+        crufts = plugin._get_category_cruft('pip/wheels', path, False, self.now - 30 * 86400)
+
+        self.assertEqual(len(crufts), 1)
+        self.assertIsInstance(crufts[0], CacheEntriesObject)
+        self.assertEqual(crufts[0].get_entries(), [old])
+        self.assertEqual(crufts[0].get_size(), 4)
+
+        crufts = plugin._get_category_cruft('pip/wheels', path, False, 0)
+        self.assertEqual([cruft.get_size() for cruft in crufts], [8])
+
+    def test_get_category_cruft_per_directory(self):
+        self._write('virtualenvs/old-py3.10/lib/site.py', 40)
+        self._write('virtualenvs/new-py3.12/lib/site.py', 1)
+
+        plugin = PipCachePlugin()
+        path = os.path.join(self.root, 'virtualenvs')
+        crufts = plugin._get_category_cruft('pypoetry/virtualenvs', path, True, self.now - 30 * 86400)
+
+        self.assertEqual([cruft.get_path() for cruft in crufts],
+                         [os.path.join(path, 'old-py3.10')])
+
+    def test_get_remainder_cruft(self):
+        self._write('wheels/a/old.whl', 40)
+        self._write('cache/repositories/pypi/index.json', 40)
+        other = self._write('cache/other/data', 40)
+        selfcheck = self._write('selfcheck.json', 1)
+
+        plugin = PipCachePlugin()
+        plugin.categories = ((self.root, 'wheels', False),
+                             (self.root, 'cache/repositories', False))
+
+        cruft = plugin._get_remainder_cruft(self.root, 0)
+        self.assertIsInstance(cruft, CacheEntriesObject)
+        self.assertEqual(cruft.get_entries(), [other, selfcheck])
+
+        cruft = plugin._get_remainder_cruft(self.root, self.now - 30 * 86400)
+        self.assertEqual(cruft.get_entries(), [other])
+
+
+if __name__ == '__main__':
+    unittest.main()
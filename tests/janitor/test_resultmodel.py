@@ -0,0 +1,72 @@
+import unittest
+
+import mock
+
+from ubuntucleaner.janitor import CruftObject
+from ubuntucleaner.janitor.resultmodel import ResultGroup, ResultModel
+
+
+class TestResultGroup(unittest.TestCase):
+    def setUp(self):
+        self.crufts = [CruftObject('cruft%d' % index) for index in range(5)]
+        self.group = ResultGroup(1, None, 'Plugin', '<b>Plugin</b>')
+        for cruft in self.crufts:
+            self.group.append(cruft)
+
+    def test_set_checked(self):
+        self.group.set_checked(1, True)
+        self.group.set_checked(3, True)
+        self.group.set_checked(3, True)
+
+        self.assertEqual(self.group.n_checked, 2)
+        self.assertFalse(self.group.checked)
+        self.assertEqual(self.group.get_checked_crufts(), [self.crufts[1], self.crufts[3]])
+
+        self.group.set_all_checked(True)
+        self.assertTrue(self.group.checked)
+        self.group.set_checked(0, False)
+        self.assertFalse(self.group.checked)
+        self.assertEqual(self.group.n_checked, 4)
+
+    def test_compact(self):
+        self.group.set_all_checked(True)
+        self.group.set_checked(4, False)
+        for cruft in (self.crufts[0], self.crufts[2]):
+            self.group.pending.add(self.group.index(cruft))
+
+        self.assertEqual(self.group.compact(), [2, 0])
+        self.assertEqual(self.group.crufts, [self.crufts[1], self.crufts[3], self.crufts[4]])
+        self.assertEqual(self.group.n_checked, 2)
+        self.assertEqual(self.group.index(self.crufts[4]), 2)
+        self.assertIsNone(self.group.index(self.crufts[0]))
+
+
+class TestResultModel(unittest.TestCase):
+    def setUp(self):
+        self.plugin = object()
+        self.crufts = [CruftObject('cruft%d' % index) for index in range(5)]
+        self.model = ResultModel()
+        self.iter = self.model.append_plugin(self.plugin, 'Plugin', '<b>Plugin</b>')
+        for cruft in self.crufts:
+            self.model.append_cruft(self.plugin, cruft)
+
+    def test_compact_expanded(self):
+        self.model.set_expanded(self.iter, True)
+        for cruft in (self.crufts[1], self.crufts[3]):
+            self.model.remove_cruft(self.plugin, cruft)
+
+        with mock.patch('ubuntucleaner.janitor.resultmodel.Gtk.TreePath.new_from_indices', side_effect=tuple), \
+                mock.patch.object(self.model, 'row_deleted') as row_deleted:
+            self.model.compact()
+
+        self.assertEqual([call[0][0] for call in row_deleted.call_args_list], [(0, 3), (0, 1)])
+        self.assertEqual(self.model.get_crufts(self.iter), [self.crufts[0], self.crufts[2], self.crufts[4]])
+
+    def test_write_removed_row(self):
+        self.model.remove_plugin(self.plugin)
+
+        self.model.set_value(self.iter, ResultModel.COLUMN_DESC, '1 MB')
+        self.model.set_checked(self.iter, True)
+        self.model.append_cruft(self.plugin, CruftObject('late'))
+        self.assertEqual(self.model.get_crufts(self.iter), [])
+        self.assertFalse(self.model.has_checked())
@@ -0,0 +1,99 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+
+import mock
+
+from ubuntucleaner.janitor.rust_plugin import RustBuildCachePlugin, read_cargo_last_use
+from tests.janitor.helpers import AgedFilesMixin
+
+INDEX = 'index.crates.io-6f17d22bba15001f'
+
+
+class TestRustBuildCachePlugin(AgedFilesMixin, unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.now = time.time()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _write_database(self, crates):
+        connection = sqlite3.connect(os.path.join(self.root, '.global-cache'))
+        connection.executescript('''
+            CREATE TABLE registry_index (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL,
+                                         timestamp INTEGER NOT NULL);
+            CREATE TABLE registry_crate (registry_id INTEGER NOT NULL, name TEXT NOT NULL,
+                                         size INTEGER NOT NULL, timestamp INTEGER NOT NULL);
+            CREATE TABLE registry_src (registry_id INTEGER NOT NULL, name TEXT NOT NULL,
+                                       size INTEGER, timestamp INTEGER NOT NULL);
+            CREATE TABLE git_db (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL,
+                                 timestamp INTEGER NOT NULL);
+            CREATE TABLE git_checkout (git_id INTEGER NOT NULL, name TEXT NOT NULL,
+                                       size INTEGER, timestamp INTEGER NOT NULL);
+        ''')
+        connection.execute('INSERT INTO registry_index VALUES (1, ?, ?)', (INDEX, int(self.now)))
+        for name, age_days in crates:
+            connection.execute('INSERT INTO registry_crate VALUES (1, ?, 4, ?)',
+                               (name + '.crate', int(self.now - age_days * 86400)))
+        connection.commit()
+        connection.close()
+
+    def test_read_cargo_last_use(self):
+        self._write_database([('serde-1.0.200', 40)])
+
+        last_uses = read_cargo_last_use(os.path.join(self.root, '.global-cache'))
+
+        self.assertEqual(list(last_uses), [('registry', INDEX, 'serde-1.0.200')])
+        self.assertEqual(read_cargo_last_use(os.path.join(self.root, 'missing')), {})
+
+    def test_get_crate_cruft(self):
+        archive = self._write('registry/cache/%s/serde-1.0.200.crate' % INDEX, 1)
+        source = os.path.dirname(self._write('registry/src/%s/serde-1.0.200/src/lib.rs' % INDEX, 1))
+        self._write('registry/cache/%s/libc-0.2.150.crate' % INDEX, 1)
+        self._write('git/db/tokio-0123456789abcdef/HEAD', 40)
+        self._write('git/checkouts/tokio-0123456789abcdef/abc1234/Cargo.toml', 40)
+        # The database knows better than the file times.
+        self._write_database([('serde-1.0.200', 40)])
+
+        plugin = RustBuildCachePlugin()
+        crufts = plugin._get_crate_cruft(self.root, self.now - 30 * 86400)
+
+        self.assertEqual(len(crufts), 2)
+        self.assertTrue(crufts[0].get_name().startswith('tokio (git, last used'))
+        self.assertEqual(crufts[0].get_size(), 8)
+        self.assertTrue(crufts[1].get_name().startswith('serde 1.0.200 (index.crates.io, last used'))
+        self.assertEqual(crufts[1].get_paths(), [archive, os.path.dirname(source)])
+
+        plugin.clean_cruft(crufts)
+        self.assertFalse(os.path.exists(archive))
+        self.assertFalse(os.path.exists(os.path.dirname(source)))
+        self.assertEqual(len(plugin._get_crate_cruft(self.root, 0)), 1)
+
+    def test_get_target_cruft(self):
+        self._write('src/old/Cargo.toml', 40)
+        self._write('src/old/target/CACHEDIR.TAG', 40)
+        self._write('src/old/target/debug/old', 40)
+        self._write('src/group/new/Cargo.toml', 1)
+        self._write('src/group/new/target/CACHEDIR.TAG', 1)
+        # Not created by cargo, never offered.
+        self._write('src/other/Cargo.toml', 40)
+        self._write('src/other/target/data', 40)
+
+        with mock.patch.object(RustBuildCachePlugin, 'get_setting',
+                               return_value=os.path.join(self.root, 'src')):
+            plugin = RustBuildCachePlugin()
+            crufts = plugin._get_target_cruft(0)
+            self.assertEqual([cruft.get_path() for cruft in crufts],
+                             [os.path.join(self.root, 'src', project, 'target') for project in ('group/new', 'old')])
+
+            crufts = plugin._get_target_cruft(self.now - 30 * 86400)
+            self.assertEqual(len(crufts), 1)
+            self.assertEqual(crufts[0].get_size(), 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
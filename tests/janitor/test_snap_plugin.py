@@ -0,0 +1,69 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+from ubuntucleaner.janitor.snap_plugin import SnapCachePlugin, SnapRevisionObject
+
+
+class TestSnapCachePlugin(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.snaps_dir = os.path.join(self.root, 'snaps')
+        self.mount_dir = os.path.join(self.root, 'snap')
+        os.makedirs(self.snaps_dir)
+        os.makedirs(self.mount_dir)
+
+        for name, size in (('core_100.snap', 10), ('core_101.snap', 20),
+                           ('firefox_5.snap', 30), ('firefox_6.snap', 40)):
+            with open(os.path.join(self.snaps_dir, name), 'wb') as f:
+                f.write(b'x' * size)
+        os.makedirs(os.path.join(self.snaps_dir, 'partial'))
+
+        self.patchers = [
+            mock.patch.object(SnapCachePlugin, 'snaps_dir', self.snaps_dir),
+            mock.patch.object(SnapCachePlugin, 'snap_mount_dir', self.mount_dir),
+            mock.patch.object(SnapCachePlugin, 'snapd_state', os.path.join(self.root, 'state.json')),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        shutil.rmtree(self.root)
+
+    def test_find_disabled_revisions_from_state(self):
+        with open(os.path.join(self.root, 'state.json'), 'w') as f:
+            json.dump({'data': {'snaps': {'core': {'current': '101'},
+                                          'firefox': {'current': '6'}}}}, f)
+
+        self.assertEqual(
+            [(name, revision, size) for name, revision, path, size in SnapCachePlugin._find_disabled_revisions()],
+            [('core', '100', 10), ('firefox', '5', 30)]
+        )
+
+    def test_find_disabled_revisions_from_mount_dir(self):
+        os.makedirs(os.path.join(self.mount_dir, 'core'))
+        os.symlink('100', os.path.join(self.mount_dir, 'core', 'current'))
+
+        self.assertEqual(
+            [(name, revision) for name, revision, path, size in SnapCachePlugin._find_disabled_revisions()],
+            [('core', '101')]
+        )
+
+    def test_remove_revisions_goes_on_after_a_failure(self):
+        revisions = [SnapRevisionObject('%s (revision %s)' % (name, revision), name, revision,
+                                        os.path.join(self.snaps_dir, '%s_%s.snap' % (name, revision)), 10)
+                     for name, revision in (('core', '100'), ('firefox', '5'))]
+
+        plugin = SnapCachePlugin()
+        with mock.patch('ubuntucleaner.janitor.snap_plugin.proxy') as proxy, \
+                mock.patch.object(plugin, 'emit') as emit:
+            proxy.remove_snap_revisions.side_effect = lambda keys, timeout: [] if keys == ['core_100'] else keys
+            plugin._remove_revisions(revisions, 0)
+
+        emit.assert_has_calls([mock.call('clean_error', 'core (revision 100)'),
+                               mock.call('object_cleaned', revisions[1], 2)])
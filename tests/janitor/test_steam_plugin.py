@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from ubuntucleaner.janitor.steam_plugin import SteamCachePlugin, parse_vdf
+
+LIBRARY_FOLDERS = '''
+"libraryfolders"
+{
+    "0"
+    {
+        "path"      "%s"
+        "apps"
+        {
+            "220"   "4096"
+        }
+    }
+    "1"
+    {
+        "path"      "%s"  // second disk
+    }
+}
+'''
+
+
+class TestSteamCachePlugin(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.steam = os.path.join(self.root, 'Steam')
+        self.library = os.path.join(self.root, 'SteamLibrary')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _write(self, path, data='data'):
+        path = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(data)
+
+    def test_parse_vdf(self):
+        data = parse_vdf('"AppState" { "appid" "220" "name" "Half-Life \\"2\\"" "UserConfig" { } }')
+        self.assertEqual(data, {'appstate': {'appid': '220', 'name': 'Half-Life "2"', 'userconfig': {}}})
+
+    def test_discover_cache_paths(self):
+        self._write('Steam/steamapps/libraryfolders.vdf', LIBRARY_FOLDERS % (self.steam, self.library))
+        self._write('Steam/appcache/appinfo.vdf')
+        self._write('Steam/steamapps/appmanifest_220.acf', '"AppState" { "appid" "220" "name" "Half-Life 2" }')
+        self._write('Steam/steamapps/shadercache/220/fozpipelinesv6/steamapp.foz')
+        self._write('Steam/steamapps/compatdata/220/pfx/system.reg')
+        self._write('SteamLibrary/steamapps/downloading/440/state')
+        self._write('SteamLibrary/steamapps/temp/.keep')
+        self._write('SteamLibrary/steamapps/compatdata/440/pfx/system.reg')
+        self._write('SteamLibrary/steamapps/compatdata/3000000000/pfx/system.reg')
+
+        with mock.patch.object(SteamCachePlugin, 'cache_roots', (self.steam,)), \
+                mock.patch.object(SteamCachePlugin, 'get_setting', return_value=True):
+            self.assertEqual(SteamCachePlugin._discover_libraries(), [self.steam, self.library])
+            self.assertEqual([name for name, path in SteamCachePlugin._discover_cache_paths()],
+                             ['appcache',
+                              'shadercache/Half-Life 2',
+                              'temp (%s)' % self.library,
+                              'downloading (%s)' % self.library,
+                              'compatdata/440 (not installed)'])
+
+            plugin = SteamCachePlugin()
+            with mock.patch.object(plugin, 'emit') as emit:
+                plugin.get_cruft()
+            emit.assert_called_with('scan_finished', True, 5, 20)
+
+
+if __name__ == '__main__':
+    unittest.main()
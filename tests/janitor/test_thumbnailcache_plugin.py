@@ -0,0 +1,90 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import zlib
+
+import mock
+from ubuntucleaner.janitor.thumbnailcache_plugin import ThumbnailCachePlugin, read_png_text
+from ubuntucleaner.utils.files import Cancellable, Cancelled
+
+
+def write_png(path, texts):
+    def chunk(chunk_type, data):
+        return struct.pack('>I', len(data)) + chunk_type + data + \
+            struct.pack('>I', zlib.crc32(chunk_type + data))
+
+    data = b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', 1, 1, 8, 6, 0, 0, 0))
+    for key, value in texts.items():
+        data += chunk(b'tEXt', key.encode('latin-1') + b'\0' + value.encode('latin-1'))
+    data += chunk(b'IDAT', zlib.compress(b'\0\0\0\0\0')) + chunk(b'IEND', b'')
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+class TestThumbnailCachePlugin(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.thumbnails = os.path.join(self.root, 'thumbnails')
+        self.sources = os.path.join(self.root, 'my files')
+        os.makedirs(os.path.join(self.thumbnails, 'normal'))
+        os.makedirs(os.path.join(self.thumbnails, 'large'))
+        os.makedirs(self.sources)
+
+        self.patchers = [
+            mock.patch.object(ThumbnailCachePlugin, 'root_path', self.thumbnails),
+            mock.patch.object(ThumbnailCachePlugin, 'verdict_cache', os.path.join(self.root, 'verdicts.json')),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        shutil.rmtree(self.root)
+
+    def _thumbnail(self, bucket, name, source, mtime=None):
+        path = os.path.join(self.thumbnails, bucket, name)
+        texts = {'Thumb::URI': 'file://' + source.replace(' ', '%20')}
+        if mtime is not None:
+            texts['Thumb::MTime'] = str(mtime)
+        write_png(path, texts)
+        return path
+
+    def test_read_png_text(self):
+        path = self._thumbnail('normal', 'a.png', '/tmp/a b.jpg', 42)
+
+        self.assertEqual(read_png_text(path), {'Thumb::URI': 'file:///tmp/a%20b.jpg', 'Thumb::MTime': '42'})
+        self.assertEqual(read_png_text(os.path.join(self.root, 'missing.png')), {})
+
+    def test_get_stale_cruft(self):
+        kept_source = os.path.join(self.sources, 'kept.jpg')
+        changed_source = os.path.join(self.sources, 'changed.jpg')
+        for source in (kept_source, changed_source):
+            open(source, 'w').close()
+            os.utime(source, (100, 100))
+
+        self._thumbnail('normal', 'kept.png', kept_source, 100)
+        changed = self._thumbnail('normal', 'changed.png', changed_source, 50)
+        missing = self._thumbnail('large', 'missing.png', os.path.join(self.sources, 'missing.jpg'), 100)
+
+        plugin = ThumbnailCachePlugin()
+        for run in range(2):
+            with mock.patch.object(ThumbnailCachePlugin, 'emit') as mocked_emit:
+                plugin.get_stale_cruft()
+
+            crufts = [call[0][1] for call in mocked_emit.call_args_list if call[0][0] == 'find_object']
+            self.assertEqual([cruft.get_entries() for cruft in crufts], [[missing], [changed]])
+            mocked_emit.assert_called_with('scan_finished', True, 2, mock.ANY)
+
+    def test_get_stale_cruft_stopped(self):
+        self._thumbnail('normal', 'a.png', os.path.join(self.sources, 'a.jpg'), 100)
+
+        plugin = ThumbnailCachePlugin()
+        cancellable = Cancellable()
+        cancellable.cancel()
+        plugin.set_cancellable(cancellable)
+        with mock.patch.object(ThumbnailCachePlugin, 'emit') as mocked_emit:
+            self.assertRaises(Cancelled, plugin.get_stale_cruft)
+        mocked_emit.assert_not_called()
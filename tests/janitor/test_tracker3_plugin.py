@@ -0,0 +1,76 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import mock
+
+from ubuntucleaner.janitor.tracker3_plugin import Tracker3CachePlugin, get_sqlite_free_size
+
+
+class TestTracker3CachePlugin(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.miner = os.path.join(self.root, 'tracker3', 'files')
+        os.makedirs(self.miner)
+        self.database = os.path.join(self.miner, 'meta.db')
+
+        connection = sqlite3.connect(self.database)
+        connection.execute('CREATE TABLE resource (data BLOB)')
+        connection.executemany('INSERT INTO resource VALUES (?)', [(b'x' * 4000,)] * 100)
+        connection.commit()
+        connection.execute('DELETE FROM resource')
+        connection.commit()
+        connection.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_get_sqlite_free_size(self):
+        self.assertGreater(get_sqlite_free_size(self.database), 100 * 4000 * 0.9)
+        self.assertEqual(get_sqlite_free_size(os.path.join(self.root, 'missing.db')), 0)
+
+    def test_compact_and_delete(self):
+        with mock.patch.object(Tracker3CachePlugin, 'cache_paths', ()), \
+                mock.patch.object(Tracker3CachePlugin, 'database_roots', (os.path.dirname(self.miner),)), \
+                mock.patch.object(Tracker3CachePlugin, '_get_active_miners', return_value=['miner.service']), \
+                mock.patch.object(Tracker3CachePlugin, '_control_miners') as control_miners:
+            plugin = Tracker3CachePlugin()
+            with mock.patch.object(plugin, 'emit') as emit:
+                plugin.get_cruft()
+            compact, delete = [call[0][1] for call in emit.call_args_list if call[0][0] == 'find_object']
+            self.assertEqual(compact.get_name(), 'tracker3/files (compact databases)')
+            self.assertEqual(delete.get_size(), os.path.getsize(self.database))
+
+            plugin.clean_cruft([compact])
+            self.assertEqual(get_sqlite_free_size(self.database), 0)
+            control_miners.assert_has_calls([mock.call('stop', ['miner.service']),
+                                             mock.call('start', ['miner.service'])])
+
+            plugin.clean_cruft([compact, delete])
+            self.assertFalse(os.path.exists(self.miner))
+
+    def test_remainder(self):
+        root = os.path.dirname(self.miner)
+        os.makedirs(os.path.join(root, 'ontologies'))
+        with open(os.path.join(root, 'ontologies', 'cache.gvdb'), 'wb') as f:
+            f.write(b'x' * 100)
+
+        with mock.patch.object(Tracker3CachePlugin, 'cache_paths', ()), \
+                mock.patch.object(Tracker3CachePlugin, 'database_roots', (root,)), \
+                mock.patch.object(Tracker3CachePlugin, '_get_active_miners', return_value=[]):
+            plugin = Tracker3CachePlugin()
+            with mock.patch.object(plugin, 'emit') as emit:
+                plugin.get_cruft()
+            remainder = [call[0][1] for call in emit.call_args_list if call[0][0] == 'find_object'][-1]
+            self.assertEqual(remainder.get_name(), 'tracker3 (other files)')
+            self.assertEqual(remainder.get_size(), 100)
+
+            plugin.clean_cruft([remainder])
+            self.assertFalse(os.path.exists(os.path.join(root, 'ontologies')))
+            self.assertTrue(os.path.exists(self.database))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,17 @@
+import contextlib
+import itertools
+import os
+import shutil
+import tempfile
 import unittest
 
-from ubuntucleaner.utils.files import filesizeformat
+import mock
+
+from ubuntucleaner.utils.files import (FIEMAP_EXTENT_LAST, FIEMAP_EXTENT_SHARED, ROTATIONAL_WORKERS,
+                                       SOLID_STATE_WORKERS, ApproximateSize, Cancellable, Cancelled,
+                                       ExclusiveSize, device_slots, estimate_path_size, filesizeformat,
+                                       find_directories, get_device_workers, get_exclusive_size, get_path_size,
+                                       get_unshared_sizes, map_by_device, remove_path)
 
 
 class TestFilesModule(unittest.TestCase):
@@ -13,3 +24,229 @@ class TestFilesModule(unittest.TestCase):
         self.assertEqual(filesizeformat(1024), "1.0 KB")
         self.assertEqual(filesizeformat(1024**2), "1.0 MB")
         self.assertEqual(filesizeformat(1024**3), "1.0 GB")
+
+    def test_get_path_size(self):
+        root = tempfile.mkdtemp()
+        try:
+            os.makedirs(os.path.join(root, 'a', 'b'))
+            with open(os.path.join(root, 'a', 'b', 'file'), 'wb') as f:
+                f.write(b'x' * 100)
+            os.link(os.path.join(root, 'a', 'b', 'file'), os.path.join(root, 'a', 'link'))
+
+            self.assertEqual(get_path_size(os.path.join(root, 'a', 'b', 'file')), 100)
+            self.assertEqual(get_path_size(root), 200)
+            self.assertEqual(get_path_size(root, seen_inodes=set()), 100)
+            self.assertEqual(get_path_size(os.path.join(root, 'missing')), 0)
+        finally:
+            shutil.rmtree(root)
+
+    def test_get_path_size_progress(self):
+        root = tempfile.mkdtemp()
+        try:
+            for index in range(3):
+                with open(os.path.join(root, str(index)), 'wb') as f:
+                    f.write(b'x' * 10)
+
+            calls = []
+            with mock.patch('ubuntucleaner.utils.files.PROGRESS_ENTRIES', 2):
+                self.assertEqual(get_path_size(root, progress=lambda *args: calls.append(args)), 30)
+            self.assertEqual(calls, [(10, 2), (30, 3)])
+        finally:
+            shutil.rmtree(root)
+
+    def test_estimate_path_size(self):
+        root = tempfile.mkdtemp()
+        try:
+            for index in range(4):
+                os.makedirs(os.path.join(root, str(index)))
+                with open(os.path.join(root, str(index), 'file'), 'wb') as f:
+                    f.write(b'x' * 100)
+
+            size = estimate_path_size(root)
+            self.assertEqual(size, get_path_size(root))
+            self.assertNotIsInstance(size, ApproximateSize)
+
+            size = estimate_path_size(root, time_budget=-1)
+            self.assertIsInstance(size, ApproximateSize)
+            self.assertGreater(size.error, 0)
+            self.assertTrue(filesizeformat(size).startswith('~'))
+        finally:
+            shutil.rmtree(root)
+
+    def test_estimate_path_size_stops_listing_at_deadline(self):
+        root = tempfile.mkdtemp()
+        try:
+            for index in range(50):
+                with open(os.path.join(root, 'file%d' % index), 'wb') as f:
+                    f.write(b'x' * 100)
+
+            # Every clock read is one second later, 10 files fit in the budget.
+            with mock.patch('ubuntucleaner.utils.files.time.monotonic', side_effect=itertools.count()):
+                size = estimate_path_size(root, time_budget=10)
+            self.assertIsInstance(size, ApproximateSize)
+            self.assertEqual(size, 2000)
+            self.assertEqual(size.error, 2000)
+        finally:
+            shutil.rmtree(root)
+
+    def test_estimate_path_size_counts_the_wait_for_the_device(self):
+        root = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(root, 'file'), 'wb') as f:
+                f.write(b'x' * 100)
+
+            clock = [0]
+
+            @contextlib.contextmanager
+            def hold(path, cancellable=None):
+                clock[0] += 1
+                yield
+
+            with mock.patch('ubuntucleaner.utils.files.time.monotonic', side_effect=lambda: clock[0]), \
+                    mock.patch.object(device_slots, 'hold', hold):
+                size = estimate_path_size(root, time_budget=0.5)
+            self.assertIsInstance(size, ApproximateSize)
+        finally:
+            shutil.rmtree(root)
+
+    def test_get_unshared_sizes(self):
+        root = tempfile.mkdtemp()
+        try:
+            for name in ('a', 'b', 'kept'):
+                os.makedirs(os.path.join(root, name))
+            for name, size in (('single', 1), ('both', 10), ('kept', 100)):
+                with open(os.path.join(root, 'a', name), 'wb') as f:
+                    f.write(b'x' * size)
+            os.link(os.path.join(root, 'a', 'both'), os.path.join(root, 'b', 'both'))
+            os.link(os.path.join(root, 'a', 'kept'), os.path.join(root, 'kept', 'kept'))
+
+            paths = [os.path.join(root, 'a'), os.path.join(root, 'b')]
+            self.assertEqual(get_unshared_sizes(paths), [1, 10])
+            self.assertEqual(get_unshared_sizes(paths, other_links=1), [101, 10])
+        finally:
+            shutil.rmtree(root)
+
+    def test_get_exclusive_size(self):
+        root = tempfile.mkdtemp()
+        try:
+            for name in ('a', 'b', 'c'):
+                with open(os.path.join(root, name), 'wb') as f:
+                    f.write(b'x' * 100)
+
+            extents = {
+                'a': [(0, 4096, 100, FIEMAP_EXTENT_LAST)],
+                'b': [(0, 8192, 60, FIEMAP_EXTENT_SHARED), (60, 9000, 40, FIEMAP_EXTENT_LAST)],
+                'c': [(0, 8192, 60, FIEMAP_EXTENT_SHARED | FIEMAP_EXTENT_LAST)],
+            }
+
+            def iter_extents(fd):
+                return iter(extents[os.path.basename(os.readlink('/proc/self/fd/%d' % fd))])
+
+            with mock.patch('ubuntucleaner.utils.files.iter_extents', side_effect=iter_extents):
+                size = get_exclusive_size(root)
+            self.assertIsInstance(size, ExclusiveSize)
+            self.assertEqual(size, 140)
+            self.assertEqual(size.shared, 60)
+            self.assertEqual(filesizeformat(size), "140 bytes (+60 bytes shared)")
+
+            # Without FIEMAP, files count with their apparent size.
+            with mock.patch('ubuntucleaner.utils.files.iter_extents', side_effect=OSError):
+                size = get_exclusive_size(root)
+            self.assertEqual(size, 300)
+            self.assertEqual(size.shared, 0)
+        finally:
+            shutil.rmtree(root)
+
+    def test_find_directories(self):
+        root = tempfile.mkdtemp()
+        try:
+            for path in ('a/project', 'a/project/sub/nested', 'b/.git/project',
+                         'b/node_modules/project', 'c/d/e/project'):
+                os.makedirs(os.path.join(root, path))
+                open(os.path.join(root, path, 'marker'), 'w').close()
+
+            match = lambda path, names: 'marker' in names
+            self.assertEqual(find_directories([root], match),
+                             [os.path.join(root, path) for path in
+                              ('a/project', 'a/project/sub/nested', 'c/d/e/project')])
+            self.assertEqual(find_directories([root], match, max_depth=3),
+                             [os.path.join(root, 'a/project')])
+        finally:
+            shutil.rmtree(root)
+
+    def test_get_device_workers(self):
+        sys_block = tempfile.mkdtemp()
+        try:
+            os.makedirs(os.path.join(sys_block, 'sda', 'sda1'))
+            os.makedirs(os.path.join(sys_block, 'sda', 'queue'))
+            with open(os.path.join(sys_block, 'sda', 'queue', 'rotational'), 'w') as f:
+                f.write('1\n')
+
+            def realpath(path):
+                return path.replace('/sys/dev/block/8:1', os.path.join(sys_block, 'sda', 'sda1'))
+
+            with mock.patch('ubuntucleaner.utils.files.os.path.realpath', side_effect=realpath):
+                self.assertEqual(get_device_workers(os.makedev(8, 1)), ROTATIONAL_WORKERS)
+
+                with open(os.path.join(sys_block, 'sda', 'queue', 'rotational'), 'w') as f:
+                    f.write('0\n')
+                self.assertEqual(get_device_workers(os.makedev(8, 1)), SOLID_STATE_WORKERS)
+        finally:
+            shutil.rmtree(sys_block)
+
+    def test_map_by_device(self):
+        root = tempfile.mkdtemp()
+        try:
+            paths = []
+            for index in range(5):
+                paths.append(os.path.join(root, str(index)))
+                with open(paths[-1], 'wb') as f:
+                    f.write(b'x' * index)
+            paths.append(os.path.join(root, 'missing'))
+
+            self.assertEqual(map_by_device(get_path_size, paths), [0, 1, 2, 3, 4, 0])
+            self.assertEqual(map_by_device(len, [(path,) for path in paths], key=lambda item: item[0]),
+                             [1] * 6)
+
+            # A thread holding the slot of a device maps it itself.
+            with device_slots.hold(root):
+                self.assertEqual(map_by_device(get_path_size, paths, max_workers=1), [0, 1, 2, 3, 4, 0])
+        finally:
+            shutil.rmtree(root)
+
+    def test_cancellable(self):
+        root = tempfile.mkdtemp()
+        try:
+            os.makedirs(os.path.join(root, 'a'))
+            with open(os.path.join(root, 'a', 'file'), 'wb') as f:
+                f.write(b'x' * 100)
+
+            cancellable = Cancellable()
+            self.assertEqual(get_path_size(root, cancellable=cancellable), 100)
+
+            cancellable.cancel()
+            self.assertTrue(cancellable.is_cancelled())
+            self.assertRaises(Cancelled, get_path_size, root, cancellable=cancellable)
+            self.assertRaises(Cancelled, find_directories, [root], lambda path, names: True,
+                              cancellable=cancellable)
+            self.assertRaises(Cancelled, remove_path, root, cancellable)
+            self.assertTrue(os.path.exists(os.path.join(root, 'a', 'file')))
+        finally:
+            shutil.rmtree(root)
+
+    def test_remove_path(self):
+        root = tempfile.mkdtemp()
+        outside = tempfile.mkdtemp()
+        try:
+            os.makedirs(os.path.join(root, 'a', 'b'))
+            with open(os.path.join(root, 'a', 'b', 'file'), 'wb') as f:
+                f.write(b'x')
+            with open(os.path.join(outside, 'kept'), 'wb') as f:
+                f.write(b'x')
+            os.symlink(outside, os.path.join(root, 'a', 'link'))
+
+            remove_path(root)
+            self.assertFalse(os.path.exists(root))
+            self.assertTrue(os.path.exists(os.path.join(outside, 'kept')))
+        finally:
+            shutil.rmtree(outside)
@@ -2,7 +2,8 @@ import unittest
 import mock
 
 from gi.repository import Gtk, GdkPixbuf
-from ubuntucleaner.utils.icon import get_from_name, get_from_list, get_from_mime_type, get_from_file, DEFAULT_SIZE
+from ubuntucleaner.utils.icon import get_from_name, get_from_list, get_from_mime_type, get_from_file, DEFAULT_SIZE, \
+    PixbufCache, get_cached_from_name, get_from_key, pixbuf_cache
 
 
 def patch_load_icon(side_effect=None):
@@ -231,3 +232,48 @@ class TestIconModule(unittest.TestCase):
         self.assertEqual(
             m_log.method_calls, [mock.call.error('get_from_file failed: ')])
         self.assertEqual(pixbuf, m_pixbuf)
+
+    def test_pixbuf_cache(self):
+        """The least recently used pixbuf is evicted once the cache is full."""
+        cache = PixbufCache(max_size=2)
+        loader = mock.Mock(side_effect=lambda: mock.Mock(spec=GdkPixbuf.Pixbuf))
+        first = cache.get(('name', 'a', 24), loader)
+        cache.get(('name', 'b', 24), loader)
+        self.assertIs(cache.get(('name', 'a', 24), loader), first)
+        cache.get(('name', 'c', 24), loader)
+        self.assertEqual(loader.call_count, 3)
+        self.assertEqual(len(cache), 2)
+        # "b" was evicted, "a" was not.
+        cache.get(('name', 'b', 24), loader)
+        cache.get(('name', 'c', 24), loader)
+        self.assertEqual(loader.call_count, 4)
+
+    def test_get_cached_from_name(self):
+        """Only the first call for a name and size loads the icon."""
+        m_pixbuf = mock.Mock(spec=GdkPixbuf.Pixbuf)
+        pixbuf_cache.clear()
+        with patch_get_from_name() as m_get_from_name:
+            m_get_from_name.return_value = m_pixbuf
+            self.assertEqual(get_cached_from_name('folder', size=16), m_pixbuf)
+            self.assertEqual(get_cached_from_name('folder', size=16), m_pixbuf)
+            get_cached_from_name('folder', size=24)
+        pixbuf_cache.clear()
+        self.assertEqual(
+            m_get_from_name.call_args_list,
+            [mock.call('folder', alter='application-x-executable', size=16),
+             mock.call('folder', alter='application-x-executable', size=24)]
+        )
+
+    def test_get_from_key_path(self):
+        """Path keys of directories resolve to the cached folder icon."""
+        m_pixbuf = mock.Mock(spec=GdkPixbuf.Pixbuf)
+        pixbuf_cache.clear()
+        with patch_get_from_name() as m_get_from_name:
+            m_get_from_name.return_value = m_pixbuf
+            self.assertEqual(get_from_key(('path', '/', 16)), m_pixbuf)
+            self.assertEqual(get_from_key(('path', '/tmp', 16)), m_pixbuf)
+        pixbuf_cache.clear()
+        self.assertEqual(
+            m_get_from_name.call_args_list,
+            [mock.call('folder', alter='application-x-executable', size=16)]
+        )
@@ -3,6 +3,7 @@
 import fcntl
 import logging
 import os
+import re
 import subprocess
 
 import dbus
@@ -18,6 +19,7 @@ PATH = "/com/ubuntu_cleaner/daemon"
 
 class DaemonService(PolicyKitService):
     p = None
+    p_snap_revision = re.compile('^([a-z0-9][a-z0-9_-]*)_(x?[0-9]+)$')
 
     def __init__(self, bus, mainloop):
         bus_name = dbus.service.BusName(INTERFACE, bus=bus)
@@ -41,6 +43,32 @@ class DaemonService(PolicyKitService):
 
         return not os.path.exists(full_path)
 
+    @dbus.service.method(INTERFACE,
+                         in_signature='as', out_signature='as',
+                         sender_keyword='sender')
+    def remove_snap_revisions(self, revisions, sender=None):
+        '''Remove disabled snap revisions given as "<snap>_<revision>", the
+        same form as their file names in /var/lib/snapd/snaps. Returns the
+        revisions which were removed.
+        '''
+        self._check_permission(sender, PK_ACTION_CLEAN)
+
+        removed = []
+        for revision in revisions:
+            match = self.p_snap_revision.match(revision)
+            if not match:
+                log.error('Invalid snap revision: %s', revision)
+                continue
+
+            name, number = match.groups()
+            cmd = ['snap', 'remove', '--revision=%s' % number, name]
+            if subprocess.call(cmd) == 0:
+                removed.append(revision)
+            else:
+                log.error('Failed to remove snap revision: %s', revision)
+
+        return removed
+
     @dbus.service.method(INTERFACE,
                          in_signature='s', out_signature='',
                          sender_keyword='sender')
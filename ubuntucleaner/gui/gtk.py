@@ -1,6 +1,10 @@
+import time
 import logging
+import threading
 
-from gi.repository import Gdk
+from collections import deque
+
+from gi.repository import Gdk, GLib
 
 from ubuntucleaner.settings.debug import log_func
 
@@ -21,12 +25,76 @@ def unset_busy(window):
         window.set_sensitive(True)
 
 
+class UiDispatcher(object):
+    '''Run callables in the main loop on behalf of worker threads.
+
+    Workers only append to a queue, which the main loop drains from one
+    idle callback for up to batch_time seconds at a time, so a busy
+    worker never waits for the UI and the UI is never re-entered.
+    '''
+    batch_time = 0.02
+
+    def __init__(self):
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._source = None
+
+    def post(self, func, *args, **kwargs):
+        with self._lock:
+            self._queue.append((func, args, kwargs))
+            if self._source is None:
+                self._source = GLib.idle_add(self._drain)
+
+    def _drain(self):
+        deadline = time.monotonic() + self.batch_time
+        while True:
+            with self._lock:
+                if not self._queue:
+                    self._source = None
+                    return False
+                func, args, kwargs = self._queue.popleft()
+
+            try:
+                func(*args, **kwargs)
+            except Exception:
+                log.exception('Error while running %s in the main loop', func)
+
+            if time.monotonic() > deadline:
+                with self._lock:
+                    if self._queue:
+                        return True
+                    self._source = None
+                    return False
+
+
+dispatcher = UiDispatcher()
+
+
 @log_func(log)
 def post_ui(func):
+    '''Queue the calls of func to the main loop, in the order they are made,
+    whatever thread they come from. func must not block, see post_dialog.
+    '''
     def func_wrapper(*args, **kwargs):
-        Gdk.threads_enter()
-        func(*args, **kwargs)
-        Gdk.threads_leave()
+        dispatcher.post(func, *args, **kwargs)
 
     return func_wrapper
 
+
+@log_func(log)
+def post_dialog(func):
+    '''Run the calls of func in the main loop from their own idle callback,
+    for functions that run() a dialog: its nested main loop keeps draining
+    the post_ui queue instead of holding it.
+    '''
+    def idle_func(args, kwargs):
+        try:
+            func(*args, **kwargs)
+        except Exception:
+            log.exception('Error while running %s in the main loop', func)
+        return False
+
+    def func_wrapper(*args, **kwargs):
+        GLib.idle_add(idle_func, args, kwargs)
+
+    return func_wrapper
@@ -1,28 +1,42 @@
 import os
+import sys
 import glob
-import shutil
+import math
+import time
 import logging
 import threading
 
+from array import array
 from collections import OrderedDict
 
-from gi.repository import GObject, Gtk, Gdk, Pango
+from gi.repository import GLib, GObject, Gtk, Gdk, Pango
 
 from ubuntucleaner.gui import GuiBuilder
 from ubuntucleaner.gui.gtk import post_ui
+from ubuntucleaner.janitor.resultmodel import ResultModel
 from ubuntucleaner.utils import icon
-from ubuntucleaner.utils.files import filesizeformat
+from ubuntucleaner.utils.files import (REFLINK_FILESYSTEMS, Cancellable, Cancelled, as_size, estimate_path_size,
+                                       filesizeformat, get_exclusive_size, get_filesystem_type, get_path_size,
+                                       remove_path)
 from ubuntucleaner.modules import ModuleLoader
+from ubuntucleaner.settings.common import RawConfigSetting
+from ubuntucleaner.settings.constants import CONFIG_ROOT
 from ubuntucleaner.settings.debug import run_traceback, log_func
 
 log = logging.getLogger('Janitor')
 
+JANITOR_CONFIG = os.path.join(CONFIG_ROOT, 'janitor.ini')
+
 
 class CruftObject(object):
+    # Scans can find hundreds of thousands of crufts, so the cruft types
+    # have no __dict__. Subclasses list their own attributes in __slots__.
+    __slots__ = ('name', 'path', 'size')
+
     def __init__(self, name, path=None, size=0):
         self.name = name
         self.path = path
-        self.size = size
+        self.size = as_size(size)
 
     def __str__(self):
         return self.get_name()
@@ -36,31 +50,48 @@ class CruftObject(object):
     def get_size_display(self):
         return ''
 
-    def get_icon(self):
+    def is_size_estimated(self):
+        '''True if the size is an ApproximateSize of a quick scan.'''
+        return bool(getattr(getattr(self, 'size', 0), 'error', 0))
+
+    def get_icon_key(self):
+        '''Return the key of the icon, see icon.get_from_key(). The result
+        view only resolves it when the row is drawn.
+        '''
         return None
 
+    def get_icon(self):
+        key = self.get_icon_key()
+        if key is None:
+            return None
+        return icon.get_from_key(key)
+
 
 class PackageObject(CruftObject):
+    __slots__ = ('package_name',)
+
     def __init__(self, name, package_name, size):
         self.name = name
         self.package_name = package_name
-        self.size = size
+        self.size = as_size(size)
 
     def get_size_display(self):
         return filesizeformat(self.size)
 
-    def get_icon(self):
-        return icon.get_from_name('package-x-generic', alter='application-x-debian-package')
+    def get_icon_key(self):
+        return ('name', 'package-x-generic', 'application-x-debian-package', icon.DEFAULT_SIZE)
 
     def get_package_name(self):
         return self.package_name
 
 
 class CacheObject(CruftObject):
+    __slots__ = ()
+
     def __init__(self, name, path, size):
         self.name = name
         self.path = path
-        self.size = size
+        self.size = as_size(size)
 
     def get_path(self):
         return self.path
@@ -68,13 +99,80 @@ class CacheObject(CruftObject):
     def get_size_display(self):
         return filesizeformat(self.size)
 
-    def get_icon(self):
-        return icon.guess_from_path(self.get_path())
+    def get_icon_key(self):
+        return ('path', self.get_path(), icon.DEFAULT_SIZE)
 
     def is_dir(self):
         return os.path.isdir(self.path)
 
 
+class CacheEntriesObject(CacheObject):
+    '''A selection of files inside one cache directory, offered as a single
+    row so that large selections do not flood the result view.
+    '''
+
+    __slots__ = ('entries',)
+
+    def __init__(self, name, path, size, entries):
+        self.name = name
+        self.path = path
+        self.size = as_size(size)
+        self.entries = entries
+
+    def get_entries(self):
+        return self.entries
+
+
+class CacheColumns(object):
+    '''Many cache files of one plugin stored by column: the directories are
+    interned, the file names kept in a list and the sizes in an
+    array('Q'). append() returns a CacheColumnObject, a row that reads
+    its values from the columns.
+    '''
+    __slots__ = ('dirs', 'names', 'sizes')
+
+    def __init__(self):
+        self.dirs = []
+        self.names = []
+        self.sizes = array('Q')
+
+    def __len__(self):
+        return len(self.names)
+
+    def append(self, path, size):
+        dirname, name = os.path.split(path)
+        self.dirs.append(sys.intern(dirname))
+        self.names.append(name)
+        self.sizes.append(int(size))
+        return CacheColumnObject(self, len(self.names) - 1)
+
+    def get_total_size(self):
+        return sum(self.sizes)
+
+
+class CacheColumnObject(CacheObject):
+    '''A CacheObject whose name (the file name), path and size live in a
+    CacheColumns.
+    '''
+    __slots__ = ('columns', 'index')
+
+    def __init__(self, columns, index):
+        self.columns = columns
+        self.index = index
+
+    @property
+    def name(self):
+        return self.columns.names[self.index]
+
+    @property
+    def path(self):
+        return os.path.join(self.columns.dirs[self.index], self.columns.names[self.index])
+
+    @property
+    def size(self):
+        return self.columns.sizes[self.index]
+
+
 class JanitorPlugin(GObject.GObject):
     __title__ = ''
     __category__ = ''
@@ -88,6 +186,27 @@ class JanitorPlugin(GObject.GObject):
     clean_finished = GObject.property(type=bool, default=False)
     error = GObject.property(type=str, default='')
 
+    # The Cancellable of the running scan or clean, set by the janitor
+    # page. Plugins pass it to the walkers of utils.files and check it
+    # between crufts.
+    cancellable = None
+    # Seconds between two scan_progress signals while a path is measured.
+    progress_interval = 0.5
+    # Set by the janitor page from "quick_scan = true" in the section of
+    # the plugin: measure_path() then estimates every path within
+    # quick_scan_budget seconds, see estimate_path_size().
+    quick_scan = False
+    quick_scan_budget = 0.5
+    # Set by the janitor page from "exclusive_size = true": on btrfs and
+    # XFS, paths are measured by the bytes of their unshared extents, see
+    # get_exclusive_size(), instead of their apparent size.
+    exclusive_size = False
+    # Filesystem type of every device seen, see get_exact_size().
+    _filesystem_types = {}
+    # Files found by the last measure of every path, the expected work of
+    # the next one.
+    _entry_counts = {}
+
     __gsignals__ = {
         'find_object': (GObject.SignalFlags.RUN_FIRST, None, (GObject.TYPE_PYOBJECT, GObject.TYPE_INT)),
         'scan_finished': (GObject.SignalFlags.RUN_FIRST, None,
@@ -98,6 +217,10 @@ class JanitorPlugin(GObject.GObject):
         'all_cleaned': (GObject.SignalFlags.RUN_FIRST, None, (GObject.TYPE_BOOLEAN,)),
         'scan_error': (GObject.SignalFlags.RUN_FIRST, None, (GObject.TYPE_STRING,)),
         'clean_error': (GObject.SignalFlags.RUN_FIRST, None, (GObject.TYPE_STRING,)),
+        'scan_progress': (GObject.SignalFlags.RUN_FIRST, None,
+                          (GObject.TYPE_STRING,
+                           GObject.TYPE_UINT64,
+                           GObject.TYPE_DOUBLE)),
     }
 
     @classmethod
@@ -125,6 +248,79 @@ class JanitorPlugin(GObject.GObject):
         #TODO
         return None
 
+    @classmethod
+    def get_setting(cls, key, default=None, type=str):
+        '''Read an option of the plugin from its [<plugin name>] section in
+        ~/.config/ubuntu-cleaner/janitor.ini, default is returned if the
+        option is not set or invalid.
+        '''
+        if not os.path.exists(JANITOR_CONFIG):
+            return default
+
+        try:
+            return RawConfigSetting(JANITOR_CONFIG, type=type).get_value(cls.get_name(), key)
+        except Exception:
+            return default
+
+    def set_cancellable(self, cancellable):
+        self.cancellable = cancellable
+
+    def check_cancelled(self):
+        '''Raise Cancelled if the running scan or clean was cancelled.'''
+        if self.cancellable is not None:
+            self.cancellable.check()
+
+    def measure_path(self, path, name=None, seen_inodes=None):
+        '''Return get_path_size(path, seen_inodes) and, while a large tree is
+        walked, emit "scan_progress" with its name, the bytes counted so far
+        and the seconds left (-1 if unknown), estimated from the files/s
+        rate and the files found by the previous measure of the path.
+
+        In quick scan mode, return an estimate instead. It may be an
+        ApproximateSize, and seen_inodes is ignored.
+        '''
+        if self.quick_scan:
+            return estimate_path_size(path, self.quick_scan_budget, self.cancellable)
+
+        name = name or os.path.basename(path)
+        expected = JanitorPlugin._entry_counts.get(path, 0)
+        start = last = time.monotonic()
+        counted = 0
+
+        def progress(size, entries):
+            nonlocal last, counted
+            counted = entries
+            now = time.monotonic()
+            if now - last < self.progress_interval:
+                return
+
+            last = now
+            eta = -1.0
+            if expected > entries:
+                eta = (expected - entries) * (now - start) / entries
+            self.emit('scan_progress', name, size, eta)
+
+        size = self.get_exact_size(path, seen_inodes, self.cancellable, progress)
+        JanitorPlugin._entry_counts[path] = counted
+        return size
+
+    def get_exact_size(self, path, seen_inodes=None, cancellable=None, progress=None):
+        '''Return get_path_size(path), or get_exclusive_size(path) if
+        exclusive_size is set and path is on a reflink filesystem.
+        '''
+        if self.exclusive_size:
+            try:
+                device = os.lstat(path).st_dev
+            except OSError:
+                device = None
+
+            if device not in JanitorPlugin._filesystem_types:
+                JanitorPlugin._filesystem_types[device] = get_filesystem_type(path)
+            if JanitorPlugin._filesystem_types[device] in REFLINK_FILESYSTEMS:
+                return get_exclusive_size(path, seen_inodes, cancellable, progress)
+
+        return get_path_size(path, seen_inodes, cancellable, progress)
+
     def get_cruft(self):
         return ()
 
@@ -168,13 +364,7 @@ class JanitorCachePlugin(JanitorPlugin):
                     new_root_path = os.path.join(self.get_path(), target)
 
                     if os.path.exists(new_root_path):
-                        if os.path.isdir(new_root_path):
-                            try:
-                                size = os.popen('du -bs "%s"' % new_root_path).read().split()[0]
-                            except Exception:
-                                size = 0
-                        else:
-                            size = os.path.getsize(new_root_path)
+                        size = self.measure_path(new_root_path, seen_inodes=set())
 
                         total_size += int(size)
                         count += 1
@@ -193,10 +383,15 @@ class JanitorCachePlugin(JanitorPlugin):
         for index, cruft in enumerate(cruft_list):
             try:
                 log.debug('Cleaning...%s' % cruft.get_name())
-                if cruft.is_dir():
-                    shutil.rmtree(cruft.get_path())
+                if isinstance(cruft, CacheEntriesObject):
+                    for entry_path in cruft.get_entries():
+                        self.check_cancelled()
+                        try:
+                            os.remove(entry_path)
+                        except FileNotFoundError:
+                            pass
                 else:
-                    os.remove(cruft.get_path())
+                    remove_path(cruft.get_path(), self.cancellable)
                 self.emit('object_cleaned', cruft, index + 1)
             except Exception as e:
                 log.error(run_traceback(e))
@@ -213,14 +408,16 @@ class JanitorCachePlugin(JanitorPlugin):
         cruft_list.sort()
         size = 0
         count = 0
+        columns = CacheColumns()
 
         for full_path in cruft_list:
+            self.check_cancelled()
             current_size = os.path.getsize(full_path)
             size += current_size
             count += 1
 
             self.emit('find_object',
-                      CacheObject(os.path.basename(full_path), full_path, current_size),
+                      columns.append(full_path, current_size),
                       count)
 
         self.emit('scan_finished', True, len(cruft_list), size)
@@ -249,10 +446,7 @@ class JanitorCachePlugin(JanitorPlugin):
                     for path in to_deleted:
                         full_path = os.path.join(root_path, path)
 
-                        try:
-                            size = os.popen('du -bs "%s"' % full_path).read().split()[0]
-                        except Exception:
-                            size = 0
+                        size = self.measure_path(full_path, seen_inodes=set())
                         count += 1
                         total_size += int(size)
 
@@ -292,6 +486,8 @@ class JanitorPage(Gtk.VBox, GuiBuilder):
      RESULT_CRUFT) = range(7)
 
     max_janitor_view_width = 0
+    # Plugins scanned at the same time, see do_scan_task().
+    max_scan_tasks = 4
 
     def __init__(self):
         GObject.GObject.__init__(self)
@@ -299,11 +495,27 @@ class JanitorPage(Gtk.VBox, GuiBuilder):
         self.scan_tasks = []
         self.clean_tasks = []
         self._total_count = 0
+        # Plugin to Gtk.TreeRowReference of its row, so that the model does
+        # not have to be walked to find the row of a plugin.
+        self._janitor_rows = {}
+        self._running_tasks = 0
+        # The last thread of every plugin, a stopped thread only ends at its
+        # next check.
+        self._plugin_threads = {}
+        # Plugins being scanned and the handlers of their scan signals.
+        self._scan_handlers = {}
+        # Plugins whose scan was stopped, their late signals are dropped.
+        self._stopped_plugins = set()
+        # Crufts of a quick scan whose exact size is being measured.
+        self._measuring = set()
 
         self.set_border_width(6)
         GuiBuilder.__init__(self, 'janitorpage.xml')
         self.pack_start(self.vbox1, True, True, 0)
 
+        self.result_model = ResultModel()
+        self.result_view.set_model(self.result_model)
+
         self.connect('realize', self.setup_ui_tasks)
         self.janitor_view.get_selection().connect('changed', self.on_janitor_selection_changed)
 
@@ -372,7 +584,7 @@ class JanitorPage(Gtk.VBox, GuiBuilder):
         result_display_renderer.set_property('ellipsize', Pango.EllipsizeMode.END)
         result_icon_renderer= self.builder.get_object('result_icon_renderer')
         self.result_column.set_cell_data_func(result_icon_renderer,
-                                              self.icon_column_view_func,
+                                              self.result_icon_view_func,
                                               self.RESULT_ICON)
         #end new result columns
 
@@ -398,6 +610,52 @@ class JanitorPage(Gtk.VBox, GuiBuilder):
     def unset_busy(self):
         self.get_parent_window().set_cursor(None)
 
+    @staticmethod
+    def _get_row_path(rows, plugin):
+        reference = rows.get(plugin)
+        if reference is not None and reference.valid():
+            return reference.get_path()
+        return None
+
+    def _get_janitor_iter(self, plugin):
+        path = self._get_row_path(self._janitor_rows, plugin)
+        if path is None:
+            return None
+        return self.janitor_model.get_iter(path)
+
+    def _set_spinner_active(self, plugin_iter, active):
+        if self.janitor_model[plugin_iter][self.JANITOR_SPINNER_ACTIVE] != active:
+            self._running_tasks += 1 if active else -1
+        self.janitor_model[plugin_iter][self.JANITOR_SPINNER_ACTIVE] = active
+        self.stop_button.set_sensitive(self._running_tasks > 0)
+
+    @staticmethod
+    def _run_plugin_task(plugin, func, **kwargs):
+        try:
+            func(**kwargs)
+        except Cancelled:
+            log.info('Task of %s stopped' % plugin)
+
+    def _new_task_thread(self, plugin, func, **kwargs):
+        plugin.set_cancellable(Cancellable())
+
+        thread = threading.Thread(target=self._run_plugin_task, args=(plugin, func), kwargs=kwargs)
+        thread.daemon = True
+        self._plugin_threads[plugin] = thread
+        return thread
+
+    def _is_plugin_running(self, plugin):
+        thread = self._plugin_threads.get(plugin)
+        return thread is not None and thread.is_alive()
+
+    def on_stop_button_clicked(self, widget):
+        log.info('Stop the scan and clean tasks')
+        self.scan_tasks = []
+        self.clean_tasks = []
+        for plugin, thread in self._plugin_threads.items():
+            if thread.is_alive():
+                plugin.cancellable.cancel()
+
     def on_janitor_selection_changed(self, selection):
         model, iter = selection.get_selected()
         if iter:
@@ -406,19 +664,14 @@ class JanitorPage(Gtk.VBox, GuiBuilder):
 
             plugin = model[iter][self.JANITOR_PLUGIN]
 
-            for row in self.result_model:
-                if row[self.RESULT_PLUGIN] == plugin:
-                    self.result_view.get_selection().select_path(row.path)
-                    log.debug("scroll_to_cell: %s" % row.path)
-                    self.result_view.scroll_to_cell(row.path)
+            path = self.result_model.get_plugin_path(plugin)
+            if path is not None:
+                self.result_view.get_selection().select_path(path)
+                log.debug("scroll_to_cell: %s" % path)
+                self.result_view.scroll_to_cell(path)
 
     def _is_scanning_or_cleaning(self):
-        for row in self.janitor_model:
-            for child_row in row.iterchildren():
-                if child_row[self.JANITOR_SPINNER_ACTIVE]:
-                    return True
-        else:
-            return False
+        return self._running_tasks > 0
 
     def on_janitor_check_button_toggled(self, cell, path):
         self.result_view.show()
@@ -447,13 +700,7 @@ class JanitorPage(Gtk.VBox, GuiBuilder):
             self._auto_scan_cruft(iter, checked)
 
     def _update_clean_button_sensitive(self):
-        self.clean_button.set_sensitive(False)
-
-        for row in self.result_model:
-            for child_row in row.iterchildren():
-                if child_row[self.RESULT_CHECK]:
-                    self.clean_button.set_sensitive(True)
-                    break
+        self.clean_button.set_sensitive(self.result_model.has_checked())
 
     def on_result_check_renderer_toggled(self, cell, path):
         iter = self.result_model.get_iter(path)
@@ -462,19 +709,49 @@ class JanitorPage(Gtk.VBox, GuiBuilder):
         if self._is_scanning_or_cleaning():
             return
 
-        if self.result_model.iter_has_child(iter):
-            child_iter = self.result_model.iter_children(iter)
-            while child_iter:
-                self.result_model[child_iter][self.RESULT_CHECK] = not checked
+        # Checks the crufts of a plugin row too and keeps the plugin row in
+        # sync with its crufts.
+        self.result_model.set_checked(iter, not checked)
+
+        if not checked:
+            self._measure_exact_sizes(self.result_model[iter][self.RESULT_PLUGIN],
+                                      self.result_model.get_crufts(iter))
+
+        self._update_clean_button_sensitive()
 
-                child_iter = self.result_model.iter_next(child_iter)
+    def _measure_exact_sizes(self, plugin, crufts):
+        '''Replace the estimated sizes of a quick scan by exact ones, only for
+        the crufts the user checks.
+        '''
+        crufts = [cruft for cruft in crufts
+                  if cruft.is_size_estimated() and hasattr(cruft, 'get_path') and
+                  id(cruft) not in self._measuring]
+        if not crufts:
+            return
 
-        self.result_model[iter][self.RESULT_CHECK] = not checked
+        self._measuring.update(id(cruft) for cruft in crufts)
+        thread = threading.Thread(target=self._do_measure_exact_sizes, args=(plugin, crufts))
+        thread.daemon = True
+        thread.start()
 
-        self._check_child_is_all_the_same(self.result_model, iter,
-                                         self.RESULT_CHECK, not checked)
+    def _do_measure_exact_sizes(self, plugin, crufts):
+        for cruft in crufts:
+            self._on_exact_size_measured(plugin, cruft, plugin.get_exact_size(cruft.get_path()))
 
-        self._update_clean_button_sensitive()
+    @post_ui
+    def _on_exact_size_measured(self, plugin, cruft, size):
+        self._measuring.discard(id(cruft))
+        cruft.size = size
+        self.result_model.cruft_changed(plugin, cruft)
+
+    def on_result_view_test_expand_row(self, treeview, iter, path):
+        # The crufts of a plugin are only announced to the view while it is
+        # expanded.
+        self.result_model.set_expanded(iter, True)
+        return False
+
+    def on_result_view_row_collapsed(self, treeview, iter, path):
+        self.result_model.set_expanded(iter, False)
 
     def _check_child_is_all_the_same(self, model, iter, column_id, status):
         iter = model.iter_parent(iter)
@@ -542,125 +819,139 @@ class JanitorPage(Gtk.VBox, GuiBuilder):
             return
 
         for plugin_iter, checked in self.scan_tasks:
-            plugin = self.janitor_model[plugin_iter][self.JANITOR_PLUGIN]
-
-            for row in self.result_model:
-                if row[self.RESULT_PLUGIN] == plugin:
-                    self.result_model.remove(row.iter)
+            self.result_model.remove_plugin(self.janitor_model[plugin_iter][self.JANITOR_PLUGIN])
 
         self.do_scan_task()
 
     def do_scan_task(self):
-        plugin_iter, checked = self.scan_tasks.pop(0)
+        '''Start the pending scan tasks, up to max_scan_tasks plugins at a
+        time. Their walks hold slots of the devices they read, so plugins
+        on different devices overlap while those sharing a disk take turns.
+        '''
+        while self.scan_tasks and len(self._scan_handlers) < self.max_scan_tasks:
+            plugin_iter, checked = self.scan_tasks[0]
 
-        plugin = self.janitor_model[plugin_iter][self.JANITOR_PLUGIN]
-        if plugin is None:
-            log.warning('Skipping scan task for empty janitor row')
-            if self.scan_tasks:
-                self.do_scan_task()
+            plugin = self.janitor_model[plugin_iter][self.JANITOR_PLUGIN]
+            if plugin is not None and self._is_plugin_running(plugin):
+                # A stopped task of this plugin has not reached its next
+                # check yet, try again later.
+                GObject.timeout_add(50, self._on_scan_task_timeout)
+                return
+
+            self.scan_tasks.pop(0)
+            if plugin is None:
+                log.warning('Skipping scan task for empty janitor row')
+                continue
+
+            plugin.set_property('scan_finished', False)
+            self._stopped_plugins.discard(plugin)
+
+            log.debug("do_scan_task for %s for status: %s" % (plugin, checked))
+
+            if checked:
+                log.info('Scan cruft for plugin: %s' % plugin.get_name())
+
+                iter = self.result_model.append_plugin(plugin,
+                                                       plugin.get_title(),
+                                                       '<b>%s</b>' % _('Scanning cruft for "%s"...') % plugin.get_title())
+
+                self._set_spinner_active(plugin_iter, True)
+                self.janitor_model[plugin_iter][self.JANITOR_SPINNER_PULSE] = 0
+                self.janitor_view.scroll_to_cell(self.janitor_model.get_path(plugin_iter))
+
+                self._scan_handlers[plugin] = (
+                    plugin.connect('find_object', self.on_find_object, (plugin_iter, iter)),
+                    plugin.connect('scan_finished', self.on_scan_finished, (plugin_iter, iter)),
+                    plugin.connect('scan_error', self.on_scan_error, (plugin_iter, iter)),
+                    plugin.connect('scan_progress', self.on_scan_progress, (plugin_iter, iter)),
+                )
+
+                plugin.quick_scan = plugin.get_setting('quick_scan', False, type=bool)
+                plugin.exclusive_size = plugin.get_setting('exclusive_size', False, type=bool)
+                t = self._new_task_thread(plugin, plugin.get_cruft)
+                GObject.timeout_add(50, self._on_spinner_timeout, plugin_iter, t)
+
+                t.start()
             else:
-                if self._total_count == 0:
-                    self.result_view.hide()
-                    self.happy_box.show()
-                else:
-                    self.result_view.show()
-                    self.happy_box.hide()
-                self.unset_busy()
-            return
-        plugin.set_property('scan_finished', False)
+                # Update the janitor title
+                self.janitor_model[plugin_iter][self.JANITOR_DISPLAY] = plugin.get_title()
 
-        log.debug("do_scan_task for %s for status: %s" % (plugin, checked))
+        if not self.scan_tasks and not self._scan_handlers:
+            self._finish_scan_tasks()
 
-        if checked:
-            log.info('Scan cruft for plugin: %s' % plugin.get_name())
-
-            iter = self.result_model.append(None, (None,
-                                                   None,
-                                                   plugin.get_title(),
-                                                   '<b>%s</b>' % _('Scanning cruft for "%s"...') % plugin.get_title(),
-                                                   None,
-                                                   plugin,
-                                                   None))
-
-            self.janitor_model[plugin_iter][self.JANITOR_SPINNER_ACTIVE] = True
-            self.janitor_model[plugin_iter][self.JANITOR_SPINNER_PULSE] = 0
-            self.janitor_view.scroll_to_cell(self.janitor_model.get_path(plugin_iter))
-
-            self._find_handler = plugin.connect('find_object', self.on_find_object, (plugin_iter, iter))
-            self._scan_handler = plugin.connect('scan_finished', self.on_scan_finished, (plugin_iter, iter))
-            self._error_handler = plugin.connect('scan_error', self.on_scan_error, (plugin_iter, iter))
-
-            t = threading.Thread(target=plugin.get_cruft)
-            GObject.timeout_add(50, self._on_spinner_timeout, plugin_iter, t)
+    def _on_scan_task_timeout(self):
+        self.do_scan_task()
+        return False
 
-            t.start()
+    def _finish_scan_tasks(self):
+        if self._total_count == 0:
+            self.result_view.hide()
+            self.happy_box.show()
         else:
-            # Update the janitor title
-            for row in self.janitor_model:
-                for child_row in row.iterchildren():
-                    if child_row[self.JANITOR_PLUGIN] == plugin:
-                        child_row[self.JANITOR_DISPLAY] = plugin.get_title()
-
-            if self.scan_tasks:
-                self.do_scan_task()
-            else:
-                if self._total_count == 0:
-                    self.result_view.hide()
-                    self.happy_box.show()
-                else:
-                    self.result_view.show()
-                    self.happy_box.hide()
+            self.result_view.show()
+            self.happy_box.hide()
 
-                self.unset_busy()
+        self.unset_busy()
 
     def _on_spinner_timeout(self, plugin_iter, thread):
         plugin = self.janitor_model[plugin_iter][self.JANITOR_PLUGIN]
         finished = plugin.get_property('scan_finished')
+        # A stopped thread is not waited for, it ends at its next check.
+        stopped = plugin.cancellable.is_cancelled()
 
         self.janitor_model[plugin_iter][self.JANITOR_SPINNER_PULSE] += 1
 
-        if finished:
-            for handler in (self._find_handler,
-                            self._scan_handler,
-                            self._error_handler):
+        if finished or stopped:
+            for handler in self._scan_handlers.get(plugin, ()):
                 if plugin.handler_is_connected(handler):
                     log.debug("Disconnect the cleaned signal, or it will clean many times: %s" % plugin)
                     plugin.disconnect(handler)
 
-            self.janitor_model[plugin_iter][self.JANITOR_SPINNER_ACTIVE] = False
-
-            thread.join()
+            self._set_spinner_active(plugin_iter, False)
 
-            if len(self.scan_tasks) != 0:
-                log.debug("Pending scan tasks: %d" % len(self.scan_tasks))
-                self.do_scan_task()
+            if stopped and not finished:
+                self._on_scan_stopped(plugin, plugin_iter)
             else:
-                log.debug("total_count is: %d" % self._total_count)
-                if self._total_count == 0:
-                    self.result_view.hide()
-                    self.happy_box.show()
-                else:
-                    self.result_view.show()
-                    self.happy_box.hide()
+                self._scan_handlers.pop(plugin, None)
+                self._next_scan_task()
+            return False
 
-                self.unset_busy()
+        return True
+
+    def _next_scan_task(self):
+        log.debug("Pending scan tasks: %d, total_count is: %d" % (len(self.scan_tasks), self._total_count))
+        self.do_scan_task()
+
+    @post_ui
+    def _on_scan_stopped(self, plugin, plugin_iter):
+        # Queued behind the signals the worker emitted before the stop, a
+        # scan that finished meanwhile is kept as is.
+        if not plugin.get_property('scan_finished'):
+            self._stopped_plugins.add(plugin)
+            plugin.set_property('scan_finished', True)
+            self.janitor_model[plugin_iter][self.JANITOR_DISPLAY] = plugin.get_title()
+
+            # Keep what was found before the stop.
+            path = self.result_model.get_plugin_path(plugin)
+            if path is not None:
+                count = self.result_model.iter_n_children(self.result_model.get_iter(path))
+                if count:
+                    self._total_count += count
+                    self.result_model[path][self.RESULT_DISPLAY] = '<b>%s</b>' % _('Scan of "%s" stopped') % plugin.get_title()
+                else:
+                    self.result_model.remove_plugin(plugin)
 
-        return not finished
+        self._scan_handlers.pop(plugin, None)
+        self._next_scan_task()
 
     @post_ui
     def on_find_object(self, plugin, cruft, count, iters):
-        while Gtk.events_pending():
-            Gtk.main_iteration()
+        if plugin in self._stopped_plugins:
+            return
 
         plugin_iter, result_iter = iters
 
-        self.result_model.append(result_iter, (False,
-                                               cruft.get_icon(),
-                                               cruft.get_name(),
-                                               cruft.get_name(),
-                                               cruft.get_size_display(),
-                                               plugin,
-                                               cruft))
+        self.result_model.append_cruft(plugin, cruft)
 
         # Update the janitor title
         if count:
@@ -668,20 +959,42 @@ class JanitorPage(Gtk.VBox, GuiBuilder):
         else:
             self.janitor_model[plugin_iter][self.JANITOR_DISPLAY] = "[0] %s" % plugin.get_title()
 
+    @post_ui
+    def on_scan_progress(self, plugin, name, size, eta, iters):
+        if plugin.get_property('scan_finished'):
+            return
+
+        plugin_iter, result_iter = iters
+
+        self.result_model[result_iter][self.RESULT_DISPLAY] = '<b>%s</b> %s' % (
+            _('Scanning cruft for "%s"...') % plugin.get_title(),
+            GLib.markup_escape_text(name))
+        if eta >= 0:
+            self.result_model[result_iter][self.RESULT_DESC] = _('%s, about %d s left') % (filesizeformat(size),
+                                                                                         math.ceil(eta))
+        else:
+            self.result_model[result_iter][self.RESULT_DESC] = filesizeformat(size)
+
     @post_ui
     def on_scan_finished(self, plugin, result, count, size, iters):
-        plugin.disconnect(self._find_handler)
-        plugin.disconnect(self._scan_handler)
+        if plugin in self._stopped_plugins:
+            return
+
         plugin.set_property('scan_finished', True)
 
         plugin_iter, result_iter = iters
 
         if count == 0:
-            self.result_model.remove(result_iter)
+            self.result_model.remove_plugin(plugin)
         else:
             self.result_model[result_iter][self.RESULT_DISPLAY] = "<b>%s</b>" % plugin.get_summary(count)
             if size != 0:
-                self.result_model[result_iter][self.RESULT_DESC] = "<b>%s</b>" % filesizeformat(size)
+                # Only totals of estimated crufts are approximate.
+                estimated = any(cruft.is_size_estimated() for cruft in self.result_model.get_crufts(result_iter))
+                self.result_model[result_iter][self.RESULT_DESC] = "<b>%s%s</b>" % ('~' if estimated else '',
+                                                                                   filesizeformat(size))
+            else:
+                self.result_model[result_iter][self.RESULT_DESC] = None
 
         # Update the janitor title
         self._total_count += count
@@ -694,9 +1007,12 @@ class JanitorPage(Gtk.VBox, GuiBuilder):
 
     @post_ui
     def on_scan_error(self, plugin, error, iters):
+        if plugin in self._stopped_plugins:
+            return
+
         plugin_iter, result_iter = iters
 
-        self.janitor_model[plugin_iter][self.JANITOR_ICON] = icon.get_from_name('error', size=16)
+        self.janitor_model[plugin_iter][self.JANITOR_ICON] = icon.get_cached_from_name('error', size=16)
         self.result_model[result_iter][self.RESULT_DISPLAY] = '<span color="red"><b>%s</b></span>' % _('Scan error for "%s", double-click to see details') % plugin.get_title()
 
         plugin.set_property('scan_finished', True)
@@ -708,55 +1024,43 @@ class JanitorPage(Gtk.VBox, GuiBuilder):
         self.set_busy()
         self.clean_button.set_sensitive(False)
 
-        plugin_dict = OrderedDict()
-
-        for row in self.result_model:
-            plugin = row[self.RESULT_PLUGIN]
-            cruft_dict = OrderedDict()
-
-            for child_row in row.iterchildren():
-                checked = child_row[self.RESULT_CHECK]
-
-                if checked:
-                    cruft_dict[child_row[self.RESULT_CRUFT]] =  child_row.iter
-
-            if cruft_dict:
-                plugin_dict[plugin] = cruft_dict
-
-        self.clean_tasks = list(plugin_dict.items())
+        self.clean_tasks = self.result_model.get_checked_crufts()
 
         self.do_real_clean_task()
         log.debug("All finished!")
 
     def do_real_clean_task(self):
         if len(self.clean_tasks) != 0:
-            plugin, cruft_dict = self.clean_tasks.pop(0)
+            plugin, cruft_list = self.clean_tasks[0]
+            if self._is_plugin_running(plugin):
+                # Its scan has emitted scan_finished but not returned yet.
+                GObject.timeout_add(50, self._on_clean_task_timeout)
+                return
+
+            self.clean_tasks.pop(0)
             plugin.set_property('clean_finished', False)
 
-            for row in self.janitor_model:
-                for child_row in row.iterchildren():
-                    if child_row[self.JANITOR_PLUGIN] == plugin:
-                        plugin_iter = child_row.iter
+            plugin_iter = self._get_janitor_iter(plugin)
 
             log.debug("Call %s to clean cruft" % plugin)
             self._object_clean_handler = plugin.connect('object_cleaned',
                                                         self.on_plugin_object_cleaned,
-                                                        (plugin_iter, cruft_dict))
+                                                        (plugin_iter, len(cruft_list)))
             self._all_clean_handler = plugin.connect('all_cleaned', self.on_plugin_cleaned, plugin_iter)
             self._error_handler = plugin.connect('clean_error', self.on_clean_error, plugin_iter)
             self.janitor_view.scroll_to_cell(self.janitor_model.get_path(plugin_iter))
 
-            t = threading.Thread(target=plugin.clean_cruft,
-                                 kwargs={'cruft_list': cruft_dict.keys(),
-                                         'parent': self.get_toplevel()})
+            t = self._new_task_thread(plugin, plugin.clean_cruft,
+                                      cruft_list=cruft_list,
+                                      parent=self.get_toplevel())
 
-            for row in self.result_model:
-                if row[self.RESULT_PLUGIN] == plugin:
-                    self.result_view.get_selection().select_path(row.path)
-                    self.result_view.scroll_to_cell(row.path)
-                    row[self.RESULT_DISPLAY] = '<b>%s</b>' % _('Cleaning cruft for "%s"...') % plugin.get_title()
+            path = self.result_model.get_plugin_path(plugin)
+            if path is not None:
+                self.result_view.get_selection().select_path(path)
+                self.result_view.scroll_to_cell(path)
+                self.result_model[path][self.RESULT_DISPLAY] = '<b>%s</b>' % _('Cleaning cruft for "%s"...') % plugin.get_title()
 
-            self.janitor_model[plugin_iter][self.JANITOR_SPINNER_ACTIVE] = True
+            self._set_spinner_active(plugin_iter, True)
             self.janitor_model[plugin_iter][self.JANITOR_SPINNER_PULSE] = 0
 
             GObject.timeout_add(50, self._on_clean_spinner_timeout, plugin_iter, t)
@@ -766,12 +1070,22 @@ class JanitorPage(Gtk.VBox, GuiBuilder):
             self.on_scan_button_clicked()
             self.unset_busy()
 
+    def _on_clean_task_timeout(self):
+        if self.clean_tasks:
+            self.do_real_clean_task()
+        else:
+            # Stopped while waiting.
+            self._update_clean_button_sensitive()
+            self.unset_busy()
+        return False
+
     def _on_clean_spinner_timeout(self, plugin_iter, thread):
         plugin = self.janitor_model[plugin_iter][self.JANITOR_PLUGIN]
         finished = plugin.get_property('clean_finished')
+        stopped = plugin.cancellable.is_cancelled()
 
         self.janitor_model[plugin_iter][self.JANITOR_SPINNER_PULSE] += 1
-        if finished:
+        if finished or stopped:
             log.debug("Disconnect the cleaned signal for %s, or it will clean many times" % plugin)
             for handler in (self._object_clean_handler,
                             self._all_clean_handler,
@@ -779,24 +1093,26 @@ class JanitorPage(Gtk.VBox, GuiBuilder):
                 if plugin.handler_is_connected(handler):
                     plugin.disconnect(handler)
 
-            self.janitor_model[plugin_iter][self.JANITOR_SPINNER_ACTIVE] = False
-
-            thread.join()
+            self._set_spinner_active(plugin_iter, False)
 
-            self.do_real_clean_task()
+            if stopped:
+                # Leave the rows of the crufts not cleaned yet, no rescan.
+                plugin.set_property('clean_finished', True)
+                self.janitor_model[plugin_iter][self.JANITOR_DISPLAY] = plugin.get_title()
+                self._update_clean_button_sensitive()
+                self.unset_busy()
+            else:
+                self.do_real_clean_task()
+            return False
 
-        return not finished
+        return True
 
     @post_ui
     def on_plugin_object_cleaned(self, plugin, cruft, count, user_data):
-        while Gtk.events_pending():
-            Gtk.main_iteration()
+        plugin_iter, total = user_data
+        self.result_model.remove_cruft(plugin, cruft)
 
-        plugin_iter, cruft_dict = user_data
-        self.result_model.remove(cruft_dict[cruft])
-
-        self.janitor_model[plugin_iter][self.JANITOR_DISPLAY]
-        remain = len(cruft_dict) - count
+        remain = total - count
 
         if remain:
             self.janitor_model[plugin_iter][self.JANITOR_DISPLAY] = "<b>[%d] %s</b>" % (remain, plugin.get_title())
@@ -812,7 +1128,7 @@ class JanitorPage(Gtk.VBox, GuiBuilder):
     @post_ui
     def on_clean_error(self, plugin, error, plugin_iter):
         #TODO response to user?
-        self.janitor_model[plugin_iter][self.JANITOR_ICON] = icon.get_from_name('error', size=16)
+        self.janitor_model[plugin_iter][self.JANITOR_ICON] = icon.get_cached_from_name('error', size=16)
         self.clean_tasks = []
         plugin.set_property('clean_finished', True)
 
@@ -822,8 +1138,30 @@ class JanitorPage(Gtk.VBox, GuiBuilder):
         else:
             renderer.set_property("visible", True)
 
+    def result_icon_view_func(self, cell_layout, renderer, model, iter, id):
+        # Rows only hold an icon key, resolve it when the row is drawn.
+        key = model[iter][id]
+        if key is None:
+            renderer.set_property("visible", False)
+        else:
+            renderer.set_property("pixbuf", icon.get_from_key(key))
+            renderer.set_property("visible", True)
+
+    def _append_plugin_row(self, parent_iter, plugin):
+        iter = self.janitor_model.append(parent_iter, (False,
+                                                       None,
+                                                       plugin.get_title(),
+                                                       plugin.get_title(),
+                                                       plugin,
+                                                       None,
+                                                       None))
+        self._janitor_rows[plugin] = Gtk.TreeRowReference.new(self.janitor_model,
+                                                              self.janitor_model.get_path(iter))
+
     def update_model(self, a=None, b=None, expand=False):
         self.janitor_model.clear()
+        self._janitor_rows.clear()
+        self._running_tasks = 0
         self.result_model.clear()
         size_list = []
 
@@ -840,13 +1178,7 @@ class JanitorPage(Gtk.VBox, GuiBuilder):
 
         for plugin in loader.get_modules_by_category('system'):
             size_list.append(Gtk.Label(label=plugin.get_title()).get_layout().get_pixel_size()[0])
-            self.janitor_model.append(iter, (False,
-                                             None,
-                                             plugin.get_title(),
-                                             plugin.get_title(),
-                                             plugin(),
-                                             None,
-                                             None))
+            self._append_plugin_row(iter, plugin())
 
         personal_text = _('Personal')
 
@@ -860,13 +1192,7 @@ class JanitorPage(Gtk.VBox, GuiBuilder):
 
         for plugin in loader.get_modules_by_category('personal'):
             size_list.append(Gtk.Label(label=plugin.get_title()).get_layout().get_pixel_size()[0])
-            self.janitor_model.append(iter, (False,
-                                             None,
-                                             plugin.get_title(),
-                                             plugin.get_title(),
-                                             plugin(),
-                                             None,
-                                             None))
+            self._append_plugin_row(iter, plugin())
 
         app_text = _('Apps')
 
@@ -880,13 +1206,7 @@ class JanitorPage(Gtk.VBox, GuiBuilder):
 
         for plugin in loader.get_modules_by_category('application'):
             size_list.append(Gtk.Label(label=plugin.get_title()).get_layout().get_pixel_size()[0])
-            self.janitor_model.append(iter, (False,
-                                             None,
-                                             plugin.get_title(),
-                                             plugin.get_title(),
-                                             plugin(),
-                                             None,
-                                             None))
+            self._append_plugin_row(iter, plugin())
         if size_list:
             self.max_janitor_view_width = max(size_list) + 80
 
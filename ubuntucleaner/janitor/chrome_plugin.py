@@ -1,22 +1,25 @@
-from ubuntucleaner.janitor import JanitorCachePlugin
+from ubuntucleaner.janitor.chromium import ChromiumBrowserCachePlugin
 
 
-class ChromeCachePlugin(JanitorCachePlugin):
+class ChromeCachePlugin(ChromiumBrowserCachePlugin):
     __title__ = _('Chrome Cache')
     __category__ = 'application'
 
-    root_path = '~/.cache/google-chrome/Default'
+    root_path = '~/.cache/google-chrome'
+    config_path = '~/.config/google-chrome'
 
 
-class ChromiumCachePlugin(JanitorCachePlugin):
+class ChromiumCachePlugin(ChromiumBrowserCachePlugin):
     __title__ = _('Chromium Cache')
     __category__ = 'application'
 
-    root_path = '~/.cache/chromium/Default'
+    root_path = '~/.cache/chromium'
+    config_path = '~/.config/chromium'
 
 
-class ChromiumSnapCachePlugin(JanitorCachePlugin):
+class ChromiumSnapCachePlugin(ChromiumBrowserCachePlugin):
     __title__ = _('Chromium Cache')
     __category__ = 'application'
 
-    root_path = '~/snap/chromium/common/.cache/chromium/Default'
+    root_path = '~/snap/chromium/common/.cache/chromium'
+    config_path = '~/snap/chromium/common/chromium'
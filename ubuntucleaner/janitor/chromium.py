@@ -0,0 +1,172 @@
+import os
+import json
+import time
+import struct
+import logging
+from collections import OrderedDict
+
+from ubuntucleaner.janitor import CacheObject, JanitorCachePlugin
+
+log = logging.getLogger('ChromiumBrowserCachePlugin')
+
+# Layout of index-dir/the-real-index, see net/disk_cache/simple/
+# simple_index_file.cc: a pickle header (payload size, crc) followed by
+# magic, version, entry count, cache size, write reason and the entries.
+SIMPLE_INDEX_MAGIC = 0x656e74657220796f
+SIMPLE_INDEX_PICKLE_HEADER = struct.Struct('<II')
+SIMPLE_INDEX_HEADER = struct.Struct('<QIQQI')
+# hash, last used time, size (in 256 bytes chunks shifted by 8 since v9)
+SIMPLE_INDEX_ENTRY = struct.Struct('<QqQ')
+SIMPLE_INDEX_MIN_VERSION = 7
+SIMPLE_INDEX_PACKED_SIZE_VERSION = 9
+
+# base::Time counts microseconds since 1601-01-01.
+WINDOWS_EPOCH_DELTA = 11644473600
+
+
+def read_simple_cache_index(index_path):
+    '''Parse a Chromium Simple Cache index and return (entry count, size in
+    bytes, last used unix time) without touching the entry files, or None
+    if the index is missing or has an unknown layout.
+    '''
+    try:
+        with open(index_path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+
+    offset = SIMPLE_INDEX_PICKLE_HEADER.size
+    if len(data) < offset + SIMPLE_INDEX_HEADER.size:
+        return None
+
+    magic, version, entry_count, cache_size, reason = SIMPLE_INDEX_HEADER.unpack_from(data, offset)
+    offset += SIMPLE_INDEX_HEADER.size
+    if magic != SIMPLE_INDEX_MAGIC or version < SIMPLE_INDEX_MIN_VERSION or \
+            len(data) < offset + entry_count * SIMPLE_INDEX_ENTRY.size:
+        log.debug('Unsupported simple cache index %s', index_path)
+        return None
+
+    size = 0
+    last_used = 0
+    for index in range(entry_count):
+        key, used, packed = SIMPLE_INDEX_ENTRY.unpack_from(data, offset + index * SIMPLE_INDEX_ENTRY.size)
+        if version >= SIMPLE_INDEX_PACKED_SIZE_VERSION:
+            size += (packed >> 8) * 256
+        else:
+            size += packed
+        last_used = max(last_used, used)
+
+    if last_used > 0:
+        last_used = last_used / 1000000.0 - WINDOWS_EPOCH_DELTA
+
+    return entry_count, size, last_used
+
+
+class ChromiumBrowserCachePlugin(JanitorCachePlugin):
+    '''Shared cache engine of the Chromium based browsers.
+
+    Profiles are discovered from "Local State" in config_path plus the
+    profile directories found under root_path, then the Cache and Code
+    Cache of every profile (in root_path) and its GPUCache (in
+    config_path) are reported. Simple Cache directories are sized from
+    their index instead of walking the entry files.
+    '''
+    __category__ = 'application'
+
+    root_path = ''
+    config_path = ''
+    cache_targets = ('Cache', 'Code Cache')
+    config_targets = ('GPUCache',)
+    # Where a Simple Cache keeps its entries relative to a cache target.
+    index_dirs = ('', 'Cache_Data', 'js', 'wasm')
+
+    @classmethod
+    def is_active(cls):
+        return cls.__utactive__ and bool(cls.root_path) and bool(cls._discover_profiles())
+
+    @classmethod
+    def get_config_path(cls):
+        return os.path.expanduser(cls.config_path)
+
+    @classmethod
+    def _discover_profiles(cls):
+        profiles = []
+
+        try:
+            with open(os.path.join(cls.get_config_path(), 'Local State')) as f:
+                info_cache = json.load(f).get('profile', {}).get('info_cache', {})
+            profiles.extend(sorted(info_cache))
+        except (OSError, ValueError, AttributeError) as e:
+            log.debug('Cannot read the profiles of %s: %s', cls.get_name(), e)
+
+        # Profiles deleted from Local State can leave their cache behind.
+        cache_root = cls.get_path()
+        if os.path.isdir(cache_root):
+            for child in sorted(os.listdir(cache_root)):
+                if any(os.path.isdir(os.path.join(cache_root, child, target))
+                       for target in cls.cache_targets):
+                    profiles.append(child)
+
+        return list(OrderedDict.fromkeys(profiles))
+
+    @classmethod
+    def _get_cache_items(cls):
+        '''Return [(display name, path)] for every cache of every profile.'''
+        items = []
+
+        for profile in cls._discover_profiles():
+            for root, targets in ((cls.get_path(), cls.cache_targets),
+                                  (cls.get_config_path(), cls.config_targets)):
+                for target in targets:
+                    path = os.path.join(root, profile, target)
+                    if os.path.isdir(path):
+                        items.append(('%s/%s' % (profile, target), path))
+
+        return items
+
+    @classmethod
+    def _read_cache_indexes(cls, path):
+        '''Return (entry count, size, last used) summed over the Simple Cache
+        indexes found in path, or None if there is none.
+        '''
+        result = None
+        for index_dir in cls.index_dirs:
+            index = read_simple_cache_index(os.path.join(path, index_dir, 'index-dir', 'the-real-index'))
+            if index is None:
+                continue
+
+            if result is None:
+                result = index
+            else:
+                result = (result[0] + index[0], result[1] + index[1], max(result[2], index[2]))
+
+        return result
+
+    def get_cruft(self):
+        count = 0
+        total_size = 0
+
+        try:
+            for name, path in self._get_cache_items():
+                index = self._read_cache_indexes(path)
+                if index is None:
+                    size = self.measure_path(path)
+                else:
+                    entry_count, size, last_used = index
+                    if last_used:
+                        name = _('%s (%d entries, last used %s)') % \
+                            (name, entry_count, time.strftime('%Y-%m-%d', time.localtime(last_used)))
+                    else:
+                        name = _('%s (%d entries)') % (name, entry_count)
+
+                count += 1
+                total_size += size
+                self.emit('find_object',
+                          CacheObject(name, path, size),
+                          count)
+        except Exception as e:
+            log.exception('Failed to scan %s', self.get_name())
+            self.emit('scan_error', str(e))
+            return
+
+        self.emit('scan_finished', True, count, total_size)
@@ -0,0 +1,194 @@
+import fnmatch
+import glob
+import logging
+import os
+import stat
+import time
+from collections import OrderedDict, namedtuple
+from configparser import RawConfigParser
+
+from ubuntucleaner.janitor import CacheObject, JanitorPlugin
+from ubuntucleaner.settings.constants import CONFIG_ROOT, DATA_DIR
+from ubuntucleaner.utils.files import iter_files, map_by_device, remove_path
+
+log = logging.getLogger('DeveloperCachePlugin')
+
+CatalogueEntry = namedtuple('CatalogueEntry', ('name', 'paths', 'patterns', 'exclude', 'skip_if', 'max_age_days'))
+
+
+def _split(value):
+    return [item.strip() for item in value.split(':') if item.strip()]
+
+
+def load_catalogue(paths):
+    '''Read the catalogue files in order, a section of a later file
+    replacing the one of the same name. Returns [CatalogueEntry].
+    '''
+    config = RawConfigParser(strict=False)
+    config.optionxform = str
+    for path in paths:
+        try:
+            config.read(path)
+        except Exception as e:
+            log.warning('Cannot read the developer cache catalogue %s: %s', path, e)
+
+    entries = []
+    for section in config.sections():
+        try:
+            entries.append(CatalogueEntry(section,
+                                          _split(config.get(section, 'paths', fallback='')),
+                                          _split(config.get(section, 'pattern', fallback='')),
+                                          _split(config.get(section, 'exclude', fallback='')),
+                                          _split(config.get(section, 'skip_if', fallback='')),
+                                          config.getint(section, 'max_age_days', fallback=0)))
+        except ValueError as e:
+            log.warning('Invalid developer cache catalogue section %s: %s', section, e)
+
+    return entries
+
+
+class DeveloperCachePlugin(JanitorPlugin):
+    '''Caches of developer tools described by the devcaches.ini catalogue,
+    see data/devcaches.ini for its format.
+    '''
+    __title__ = _('Developer Caches')
+    __category__ = 'application'
+
+    catalogue_paths = (
+        os.path.join(DATA_DIR, 'devcaches.ini'),
+        os.path.join(CONFIG_ROOT, 'devcaches.ini'),
+    )
+    max_workers = 4
+
+    @classmethod
+    def is_active(cls):
+        return cls.__utactive__ and any(cls._expand_paths(entry) for entry in cls._get_catalogue())
+
+    @classmethod
+    def _get_catalogue(cls):
+        return load_catalogue(cls.catalogue_paths)
+
+    @staticmethod
+    def _is_below_home(path):
+        home = os.path.realpath(os.path.expanduser('~'))
+        return os.path.realpath(path).startswith(home + os.sep)
+
+    @classmethod
+    def _expand_paths(cls, entry):
+        paths = OrderedDict()
+        for path in entry.paths:
+            expanded = os.path.expandvars(os.path.expanduser(path))
+            # Unset variables are left as is by expandvars.
+            if '$' in expanded or not os.path.isabs(expanded):
+                continue
+            if os.path.isdir(expanded) and not os.path.islink(expanded) and cls._is_below_home(expanded):
+                paths[os.path.realpath(expanded)] = None
+        return list(paths)
+
+    @classmethod
+    def _discover_items(cls):
+        '''Return [(entry, display name, path)] for every cache entry of the
+        catalogue, in catalogue order.
+        '''
+        items = []
+        seen = set()
+
+        for entry in cls._get_catalogue():
+            for root in cls._expand_paths(entry):
+                if entry.patterns:
+                    paths = sorted(set(path for pattern in entry.patterns
+                                       for path in glob.glob(os.path.join(glob.escape(root), pattern))))
+                else:
+                    paths = [root]
+
+                for path in paths:
+                    name = os.path.basename(path)
+                    if path in seen or os.path.islink(path) or \
+                            any(fnmatch.fnmatch(name, exclude) for exclude in entry.exclude):
+                        continue
+                    if any(glob.glob(os.path.join(glob.escape(path), skip_if)) for skip_if in entry.skip_if):
+                        log.debug('Skip %s, it is in use', path)
+                        continue
+
+                    seen.add(path)
+                    if path == root:
+                        name = os.path.basename(root)
+                    else:
+                        name = os.path.relpath(path, root)
+                    items.append((entry, '%s: %s' % (entry.name, name), path))
+
+        return items
+
+    def _scan_item(self, item):
+        '''Return (size, last used) of a cache entry, last used being the
+        latest of the access and modification times seen.
+        '''
+        size = 0
+        last_used = 0
+        for file_path, st in iter_files(item[2], self.cancellable):
+            size += st.st_size
+            last_used = max(last_used, st.st_atime, st.st_mtime)
+        return size, last_used
+
+    def get_cruft(self):
+        count = 0
+        total_size = 0
+
+        try:
+            items = self._discover_items()
+            # The catalogue entries are walked by one pool per device and
+            # emitted in catalogue order.
+            scans = map_by_device(self._scan_item, items, key=lambda item: item[2],
+                                  max_workers=self.max_workers, cancellable=self.cancellable)
+        except Exception as e:
+            log.exception('Failed to scan developer caches')
+            self.emit('scan_error', str(e))
+            return
+
+        now = time.time()
+        for (entry, name, path), (size, last_used) in zip(items, scans):
+            if not size:
+                continue
+            if entry.max_age_days and last_used >= now - entry.max_age_days * 24 * 60 * 60:
+                continue
+
+            if last_used:
+                name = _('%s (last used %s)') % (name, time.strftime('%Y-%m-%d', time.localtime(last_used)))
+
+            count += 1
+            total_size += size
+            self.emit('find_object',
+                      CacheObject(name, path, size),
+                      count)
+
+        self.emit('scan_finished', True, count, total_size)
+
+    @staticmethod
+    def _on_rmtree_error(function, path, excinfo):
+        # Go makes its module cache read-only, allow the removal and retry.
+        parent = os.path.dirname(path)
+        os.chmod(parent, os.stat(parent).st_mode | stat.S_IWUSR)
+        if os.path.isdir(path) and not os.path.islink(path):
+            os.chmod(path, os.stat(path).st_mode | stat.S_IWUSR | stat.S_IXUSR)
+        function(path)
+
+    def clean_cruft(self, cruft_list=[], parent=None):
+        for index, cruft in enumerate(cruft_list):
+            try:
+                path = cruft.get_path()
+                if os.path.isdir(path) and not os.path.islink(path):
+                    remove_path(path, self.cancellable, onerror=self._on_rmtree_error)
+                elif os.path.lexists(path):
+                    os.remove(path)
+                self.emit('object_cleaned', cruft, index + 1)
+            except Exception:
+                log.exception('Failed to clean developer cache: %s', cruft.get_name())
+                self.emit('clean_error', cruft.get_name())
+                break
+
+        self.emit('all_cleaned', True)
+
+    def get_summary(self, count):
+        if count:
+            return '[%d] %s' % (count, self.__title__)
+        return '%s (No developer cache to be cleaned)' % self.__title__
@@ -4,19 +4,21 @@ import shutil
 import subprocess
 
 from ubuntucleaner.janitor import CruftObject, JanitorPlugin
-from ubuntucleaner.utils.files import filesizeformat
+from ubuntucleaner.utils.files import as_size, filesizeformat, remove_path
 
 
 log = logging.getLogger('DockerPlugin')
 
 
 class DockerResourceObject(CruftObject):
+    __slots__ = ('resource_type', 'resource_id')
+
     def __init__(self, name, resource_type, resource_id, path=None, size=0):
         self.name = name
         self.resource_type = resource_type
         self.resource_id = resource_id
         self.path = path
-        self.size = size
+        self.size = as_size(size)
 
     def get_size_display(self):
         return filesizeformat(self.size)
@@ -83,7 +85,7 @@ class DockerCachePlugin(JanitorPlugin):
         # Local cache folders under HOME
         for cache_path in self._discover_cache_paths():
             try:
-                size = self._du(cache_path)
+                size = self.measure_path(cache_path)
                 count += 1
                 total_size += int(size)
                 self.emit('find_object',
@@ -116,7 +118,7 @@ class DockerCachePlugin(JanitorPlugin):
             volumes = self._run_docker(['volume', 'ls', '-q', '-f', 'dangling=true'], check=False)
             for volume_name in (line.strip() for line in volumes.splitlines() if line.strip()):
                 mountpoint = self._get_volume_mountpoint(volume_name)
-                size = self._du(mountpoint) if mountpoint else 0
+                size = self.measure_path(mountpoint) if mountpoint else 0
                 count += 1
                 total_size += int(size)
                 self.emit('find_object',
@@ -137,7 +139,7 @@ class DockerCachePlugin(JanitorPlugin):
 
                 if resource_type == 'cache_path':
                     if os.path.isdir(resource_id):
-                        shutil.rmtree(resource_id)
+                        remove_path(resource_id, self.cancellable)
                     else:
                         os.remove(resource_id)
                 elif resource_type == 'image':
@@ -175,18 +177,3 @@ class DockerCachePlugin(JanitorPlugin):
             return output.strip() if output else None
         except Exception:
             return None
-
-    @staticmethod
-    def _du(path):
-        if not path or not os.path.isdir(path):
-            return 0
-
-        total_size = 0
-        for root, _, files in os.walk(path):
-            for filename in files:
-                full_path = os.path.join(root, filename)
-                try:
-                    total_size += os.path.getsize(full_path)
-                except OSError:
-                    pass
-        return total_size
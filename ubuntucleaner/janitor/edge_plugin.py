@@ -1,15 +1,17 @@
-from ubuntucleaner.janitor import JanitorCachePlugin
+from ubuntucleaner.janitor.chromium import ChromiumBrowserCachePlugin
 
 
-class EdgeCachePlugin(JanitorCachePlugin):
+class EdgeCachePlugin(ChromiumBrowserCachePlugin):
     __title__ = _('Edge Cache')
     __category__ = 'application'
 
-    root_path = '~/.cache/microsoft-edge/Default'
+    root_path = '~/.cache/microsoft-edge'
+    config_path = '~/.config/microsoft-edge'
 
 
-class EdgeDevCachePlugin(JanitorCachePlugin):
+class EdgeDevCachePlugin(ChromiumBrowserCachePlugin):
     __title__ = _('Edge-dev Cache')
     __category__ = 'application'
 
-    root_path = '~/.cache/microsoft-edge-dev/Default'
+    root_path = '~/.cache/microsoft-edge-dev'
+    config_path = '~/.config/microsoft-edge-dev'
@@ -1,8 +1,8 @@
 import os
-import shutil
 import logging
 
 from ubuntucleaner.janitor import CacheObject, JanitorPlugin
+from ubuntucleaner.utils.files import remove_path
 
 
 log = logging.getLogger('EspressifSDKCachePlugin')
@@ -30,7 +30,7 @@ class EspressifSDKCachePlugin(JanitorPlugin):
                 if not os.path.exists(full_path):
                     continue
 
-                size = self._du(full_path)
+                size = self.measure_path(full_path)
                 count += 1
                 total_size += int(size)
                 self.emit('find_object',
@@ -51,7 +51,7 @@ class EspressifSDKCachePlugin(JanitorPlugin):
                     continue
 
                 if os.path.isdir(path):
-                    shutil.rmtree(path)
+                    remove_path(path, self.cancellable)
                 else:
                     os.remove(path)
                 self.emit('object_cleaned', cruft, index + 1)
@@ -66,21 +66,3 @@ class EspressifSDKCachePlugin(JanitorPlugin):
         if count:
             return '[%d] %s' % (count, self.__title__)
         return '%s (No Espressif cache to be cleaned)' % self.__title__
-
-    @staticmethod
-    def _du(path):
-        if os.path.isfile(path):
-            try:
-                return os.path.getsize(path)
-            except OSError:
-                return 0
-
-        total_size = 0
-        for root, _, files in os.walk(path):
-            for filename in files:
-                full_path = os.path.join(root, filename)
-                try:
-                    total_size += os.path.getsize(full_path)
-                except OSError:
-                    pass
-        return total_size
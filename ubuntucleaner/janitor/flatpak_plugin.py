@@ -1,13 +1,37 @@
 import logging
 import os
-import shutil
 import subprocess
+from configparser import RawConfigParser
 
-from ubuntucleaner.janitor import CacheObject, JanitorPlugin
+from ubuntucleaner.janitor import CacheObject, CruftObject, JanitorPlugin
+from ubuntucleaner.utils.files import as_size, filesizeformat, get_unshared_sizes, remove_path
 
 log = logging.getLogger('FlatpakCachePlugin')
 
 
+class FlatpakRuntimeObject(CruftObject):
+    __slots__ = ('ref', 'installation')
+
+    def __init__(self, name, ref, installation, path, size):
+        self.name = name
+        self.ref = ref
+        self.installation = installation
+        self.path = path
+        self.size = as_size(size)
+
+    def get_path(self):
+        return self.path
+
+    def get_ref(self):
+        return self.ref
+
+    def get_installation(self):
+        return self.installation
+
+    def get_size_display(self):
+        return filesizeformat(self.size)
+
+
 class FlatpakCachePlugin(JanitorPlugin):
     __title__ = _('Flatpak Cache')
     __category__ = 'system'
@@ -16,10 +40,22 @@ class FlatpakCachePlugin(JanitorPlugin):
         '~/.cache/flatpak',
         '/var/cache/flatpak',
     )
+    installations = (
+        ('system', '/var/lib/flatpak'),
+        ('user', '~/.local/share/flatpak'),
+    )
+    # Leftovers of interrupted pulls and deployments that were removed
+    # while still in use, relative to the installation directory.
+    orphan_paths = (
+        'repo/tmp',
+        '.removed',
+    )
+    flatpak_bin = 'flatpak'
 
     @classmethod
     def is_active(cls):
-        return cls.__utactive__ and bool(cls._discover_cache_paths())
+        return cls.__utactive__ and (bool(cls._discover_cache_paths()) or
+                                     bool(cls._discover_installations()))
 
     @classmethod
     def _discover_cache_paths(cls):
@@ -37,16 +73,198 @@ class FlatpakCachePlugin(JanitorPlugin):
         base = os.path.expanduser('~/.var/app')
         cache_paths = []
 
-        if not os.path.isdir(base):
+        try:
+            names = sorted(os.listdir(base))
+        except OSError:
             return cache_paths
 
-        for name in sorted(os.listdir(base)):
+        for name in names:
             cache_path = os.path.join(base, name, 'cache')
             if os.path.isdir(cache_path):
                 cache_paths.append(os.path.abspath(cache_path))
 
         return cache_paths
 
+    @classmethod
+    def _discover_installations(cls):
+        installations = []
+        for name, path in cls.installations:
+            expanded = os.path.abspath(os.path.expanduser(path))
+            if os.path.isdir(os.path.join(expanded, 'runtime')):
+                installations.append((name, expanded))
+        return installations
+
+    @classmethod
+    def _iter_deployments(cls, base, kind):
+        '''Yield ((id, arch, branch), branch_dir) for every deployed ref of
+        the given kind ("app" or "runtime") by walking the deploy layout
+        <base>/<kind>/<id>/<arch>/<branch>/active.
+        '''
+        kind_root = os.path.join(base, kind)
+        try:
+            ref_ids = sorted(os.listdir(kind_root))
+        except OSError:
+            return
+
+        for ref_id in ref_ids:
+            id_root = os.path.join(kind_root, ref_id)
+            try:
+                arches = sorted(os.listdir(id_root))
+            except OSError:
+                continue
+
+            for arch in arches:
+                arch_root = os.path.join(id_root, arch)
+                if arch == 'current':
+                    continue
+                try:
+                    branches = sorted(os.listdir(arch_root))
+                except OSError:
+                    continue
+
+                for branch in branches:
+                    branch_root = os.path.join(arch_root, branch)
+                    if os.path.isdir(os.path.join(branch_root, 'active')):
+                        yield (ref_id, arch, branch), branch_root
+
+    @staticmethod
+    def _read_metadata(branch_root):
+        config = RawConfigParser(strict=False)
+        config.optionxform = str
+        try:
+            config.read(os.path.join(branch_root, 'active', 'metadata'))
+        except Exception as e:
+            log.warning('Cannot parse flatpak metadata in %s: %s', branch_root, e)
+        return config
+
+    @staticmethod
+    def _parse_ref(value, default_arch):
+        '''Parse "id/arch/branch" as written in the runtime= and sdk= keys.'''
+        parts = value.strip().split('/')
+        if len(parts) != 3 or not parts[0]:
+            return None
+        return (parts[0], parts[1] or default_arch, parts[2])
+
+    @classmethod
+    def _get_dependencies(cls, ref, config, by_arch_branch):
+        '''Return the runtimes a deployed ref depends on: its runtime= and
+        sdk= keys plus every deployed runtime matching one of its extension
+        points. by_arch_branch maps (arch, branch) to deployed runtime ids.
+        '''
+        ref_id, arch, branch = ref
+        depends = []
+
+        for group in ('Application', 'Runtime'):
+            if not config.has_section(group):
+                continue
+            for key in ('runtime', 'sdk'):
+                if config.has_option(group, key):
+                    dependency = cls._parse_ref(config.get(group, key), arch)
+                    if dependency:
+                        depends.append(dependency)
+
+        for section in config.sections():
+            if not section.startswith('Extension '):
+                continue
+
+            name = section[len('Extension '):].strip()
+            if config.has_option(section, 'versions'):
+                versions = config.get(section, 'versions').split(';')
+            elif config.has_option(section, 'version'):
+                versions = [config.get(section, 'version')]
+            else:
+                versions = [branch]
+
+            subdirectories = config.has_option(section, 'subdirectories') and \
+                config.get(section, 'subdirectories').strip().lower() == 'true'
+
+            for version in set(version.strip() for version in versions if version.strip()):
+                for extension_id in by_arch_branch.get((arch, version), ()):
+                    if extension_id == name or \
+                            (subdirectories and extension_id.startswith(name + '.')):
+                        depends.append((extension_id, arch, version))
+
+        return depends
+
+    @staticmethod
+    def _get_pinned_refs(base):
+        config = RawConfigParser(strict=False)
+        try:
+            config.read(os.path.join(base, 'repo', 'config'))
+            if config.has_option('core', 'xa.pinned'):
+                return set(ref.strip() for ref in config.get('core', 'xa.pinned').split(';') if ref.strip())
+        except Exception as e:
+            log.warning('Cannot read pinned flatpak refs in %s: %s', base, e)
+        return set()
+
+    @classmethod
+    def _find_unused_runtimes(cls, installations):
+        '''Return [(installation, ref, branch_dir)] for every deployed runtime
+        which is not reachable from an installed app, a pinned ref or an
+        extension point of a used runtime.
+
+        Apps of any installation keep runtimes of every installation alive,
+        because user apps are allowed to run on system runtimes.
+        '''
+        runtimes = {}
+        apps = []
+        pending = []
+
+        for installation, base in installations:
+            pinned = cls._get_pinned_refs(base)
+            for ref, branch_root in cls._iter_deployments(base, 'runtime'):
+                runtimes.setdefault(ref, []).append((installation, branch_root))
+                if 'runtime/%s/%s/%s' % ref in pinned:
+                    pending.append(ref)
+
+            apps.extend(cls._iter_deployments(base, 'app'))
+
+        # Index the runtimes by arch/branch so that extension points with
+        # subdirectories do not need a scan over every installed runtime.
+        by_arch_branch = {}
+        for ref_id, arch, branch in runtimes:
+            by_arch_branch.setdefault((arch, branch), []).append(ref_id)
+
+        for ref, branch_root in apps:
+            pending.extend(cls._get_dependencies(ref, cls._read_metadata(branch_root), by_arch_branch))
+
+        reachable = set()
+        while pending:
+            ref = pending.pop()
+            if ref in reachable:
+                continue
+
+            reachable.add(ref)
+            if ref in runtimes:
+                config = cls._read_metadata(runtimes[ref][0][1])
+                pending.extend(cls._get_dependencies(ref, config, by_arch_branch))
+
+        unused = []
+        for ref in sorted(runtimes):
+            if ref in reachable:
+                continue
+            for installation, branch_root in runtimes[ref]:
+                unused.append((installation, ref, branch_root))
+
+        return unused
+
+    @classmethod
+    def _discover_orphan_paths(cls, installations):
+        orphans = []
+        for installation, base in installations:
+            for orphan_path in cls.orphan_paths:
+                root = os.path.join(base, orphan_path)
+                try:
+                    children = sorted(os.listdir(root))
+                except OSError:
+                    continue
+
+                for child in children:
+                    orphans.append((installation,
+                                    '%s/%s' % (orphan_path, child),
+                                    os.path.join(root, child)))
+        return orphans
+
     @classmethod
     def _remove_with_root(cls, path):
         command = ['pkexec', 'rm', '-rf', '--', path]
@@ -68,13 +286,38 @@ class FlatpakCachePlugin(JanitorPlugin):
 
         return True
 
+    @classmethod
+    def _uninstall_refs(cls, installation, refs):
+        '''Uninstall all the refs of one installation with a single flatpak
+        call, flatpak takes care of the authorization for system refs.
+        '''
+        command = [cls.flatpak_bin, 'uninstall', '--noninteractive', '-y',
+                   '--%s' % installation] + list(refs)
+        try:
+            result = subprocess.run(command,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE,
+                                    text=True)
+        except FileNotFoundError:
+            log.error('flatpak not found, cannot uninstall unused runtimes')
+            return False
+        except Exception as e:
+            log.error('Failed to uninstall flatpak runtimes: %s', e)
+            return False
+
+        if result.returncode != 0:
+            log.error('flatpak uninstall failed for %s: %s', ' '.join(refs), result.stderr.strip())
+            return False
+
+        return True
+
     def get_cruft(self):
         count = 0
         total_size = 0
 
         for path in self._discover_cache_paths():
             try:
-                size = self._du(path)
+                size = self.measure_path(path)
                 count += 1
                 total_size += int(size)
                 self.emit('find_object',
@@ -85,20 +328,65 @@ class FlatpakCachePlugin(JanitorPlugin):
                 self.emit('scan_error', path)
                 return
 
+        installations = self._discover_installations()
+
+        try:
+            runtimes = self._find_unused_runtimes(installations)
+            orphans = self._discover_orphan_paths(installations)
+            paths = [path for _, _, path in runtimes] + [path for _, _, path in orphans]
+            if self.quick_scan:
+                # Estimates count the shared files too, an upper bound.
+                sizes = [self.measure_path(path) for path in paths]
+            else:
+                # Deployed files are hardlinks into the OSTree repo, shared
+                # with the deployments kept. Only the files whose links are
+                # all in these trees, the repo object aside, are freed.
+                sizes = get_unshared_sizes(paths, other_links=1, cancellable=self.cancellable)
+
+            for (installation, ref, branch_root), size in zip(runtimes, sizes):
+                count += 1
+                total_size += size
+                self.emit('find_object',
+                          FlatpakRuntimeObject('%s (%s)' % ('/'.join(ref), installation),
+                                               'runtime/%s' % '/'.join(ref),
+                                               installation,
+                                               branch_root,
+                                               size),
+                          count)
+
+            for (installation, name, path), size in zip(orphans, sizes[len(runtimes):]):
+                count += 1
+                total_size += size
+                self.emit('find_object',
+                          CacheObject('%s (%s)' % (name, installation), path, size),
+                          count)
+        except Exception:
+            log.exception('Failed to scan flatpak installations')
+            self.emit('scan_error', ', '.join(base for _, base in installations))
+            return
+
         self.emit('scan_finished', True, count, total_size)
 
     def clean_cruft(self, cruft_list=[], parent=None):
-        for index, cruft in enumerate(cruft_list):
+        count = 0
+        runtimes = {}
+
+        for cruft in cruft_list:
+            if isinstance(cruft, FlatpakRuntimeObject):
+                runtimes.setdefault(cruft.get_installation(), []).append(cruft)
+                continue
+
             try:
                 path = cruft.get_path()
                 if not os.path.exists(path):
-                    self.emit('object_cleaned', cruft, index + 1)
+                    count += 1
+                    self.emit('object_cleaned', cruft, count)
                     continue
 
                 deleted = False
                 try:
                     if os.path.isdir(path):
-                        shutil.rmtree(path)
+                        remove_path(path, self.cancellable)
                     else:
                         os.remove(path)
                     deleted = True
@@ -108,33 +396,26 @@ class FlatpakCachePlugin(JanitorPlugin):
                 if not deleted:
                     raise RuntimeError('Failed to remove %s' % path)
 
-                self.emit('object_cleaned', cruft, index + 1)
+                count += 1
+                self.emit('object_cleaned', cruft, count)
             except Exception:
                 log.exception('Failed to clean flatpak cache item: %s', cruft.get_name())
                 self.emit('clean_error', cruft.get_name())
+                self.emit('all_cleaned', True)
+                return
+
+        for installation, crufts in runtimes.items():
+            if not self._uninstall_refs(installation, [cruft.get_ref() for cruft in crufts]):
+                self.emit('clean_error', crufts[0].get_name())
                 break
 
+            for cruft in crufts:
+                count += 1
+                self.emit('object_cleaned', cruft, count)
+
         self.emit('all_cleaned', True)
 
     def get_summary(self, count):
         if count:
             return '[%d] %s' % (count, self.__title__)
         return '%s (No flatpak cache to be cleaned)' % self.__title__
-
-    @staticmethod
-    def _du(path):
-        if os.path.isfile(path):
-            try:
-                return os.path.getsize(path)
-            except OSError:
-                return 0
-
-        total_size = 0
-        for root, _, files in os.walk(path):
-            for filename in files:
-                full_path = os.path.join(root, filename)
-                try:
-                    total_size += os.path.getsize(full_path)
-                except OSError:
-                    pass
-        return total_size
@@ -1,11 +1,79 @@
 import os
+import math
+import time
+import struct
 import logging
+from collections import OrderedDict, namedtuple
 
-from ubuntucleaner.janitor import CacheObject, JanitorCachePlugin
+from ubuntucleaner.janitor import CacheEntriesObject, CacheObject, JanitorCachePlugin
 from ubuntucleaner.settings.common import RawConfigSetting
+from ubuntucleaner.utils.files import map_by_device, remove_path
 
 log = logging.getLogger('MozillaCachePlugin')
 
+# Layout of cache2/index, see netwerk/cache2/CacheIndex.h: a header
+# (version, timestamp, dirty flag, kB written), fixed size records and a
+# trailing hash of the whole file.
+INDEX_HEADER = struct.Struct('>IIII')
+INDEX_HASH_SIZE = 4
+INDEX_RECORDS = {
+    # hash, frecency, origin attrs hash, on start/stop time, [content type,] flags
+    8: struct.Struct('>20sIQHHI'),
+    9: struct.Struct('>20sIQHHBI'),
+    10: struct.Struct('>20sIQHHBI'),
+}
+INDEX_FLAG_INITIALIZED = 0x80000000
+INDEX_FLAG_REMOVED = 0x20000000
+INDEX_FLAG_PINNED = 0x04000000
+INDEX_FILE_SIZE_MASK = 0x00FFFFFF
+
+CacheIndexEntry = namedtuple('CacheIndexEntry', 'key frecency size pinned')
+
+
+def read_cache_index(index_path):
+    '''Parse a cache2/index file with a single sequential read and return
+    a list of CacheIndexEntry, or None if the index is missing or has an
+    unknown layout. The entry file of a record is cache2/entries/<key>.
+    '''
+    try:
+        with open(index_path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+
+    if len(data) < INDEX_HEADER.size + INDEX_HASH_SIZE:
+        return None
+
+    version = INDEX_HEADER.unpack_from(data)[0]
+    record = INDEX_RECORDS.get(version)
+    records_size = len(data) - INDEX_HEADER.size - INDEX_HASH_SIZE
+    if record is None or records_size % record.size:
+        log.debug('Unsupported cache index %s (version %d)', index_path, version)
+        return None
+
+    entries = []
+    records = data[INDEX_HEADER.size:INDEX_HEADER.size + records_size]
+    for fields in record.iter_unpack(records):
+        flags = fields[-1]
+        if not flags & INDEX_FLAG_INITIALIZED or flags & INDEX_FLAG_REMOVED:
+            continue
+
+        entries.append(CacheIndexEntry(fields[0].hex().upper(),
+                                       fields[1],
+                                       (flags & INDEX_FILE_SIZE_MASK) * 1024,
+                                       bool(flags & INDEX_FLAG_PINNED)))
+
+    return entries
+
+
+def get_frecency_time(frecency):
+    '''Firefox stores frecency as log(sum of exp(-ln2 * age / half life))
+    scaled by the half life, which for an entry fetched once is its fetch
+    time (in seconds) times ln 2. Return that time as an estimate of when
+    the entry was last used, or 0 if unknown.
+    '''
+    return frecency / math.log(2) if frecency else 0
+
 
 class MozillaCachePlugin(JanitorCachePlugin):
     __category__ = 'application'
@@ -18,6 +86,15 @@ class MozillaCachePlugin(JanitorCachePlugin):
     #           'cache2',
     #           'OfflineCache']
     app_path = ''
+    max_workers = 4
+
+    # Opt-in entry level cleaning of cache2, see get_setting():
+    #   entry_mode = true
+    #   max_age_days = 30   evict entries not used for that many days
+    #   max_size_mb = 0     then evict the coldest entries above this budget
+    default_max_age_days = 30
+
+    _discovered_roots = {}
 
     @classmethod
     def is_active(cls):
@@ -41,15 +118,40 @@ class MozillaCachePlugin(JanitorCachePlugin):
         return os.path.join(cache_root, profile_path)
 
     @classmethod
-    def _discover_cache_roots(cls):
-        profiles_path = os.path.expanduser('%s/profiles.ini' % cls.app_path)
+    def _get_cache_root(cls):
         cache_path = getattr(cls, 'cache_path', '')
         if cache_path:
             cache_root = os.path.expanduser(cache_path)
         else:
             cache_root = os.path.expanduser(getattr(cls, 'root_path', ''))
-        cache_root = cache_root.rstrip(os.sep)
+        return cache_root.rstrip(os.sep)
+
+    @staticmethod
+    def _get_mtime(path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    @classmethod
+    def _discover_cache_roots(cls):
+        '''Return the profile cache roots, memoised until profiles.ini or
+        the cache directory itself is modified.
+        '''
+        profiles_path = os.path.expanduser('%s/profiles.ini' % cls.app_path)
+        cache_root = cls._get_cache_root()
 
+        key = (profiles_path, cache_root,
+               cls._get_mtime(profiles_path), cls._get_mtime(cache_root))
+        cached = cls._discovered_roots.get(cls)
+        if cached is None or cached[0] != key:
+            cached = (key, cls._do_discover_cache_roots(profiles_path, cache_root))
+            cls._discovered_roots[cls] = cached
+
+        return list(cached[1])
+
+    @classmethod
+    def _do_discover_cache_roots(cls, profiles_path, cache_root):
         if not os.path.isdir(cache_root):
             return []
 
@@ -82,24 +184,7 @@ class MozillaCachePlugin(JanitorCachePlugin):
                 discovered.append(os.path.abspath(profile_root))
 
         # Deduplicate and keep stable order.
-        unique_roots = []
-        for path in discovered:
-            if path not in unique_roots:
-                unique_roots.append(path)
-
-        return unique_roots
-
-    @classmethod
-    def _cache_size(cls, cache_root):
-        cache2_root = os.path.join(cache_root, 'cache2')
-        if not os.path.isdir(cache2_root):
-            return 0
-
-        try:
-            size = os.popen('du -bs "%s"' % cache2_root).read().split()[0]
-            return int(size)
-        except Exception:
-            return 0
+        return list(OrderedDict.fromkeys(discovered))
 
     @classmethod
     def get_path(cls):
@@ -107,66 +192,138 @@ class MozillaCachePlugin(JanitorCachePlugin):
         if not cache_roots:
             return cls.root_path
 
-        cache_roots.sort(key=cls._cache_size, reverse=True)
         return cache_roots[0]
 
-    def get_cruft(self):
-        total_size = 0
-        count = 0
+    def _get_cache_items(self):
+        '''Return [(display name, path)] for every item to be sized.'''
+        items = []
 
         for cache_root in self._discover_cache_roots():
             if not self.targets:
-                if not os.path.isdir(cache_root):
+                try:
+                    children = sorted(os.listdir(cache_root))
+                except OSError:
                     continue
 
-                for root, dirs, files in os.walk(cache_root):
-                    if root != cache_root or not dirs:
-                        continue
+                items.extend((child, os.path.join(cache_root, child)) for child in children)
+                continue
 
-                    dirs.sort()
-                    files.sort()
+            for target in self.targets:
+                new_root_path = os.path.join(cache_root, target)
 
-                    for path in sorted(dirs + files):
-                        full_path = os.path.join(cache_root, path)
-                        try:
-                            size = os.popen('du -bs "%s"' % full_path).read().split()[0]
-                        except Exception:
-                            size = 0
-                        count += 1
-                        total_size += int(size)
+                if os.path.exists(new_root_path):
+                    items.append(('%s/%s' % (os.path.basename(cache_root), target),
+                                  new_root_path))
 
-                        self.emit('find_object',
-                                  CacheObject(path, full_path, size),
-                                  count)
+        return items
 
+    @classmethod
+    def _select_cache_entries(cls, entries, max_age_days=0, max_size=0, now=None):
+        '''Return the entries to evict: the ones not used for max_age_days,
+        then the coldest ones until the remaining entries fit in max_size
+        bytes. Pinned entries are always kept.
+        '''
+        if now is None:
+            now = time.time()
+
+        candidates = sorted((entry for entry in entries if not entry.pinned),
+                            key=lambda entry: entry.frecency)
+        selected = OrderedDict()
+
+        if max_age_days:
+            cutoff = now - max_age_days * 24 * 60 * 60
+            for entry in candidates:
+                if 0 < get_frecency_time(entry.frecency) < cutoff:
+                    selected[entry.key] = entry
+
+        if max_size:
+            remaining = sum(entry.size for entry in entries) - \
+                sum(entry.size for entry in selected.values())
+            for entry in candidates:
+                if remaining <= max_size:
                     break
+                if entry.key not in selected:
+                    selected[entry.key] = entry
+                    remaining -= entry.size
 
-                continue
+        return list(selected.values())
 
-            for target in self.targets:
-                new_root_path = os.path.join(cache_root, target)
+    def _scan_cache_entries(self, name, path, max_age_days, max_size):
+        entries = read_cache_index(os.path.join(path, 'index'))
+        if entries is None:
+            return CacheObject(name, path, self.measure_path(path))
 
-                if not os.path.exists(new_root_path):
-                    continue
+        selected = self._select_cache_entries(entries, max_age_days, max_size)
+        if not selected:
+            return None
 
-                if os.path.isdir(new_root_path):
-                    try:
-                        size = os.popen('du -bs "%s"' % new_root_path).read().split()[0]
-                    except Exception:
-                        size = 0
-                else:
-                    size = os.path.getsize(new_root_path)
+        return CacheEntriesObject(_('%s (%d old entries)') % (name, len(selected)),
+                                  path,
+                                  sum(entry.size for entry in selected),
+                                  [os.path.join(path, 'entries', entry.key) for entry in selected])
+
+    def get_cruft(self):
+        total_size = 0
+        count = 0
+
+        if self.get_setting('entry_mode', False, type=bool):
+            max_age_days = self.get_setting('max_age_days', self.default_max_age_days, type=int)
+            max_size = self.get_setting('max_size_mb', 0, type=int) * 1024 * 1024
+        else:
+            max_age_days = max_size = None
+
+        def scan_item(item):
+            name, path = item
+            if max_age_days is not None and os.path.basename(path) == 'cache2':
+                return self._scan_cache_entries(name, path, max_age_days, max_size)
+            return CacheObject(name, path, self.measure_path(path))
+
+        items = self._get_cache_items()
+        if items:
+            # Users with many profiles have one large tree per profile, walk
+            # them concurrently and emit the results in discovery order.
+            for cruft in map_by_device(scan_item, items, key=lambda item: item[1],
+                                       max_workers=self.max_workers, cancellable=self.cancellable):
+                if cruft is None:
+                    continue
 
-                display_name = '%s/%s' % (os.path.basename(cache_root), target)
-                total_size += int(size)
                 count += 1
+                total_size += cruft.get_size()
 
-                self.emit('find_object',
-                          CacheObject(display_name, new_root_path, size),
-                          count)
+                self.emit('find_object', cruft, count)
 
         self.emit('scan_finished', True, count, total_size)
 
+    def clean_cruft(self, cruft_list=[], parent=None):
+        for index, cruft in enumerate(cruft_list):
+            try:
+                log.debug('Cleaning...%s' % cruft.get_name())
+                if isinstance(cruft, CacheEntriesObject):
+                    for entry_path in cruft.get_entries():
+                        self.check_cancelled()
+                        try:
+                            os.remove(entry_path)
+                        except FileNotFoundError:
+                            pass
+
+                    # Firefox rebuilds a missing index from the entries
+                    # left on disk at next start.
+                    for name in ('index', 'index.log'):
+                        try:
+                            os.remove(os.path.join(cruft.get_path(), name))
+                        except FileNotFoundError:
+                            pass
+                elif cruft.is_dir():
+                    remove_path(cruft.get_path(), self.cancellable)
+                else:
+                    os.remove(cruft.get_path())
+                self.emit('object_cleaned', cruft, index + 1)
+            except Exception:
+                log.exception('Failed to clean Mozilla cache: %s', cruft.get_name())
+                self.emit('clean_error', cruft.get_name())
+                break
+
+        self.emit('all_cleaned', True)
 
 
 class FirefoxCachePlugin(MozillaCachePlugin):
@@ -0,0 +1,128 @@
+import logging
+import os
+import time
+
+from ubuntucleaner.janitor import CacheObject, JanitorPlugin
+from ubuntucleaner.utils.files import find_directories, get_unshared_sizes, remove_path
+
+log = logging.getLogger('NodeModulesPlugin')
+
+
+class NodeModulesPlugin(JanitorPlugin):
+    __title__ = _('Node Modules')
+    __category__ = 'application'
+
+    # The node_modules of every Node project found below the project roots,
+    # stalest first. In the [NodeModulesPlugin] section:
+    #   project_roots = ~/src:~/work   where to look for Node projects
+    #   max_age_days = N               only offer projects whose manifest
+    #                                  did not change for N days
+    project_roots = ('~/src', '~/projects')
+    # Files whose modification tells when the dependencies last changed.
+    manifests = (
+        'package.json',
+        'package-lock.json',
+        'npm-shrinkwrap.json',
+        'yarn.lock',
+        'pnpm-lock.yaml',
+        'bun.lockb',
+    )
+    max_workers = 4
+
+    @classmethod
+    def is_active(cls):
+        return cls.__utactive__ and bool(cls._discover_project_roots())
+
+    @classmethod
+    def _discover_project_roots(cls):
+        roots = cls.get_setting('project_roots', None)
+        if roots is None:
+            roots = cls.project_roots
+        else:
+            roots = roots.split(os.pathsep)
+
+        return [os.path.expanduser(root.strip()) for root in roots
+                if root.strip() and os.path.isdir(os.path.expanduser(root.strip()))]
+
+    @staticmethod
+    def _is_node_project(path, names):
+        return 'node_modules' in names and 'package.json' in names
+
+    @classmethod
+    def _get_last_changed(cls, project):
+        last_changed = 0
+        for manifest in cls.manifests:
+            try:
+                last_changed = max(last_changed, os.stat(os.path.join(project, manifest)).st_mtime)
+            except OSError:
+                continue
+        return last_changed
+
+    def _get_node_modules_cruft(self, cutoff):
+        '''Return the node_modules below the project roots, stalest project
+        first. The walk prunes node_modules, so nested packages of a
+        monorepo are found but never the dependencies of a dependency.
+        '''
+        projects = find_directories(self._discover_project_roots(),
+                                    self._is_node_project,
+                                    max_workers=self.max_workers,
+                                    cancellable=self.cancellable)
+        projects = [(self._get_last_changed(project), project) for project in projects]
+        projects = sorted((last_changed, project) for last_changed, project in projects
+                          if not cutoff or last_changed < cutoff)
+        if not projects:
+            return []
+
+        paths = [os.path.join(project, 'node_modules') for last_changed, project in projects]
+        # A file pnpm links from its store is not freed with the project,
+        # one shared by several projects only counts for the most recent.
+        sizes = get_unshared_sizes(paths, max_workers=self.max_workers, cancellable=self.cancellable)
+
+        crufts = []
+        home = os.path.expanduser('~')
+        for (last_changed, project), path, size in zip(projects, paths, sizes):
+            name = project
+            if name.startswith(home + os.sep):
+                name = '~' + name[len(home):]
+            if last_changed:
+                name = _('%s (last changed %s)') % (name, time.strftime('%Y-%m-%d', time.localtime(last_changed)))
+            crufts.append(CacheObject(name, path, size))
+
+        return crufts
+
+    def get_cruft(self):
+        count = 0
+        total_size = 0
+
+        max_age_days = self.get_setting('max_age_days', 0, type=int)
+        cutoff = time.time() - max_age_days * 24 * 60 * 60 if max_age_days else 0
+
+        try:
+            for cruft in self._get_node_modules_cruft(cutoff):
+                count += 1
+                total_size += cruft.get_size()
+                self.emit('find_object', cruft, count)
+        except Exception:
+            log.exception('Failed to scan Node projects')
+            self.emit('scan_error', ', '.join(self._discover_project_roots()))
+            return
+
+        self.emit('scan_finished', True, count, total_size)
+
+    def clean_cruft(self, cruft_list=[], parent=None):
+        for index, cruft in enumerate(cruft_list):
+            try:
+                if os.path.isdir(cruft.get_path()):
+                    remove_path(cruft.get_path(), self.cancellable)
+                self.emit('object_cleaned', cruft, index + 1)
+            except Exception:
+                log.exception('Failed to clean node_modules: %s', cruft.get_name())
+                self.emit('clean_error', cruft.get_name())
+                break
+
+        self.emit('all_cleaned', True)
+
+    def get_summary(self, count):
+        if count:
+            return '[%d] %s' % (count, self.__title__)
+        return '%s (No node_modules to be cleaned)' % self.__title__
@@ -1,12 +1,86 @@
+import base64
+import hashlib
+import json
 import logging
 import os
-import shutil
+import time
 
-from ubuntucleaner.janitor import CacheObject, JanitorPlugin
+from ubuntucleaner.janitor import CacheEntriesObject, CacheObject, JanitorPlugin
+from ubuntucleaner.utils.files import as_size, iter_files, remove_path
 
 log = logging.getLogger('NPMCachePlugin')
 
 
+class CacacheEvictionObject(CacheEntriesObject):
+    '''Old entries of a cacache store: the content blobs they alone
+    reference (entries), the index buckets holding them and the cutoff
+    (in ms) they were written before. The buckets are read again when
+    cleaned, so that what npm writes meanwhile is kept.
+    '''
+
+    __slots__ = ('buckets', 'cutoff')
+
+    def __init__(self, name, path, size, entries, buckets, cutoff):
+        self.name = name
+        self.path = path
+        self.size = as_size(size)
+        self.entries = entries
+        self.buckets = buckets
+        self.cutoff = cutoff
+
+    def get_buckets(self):
+        return self.buckets
+
+    def get_cutoff(self):
+        return self.cutoff
+
+
+def read_cacache_bucket(path):
+    '''Return the raw lines and the live entries {key: entry} of an
+    index-v5 bucket. Buckets are append-only logs of
+    "<sha1 of json>\t<json>" lines, the last line of a key wins and a
+    null integrity marks a deleted key.
+    '''
+    lines = []
+    entries = {}
+
+    with open(path, encoding='utf-8', errors='replace') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            digest, sep, data = line.partition('\t')
+            if not sep or hashlib.sha1(data.encode('utf-8')).hexdigest() != digest:
+                continue
+
+            try:
+                entry = json.loads(data)
+                key = entry['key']
+            except (ValueError, KeyError, TypeError):
+                continue
+
+            lines.append((key, line))
+            if entry.get('integrity'):
+                entries[key] = entry
+            else:
+                entries.pop(key, None)
+
+    return lines, entries
+
+
+def get_cacache_content_path(cache_root, integrity):
+    '''Map an SRI integrity string to its content-v2 blob path.'''
+    hashes = dict(item.split('-', 1) for item in integrity.split() if '-' in item)
+    if not hashes:
+        return None
+
+    algorithm = 'sha512' if 'sha512' in hashes else sorted(hashes)[0]
+    try:
+        digest = base64.b64decode(hashes[algorithm].split('?')[0]).hex()
+    except ValueError:
+        return None
+
+    return os.path.join(cache_root, 'content-v2', algorithm, digest[:2], digest[2:4], digest[4:])
+
+
 class NPMCachePlugin(JanitorPlugin):
     __title__ = _('NPM Cache')
     __category__ = 'application'
@@ -19,6 +93,10 @@ class NPMCachePlugin(JanitorPlugin):
         '~/.cache/npm/_cacache',
         '~/.cache/npm/_logs',
     )
+    # With "max_age_days = N" in the [NPMCachePlugin] section, _cacache
+    # stores are not offered as a whole but only their entries older than
+    # N days together with the content they alone reference.
+    cacache_name = '_cacache'
 
     @classmethod
     def is_active(cls):
@@ -45,15 +123,21 @@ class NPMCachePlugin(JanitorPlugin):
         total_size = 0
         count = 0
 
+        max_age_days = self.get_setting('max_age_days', 0, type=int)
+
         for path in self._discover_cache_paths():
             try:
-                size = self._du(path)
+                if max_age_days and os.path.basename(path) == self.cacache_name:
+                    cruft = self._get_cacache_eviction(path, max_age_days)
+                    if cruft is None:
+                        continue
+                else:
+                    cruft = CacheObject(os.path.basename(path), path, self.measure_path(path))
+
                 count += 1
-                total_size += int(size)
+                total_size += int(cruft.get_size())
 
-                self.emit('find_object',
-                          CacheObject(os.path.basename(path), path, size),
-                          count)
+                self.emit('find_object', cruft, count)
             except Exception:
                 log.exception('Failed to scan NPM cache path: %s', path)
                 self.emit('scan_error', path)
@@ -61,15 +145,120 @@ class NPMCachePlugin(JanitorPlugin):
 
         self.emit('scan_finished', True, count, total_size)
 
+    def _list_cacache_content(self, cache_root):
+        '''Walk content-v2 once and return {blob path: size}.'''
+        return dict((path, st.st_size)
+                    for path, st in iter_files(os.path.join(cache_root, 'content-v2'), self.cancellable))
+
+    def _read_cacache_index(self, cache_root, cutoff):
+        '''Yield (bucket, lines, entries, old keys) for every readable
+        index-v5 bucket, the old keys being its live keys written before
+        cutoff (in ms).
+        '''
+        for bucket, st in iter_files(os.path.join(cache_root, 'index-v5'), self.cancellable):
+            self.check_cancelled()
+            try:
+                lines, entries = read_cacache_bucket(bucket)
+            except OSError:
+                continue
+
+            old_keys = set(key for key, entry in entries.items() if entry.get('time', 0) < cutoff)
+            yield bucket, lines, entries, old_keys
+
+    @staticmethod
+    def _get_referenced_blobs(cache_root, entries, old_keys):
+        blobs = set()
+        for key, entry in entries.items():
+            if key not in old_keys:
+                blob = get_cacache_content_path(cache_root, entry['integrity'])
+                if blob:
+                    blobs.add(blob)
+        return blobs
+
+    def _get_cacache_eviction(self, cache_root, max_age_days, now=None):
+        '''Select the index entries older than max_age_days and the blobs
+        which no remaining entry references, including blobs no entry
+        references at all. Returns a CacacheEvictionObject or None.
+        '''
+        if now is None:
+            now = time.time()
+        cutoff = (now - max_age_days * 24 * 60 * 60) * 1000
+
+        content = self._list_cacache_content(cache_root)
+        kept_blobs = set()
+        buckets = []
+        evicted = 0
+
+        for bucket, lines, entries, old_keys in self._read_cacache_index(cache_root, cutoff):
+            kept_blobs.update(self._get_referenced_blobs(cache_root, entries, old_keys))
+            if old_keys:
+                evicted += len(old_keys)
+                buckets.append(bucket)
+
+        blobs = sorted(blob for blob in content if blob not in kept_blobs)
+        if not blobs and not buckets:
+            return None
+
+        return CacacheEvictionObject(_('%s (%d entries older than %d days)') %
+                                     (os.path.basename(cache_root), evicted, max_age_days),
+                                     cache_root,
+                                     sum(content[blob] for blob in blobs),
+                                     blobs,
+                                     sorted(buckets),
+                                     cutoff)
+
+    def _evict_cacache(self, cruft):
+        '''Rewrite the buckets of the cruft without their keys older than
+        its cutoff, read as they are now, then remove the blobs that no
+        entry references any more.
+        '''
+        cache_root = cruft.get_path()
+        buckets = set(cruft.get_buckets())
+        referenced = set()
+        rewrites = []
+
+        for bucket, lines, entries, old_keys in self._read_cacache_index(cache_root, cruft.get_cutoff()):
+            referenced.update(self._get_referenced_blobs(cache_root, entries, old_keys))
+            if bucket in buckets and old_keys:
+                rewrites.append((bucket, [line for key, line in lines
+                                          if key in entries and key not in old_keys]))
+
+        for bucket, lines in rewrites:
+            self.check_cancelled()
+            if lines:
+                temp_path = bucket + '.tmp'
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    f.write(''.join(line + '\n' for line in lines))
+                os.replace(temp_path, bucket)
+            else:
+                try:
+                    os.remove(bucket)
+                except FileNotFoundError:
+                    pass
+
+        for blob in cruft.get_entries():
+            self.check_cancelled()
+            if blob in referenced:
+                continue
+            try:
+                os.remove(blob)
+            except FileNotFoundError:
+                pass
+
     def clean_cruft(self, cruft_list=[], parent=None):
         for index, cruft in enumerate(cruft_list):
             try:
+                if isinstance(cruft, CacacheEvictionObject):
+                    self._evict_cacache(cruft)
+                    self.emit('object_cleaned', cruft, index + 1)
+                    continue
+
                 if not os.path.exists(cruft.get_path()):
                     self.emit('object_cleaned', cruft, index + 1)
                     continue
 
                 if os.path.isdir(cruft.get_path()):
-                    shutil.rmtree(cruft.get_path())
+                    remove_path(cruft.get_path(), self.cancellable)
                 else:
                     os.remove(cruft.get_path())
 
@@ -85,21 +274,3 @@ class NPMCachePlugin(JanitorPlugin):
         if count:
             return '[%d] %s' % (count, self.__title__)
         return '%s (No npm cache to be cleaned)' % self.__title__
-
-    @staticmethod
-    def _du(path):
-        if os.path.isfile(path):
-            try:
-                return os.path.getsize(path)
-            except OSError:
-                return 0
-
-        total_size = 0
-        for root, _, files in os.walk(path):
-            for filename in files:
-                full_path = os.path.join(root, filename)
-                try:
-                    total_size += os.path.getsize(full_path)
-                except OSError:
-                    pass
-        return total_size
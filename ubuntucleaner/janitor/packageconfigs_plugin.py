@@ -11,11 +11,13 @@ log = logging.getLogger('PackageConfigsPlugin')
 
 
 class PackageConfigObject(PackageObject):
+    __slots__ = ()
+
     def __init__(self, name):
         self.name = name
 
-    def get_icon(self):
-        return icon.get_from_name('text-plain')
+    def get_icon_key(self):
+        return ('name', 'text-plain', icon.DEFAULT_ICON, icon.DEFAULT_SIZE)
 
     def get_size_display(self):
         return ''
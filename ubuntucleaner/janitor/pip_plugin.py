@@ -1,8 +1,9 @@
 import logging
 import os
-import shutil
+import time
 
-from ubuntucleaner.janitor import CacheObject, JanitorPlugin
+from ubuntucleaner.janitor import CacheEntriesObject, CacheObject, JanitorPlugin
+from ubuntucleaner.utils.files import iter_files, remove_path
 
 log = logging.getLogger('PipCachePlugin')
 
@@ -13,10 +14,23 @@ class PipCachePlugin(JanitorPlugin):
 
     cache_paths = (
         '~/.cache/pip',
-        '~/.cache/pip/http',
-        '~/.cache/pip/selfcheck',
         '~/.cache/pypoetry',
     )
+    # Subtrees reported separately, relative to their cache path, the rest
+    # of every cache path being one more row. Entries of "per_directory"
+    # categories (virtualenvs) are only removed whole.
+    # With "keep_days = N" in the [PipCachePlugin] section, only the files
+    # (or virtualenvs) not used for N days are offered, so CI runners keep
+    # their hot wheels.
+    categories = (
+        ('~/.cache/pip', 'http', False),
+        ('~/.cache/pip', 'http-v2', False),
+        ('~/.cache/pip', 'wheels', False),
+        ('~/.cache/pip', 'selfcheck', False),
+        ('~/.cache/pypoetry', 'artifacts', False),
+        ('~/.cache/pypoetry', 'cache/repositories', False),
+        ('~/.cache/pypoetry', 'virtualenvs', True),
+    )
 
     @classmethod
     def is_active(cls):
@@ -36,18 +50,128 @@ class PipCachePlugin(JanitorPlugin):
                 discovered.append(expanded)
         return discovered
 
+    @classmethod
+    def _discover_categories(cls):
+        '''Return [(display name, path, per_directory)] for the existing
+        categories.
+        '''
+        categories = []
+        for cache_path, subtree, per_directory in cls.categories:
+            path = os.path.join(os.path.expanduser(cache_path), subtree)
+            if os.path.isdir(path):
+                name = '%s/%s' % (os.path.basename(cache_path), subtree)
+                categories.append((name, path, per_directory))
+        return categories
+
+    def _scan_remainder(self, path, excluded):
+        '''Return _scan_files() of what is below path outside the excluded
+        subtrees, only descending into the directories holding them.
+        '''
+        try:
+            children = sorted(os.listdir(path))
+        except OSError:
+            return []
+
+        files = []
+        for child in children:
+            child_path = os.path.join(path, child)
+            if child_path in excluded:
+                continue
+            if any(subtree.startswith(child_path + os.sep) for subtree in excluded):
+                files.extend(self._scan_remainder(child_path, excluded))
+            else:
+                files.extend(self._scan_files(child_path))
+        return files
+
+    def _scan_files(self, path):
+        '''Single scandir pass returning [(path, size, last used)], where
+        last used is the latest of the access and modification times.
+        '''
+        return [(file_path, st.st_size, max(st.st_atime, st.st_mtime))
+                for file_path, st in iter_files(path, self.cancellable)]
+
+    @staticmethod
+    def _format_name(name, files):
+        oldest = min(last_used for path, size, last_used in files)
+        return _('%s (oldest used %s)') % (name, time.strftime('%Y-%m-%d', time.localtime(oldest)))
+
+    def _get_category_cruft(self, name, path, per_directory, cutoff):
+        if per_directory:
+            crufts = []
+            for child in sorted(os.listdir(path)):
+                child_path = os.path.join(path, child)
+                files = self._scan_files(child_path)
+                if not files:
+                    continue
+
+                last_used = max(used for file_path, size, used in files)
+                if cutoff and last_used >= cutoff:
+                    continue
+
+                crufts.append(CacheObject(self._format_name('%s/%s' % (name, child), files),
+                                          child_path,
+                                          sum(size for file_path, size, used in files)))
+            return crufts
+
+        files = self._scan_files(path)
+        if not files:
+            return []
+
+        if not cutoff:
+            return [CacheObject(self._format_name(name, files),
+                                path,
+                                sum(size for file_path, size, used in files))]
+
+        stale = [(file_path, size, used) for file_path, size, used in files if used < cutoff]
+        if not stale:
+            return []
+
+        return [CacheEntriesObject(self._format_name(name, stale),
+                                   path,
+                                   sum(size for file_path, size, used in stale),
+                                   [file_path for file_path, size, used in stale])]
+
+    def _get_remainder_cruft(self, path, cutoff):
+        '''Return the files of a cache path outside its categories as one
+        CacheEntriesObject, None if there is none.
+        '''
+        excluded = set(os.path.join(os.path.abspath(os.path.expanduser(cache_path)), subtree)
+                       for cache_path, subtree, per_directory in self.categories)
+        files = [(file_path, size, used) for file_path, size, used in self._scan_remainder(path, excluded)
+                 if not cutoff or used < cutoff]
+        if not files:
+            return None
+
+        return CacheEntriesObject(self._format_name(_('%s (other files)') % os.path.basename(path), files),
+                                  path,
+                                  sum(size for file_path, size, used in files),
+                                  [file_path for file_path, size, used in files])
+
     def get_cruft(self):
         count = 0
         total_size = 0
 
+        keep_days = self.get_setting('keep_days', 0, type=int)
+        cutoff = time.time() - keep_days * 24 * 60 * 60 if keep_days else 0
+
+        for name, path, per_directory in self._discover_categories():
+            try:
+                for cruft in self._get_category_cruft(name, path, per_directory, cutoff):
+                    count += 1
+                    total_size += cruft.get_size()
+                    self.emit('find_object', cruft, count)
+            except Exception:
+                log.exception('Failed to scan pip cache path: %s', path)
+                self.emit('scan_error', path)
+                return
+
         for path in self._discover_cache_paths():
             try:
-                count += 1
-                size = self._du(path)
-                total_size += int(size)
-                self.emit('find_object',
-                          CacheObject(os.path.basename(path), path, size),
-                          count)
+                cruft = self._get_remainder_cruft(path, cutoff)
+                if cruft is not None:
+                    count += 1
+                    total_size += cruft.get_size()
+                    self.emit('find_object', cruft, count)
             except Exception:
                 log.exception('Failed to scan pip cache path: %s', path)
                 self.emit('scan_error', path)
@@ -58,12 +182,22 @@ class PipCachePlugin(JanitorPlugin):
     def clean_cruft(self, cruft_list=[], parent=None):
         for index, cruft in enumerate(cruft_list):
             try:
+                if isinstance(cruft, CacheEntriesObject):
+                    for file_path in cruft.get_entries():
+                        self.check_cancelled()
+                        try:
+                            os.remove(file_path)
+                        except FileNotFoundError:
+                            pass
+                    self.emit('object_cleaned', cruft, index + 1)
+                    continue
+
                 if not os.path.exists(cruft.get_path()):
                     self.emit('object_cleaned', cruft, index + 1)
                     continue
 
                 if os.path.isdir(cruft.get_path()):
-                    shutil.rmtree(cruft.get_path())
+                    remove_path(cruft.get_path(), self.cancellable)
                 else:
                     os.remove(cruft.get_path())
                 self.emit('object_cleaned', cruft, index + 1)
@@ -78,21 +212,3 @@ class PipCachePlugin(JanitorPlugin):
         if count:
             return '[%d] %s' % (count, self.__title__)
         return '%s (No pip cache to be cleaned)' % self.__title__
-
-    @staticmethod
-    def _du(path):
-        if os.path.isfile(path):
-            try:
-                return os.path.getsize(path)
-            except OSError:
-                return 0
-
-        total_size = 0
-        for root, _, files in os.walk(path):
-            for filename in files:
-                full_path = os.path.join(root, filename)
-                try:
-                    total_size += os.path.getsize(full_path)
-                except OSError:
-                    pass
-        return total_size
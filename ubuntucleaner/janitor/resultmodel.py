@@ -0,0 +1,419 @@
+from itertools import count
+
+from gi.repository import GLib, GObject, Gtk
+
+
+class ResultGroup(object):
+    '''The summary row of a plugin and its cruft, kept as plain arrays:
+    the cruft objects and one check byte per cruft. Cleaned crufts are
+    only marked as pending and dropped in one pass by compact().
+    '''
+
+    def __init__(self, id, plugin, name, display):
+        self.id = id
+        self.plugin = plugin
+        self.name = name
+        self.display = display
+        self.desc = None
+        self.checked = False
+        self.expanded = False
+        self.crufts = []
+        self.checks = bytearray()
+        self.n_checked = 0
+        self.pending = set()
+        self._indexes = None
+
+    def __len__(self):
+        return len(self.crufts)
+
+    def append(self, cruft):
+        if self._indexes is not None:
+            self._indexes[id(cruft)] = len(self.crufts)
+        self.crufts.append(cruft)
+        self.checks.append(0)
+
+    def index(self, cruft):
+        if self._indexes is None:
+            self._indexes = dict((id(cruft), index) for index, cruft in enumerate(self.crufts))
+        return self._indexes.get(id(cruft))
+
+    def set_checked(self, index, checked):
+        if bool(self.checks[index]) != checked:
+            self.checks[index] = checked
+            self.n_checked += 1 if checked else -1
+        self.checked = bool(self.crufts) and self.n_checked == len(self.crufts)
+
+    def set_all_checked(self, checked):
+        self.checks = bytearray([checked]) * len(self.crufts)
+        self.n_checked = len(self.crufts) if checked else 0
+        self.checked = checked
+
+    def get_checked_crufts(self):
+        return [cruft for cruft, checked in zip(self.crufts, self.checks) if checked]
+
+    def compact(self):
+        '''Drop the pending crufts, returns their indexes in descending
+        order.
+        '''
+        removed = sorted(self.pending, reverse=True)
+        keep = [index not in self.pending for index in range(len(self.crufts))]
+        self.crufts = [cruft for cruft, kept in zip(self.crufts, keep) if kept]
+        self.checks = bytearray(checked for checked, kept in zip(self.checks, keep) if kept)
+        self.n_checked = sum(self.checks)
+        self.checked = bool(self.crufts) and self.n_checked == len(self.crufts)
+        self.pending = set()
+        self._indexes = None
+        return removed
+
+
+class ResultModel(GObject.GObject, Gtk.TreeModel):
+    '''Scan results of the janitor page as a two level Gtk.TreeModel: one
+    row per plugin and its crufts as children.
+
+    Row values are only built when the view asks for them, and the
+    children of a collapsed plugin are not announced to the view, which
+    reads them when the row is expanded. The columns are the RESULT_*
+    ones of JanitorPage.
+    '''
+
+    (COLUMN_CHECK,
+     COLUMN_ICON,
+     COLUMN_NAME,
+     COLUMN_DISPLAY,
+     COLUMN_DESC,
+     COLUMN_PLUGIN,
+     COLUMN_CRUFT) = range(7)
+
+    column_types = (GObject.TYPE_BOOLEAN,
+                    GObject.TYPE_PYOBJECT,
+                    GObject.TYPE_STRING,
+                    GObject.TYPE_STRING,
+                    GObject.TYPE_STRING,
+                    GObject.TYPE_PYOBJECT,
+                    GObject.TYPE_PYOBJECT)
+
+    def __init__(self):
+        GObject.GObject.__init__(self)
+        self.stamp = 1
+        self._groups = []
+        self._groups_by_id = {}
+        self._groups_by_plugin = {}
+        self._ids = count(1)
+        self._compact_source = None
+
+    # Iters carry the group id in the high bits and the cruft index + 1
+    # (0 for the plugin row) in the low 32 bits.
+
+    def _make_iter(self, group, index=None):
+        iter = Gtk.TreeIter()
+        iter.stamp = self.stamp
+        iter.user_data = (group.id << 32) | (0 if index is None else index + 1)
+        return iter
+
+    def _resolve(self, iter):
+        '''Return (group, cruft index or None) of an iter, (None, None) if
+        its row was removed. Group ids are never reused, so the iters of a
+        plugin row stay valid as long as the plugin is in the model.
+        '''
+        group = self._groups_by_id.get(iter.user_data >> 32)
+        index = (iter.user_data & 0xffffffff) - 1
+        if group is None or index >= len(group):
+            return None, None
+        return group, (None if index < 0 else index)
+
+    def _get_group_path(self, group):
+        return Gtk.TreePath.new_from_indices([self._groups.index(group)])
+
+    def _get_path(self, group, index):
+        return Gtk.TreePath.new_from_indices([self._groups.index(group), index])
+
+    def do_get_flags(self):
+        return 0
+
+    def do_get_n_columns(self):
+        return len(self.column_types)
+
+    def do_get_column_type(self, column):
+        return self.column_types[column]
+
+    def do_get_iter(self, path):
+        indices = path.get_indices()
+        if not indices or indices[0] >= len(self._groups):
+            return (False, None)
+
+        group = self._groups[indices[0]]
+        if len(indices) == 1:
+            return (True, self._make_iter(group))
+        if len(indices) == 2 and indices[1] < len(group):
+            return (True, self._make_iter(group, indices[1]))
+        return (False, None)
+
+    def do_get_path(self, iter):
+        group, index = self._resolve(iter)
+        if index is None:
+            return self._get_group_path(group)
+        return self._get_path(group, index)
+
+    def do_get_value(self, iter, column):
+        group, index = self._resolve(iter)
+        if group is None:
+            return None
+
+        if index is None:
+            if column == self.COLUMN_CHECK:
+                return group.checked
+            elif column == self.COLUMN_NAME:
+                return group.name
+            elif column == self.COLUMN_DISPLAY:
+                return group.display
+            elif column == self.COLUMN_DESC:
+                return group.desc
+            elif column == self.COLUMN_PLUGIN:
+                return group.plugin
+            return None
+
+        cruft = group.crufts[index]
+        if column == self.COLUMN_CHECK:
+            return bool(group.checks[index])
+        elif column == self.COLUMN_ICON:
+            return cruft.get_icon_key()
+        elif column in (self.COLUMN_NAME, self.COLUMN_DISPLAY):
+            return cruft.get_name()
+        elif column == self.COLUMN_DESC:
+            return cruft.get_size_display()
+        elif column == self.COLUMN_PLUGIN:
+            return group.plugin
+        return cruft
+
+    def do_iter_next(self, iter):
+        group, index = self._resolve(iter)
+        if group is None:
+            return False
+        if index is None:
+            position = self._groups.index(group) + 1
+            if position < len(self._groups):
+                iter.user_data = self._groups[position].id << 32
+                return True
+        elif index + 1 < len(group):
+            iter.user_data += 1
+            return True
+        return False
+
+    def do_iter_children(self, parent):
+        if parent is None:
+            if self._groups:
+                return (True, self._make_iter(self._groups[0]))
+            return (False, None)
+
+        group, index = self._resolve(parent)
+        if group is not None and index is None and len(group):
+            return (True, self._make_iter(group, 0))
+        return (False, None)
+
+    def do_iter_has_child(self, iter):
+        group, index = self._resolve(iter)
+        return group is not None and index is None and bool(len(group))
+
+    def do_iter_n_children(self, iter):
+        if iter is None:
+            return len(self._groups)
+
+        group, index = self._resolve(iter)
+        if group is not None and index is None:
+            return len(group)
+        return 0
+
+    def do_iter_nth_child(self, parent, n):
+        if parent is None:
+            if n < len(self._groups):
+                return (True, self._make_iter(self._groups[n]))
+            return (False, None)
+
+        group, index = self._resolve(parent)
+        if group is not None and index is None and n < len(group):
+            return (True, self._make_iter(group, n))
+        return (False, None)
+
+    def do_iter_parent(self, child):
+        group, index = self._resolve(child)
+        if group is None or index is None:
+            return (False, None)
+        return (True, self._make_iter(group))
+
+    def clear(self):
+        while self._groups:
+            self._remove_group(self._groups[-1])
+
+    def append_plugin(self, plugin, name, display):
+        group = ResultGroup(next(self._ids), plugin, name, display)
+        self._groups.append(group)
+        self._groups_by_id[group.id] = group
+        self._groups_by_plugin[plugin] = group
+
+        iter = self._make_iter(group)
+        self.row_inserted(self.get_path(iter), iter)
+        return iter
+
+    def _remove_group(self, group):
+        path = self._get_group_path(group)
+        self._groups.remove(group)
+        del self._groups_by_id[group.id]
+        if self._groups_by_plugin.get(group.plugin) is group:
+            del self._groups_by_plugin[group.plugin]
+        self.row_deleted(path)
+
+    def remove_plugin(self, plugin):
+        group = self._groups_by_plugin.get(plugin)
+        if group is not None:
+            self._remove_group(group)
+
+    def get_plugin_path(self, plugin):
+        group = self._groups_by_plugin.get(plugin)
+        if group is None:
+            return None
+        return self._get_group_path(group)
+
+    def get_plugins(self):
+        return [group.plugin for group in self._groups]
+
+    def append_cruft(self, plugin, cruft):
+        group = self._groups_by_plugin.get(plugin)
+        if group is None:
+            # Found by a stopped scan after its row was removed.
+            return
+
+        group.append(cruft)
+        group.checked = False
+
+        if len(group) == 1:
+            iter = self._make_iter(group)
+            self.row_has_child_toggled(self._get_group_path(group), iter)
+
+        if group.expanded:
+            iter = self._make_iter(group, len(group) - 1)
+            self.row_inserted(self._get_path(group, len(group) - 1), iter)
+
+    def set_value(self, iter, column, value):
+        group, index = self._resolve(iter)
+        if group is None:
+            # Written by a queued handler after the row was removed.
+            return
+
+        if column == self.COLUMN_CHECK:
+            self.set_checked(iter, value)
+            return
+
+        if index is not None:
+            raise ValueError('Only the check of a cruft row can be set')
+
+        if column == self.COLUMN_NAME:
+            group.name = value
+        elif column == self.COLUMN_DISPLAY:
+            group.display = value
+        elif column == self.COLUMN_DESC:
+            group.desc = value
+        else:
+            raise ValueError('Column %d of a plugin row cannot be set' % column)
+
+        self.row_changed(self._get_group_path(group), iter)
+
+    def set_checked(self, iter, checked):
+        '''Check a cruft row, or a plugin row with all its crufts, and keep
+        the check of the plugin row in sync with its crufts.
+        '''
+        group, index = self._resolve(iter)
+        if group is None:
+            return
+        checked = bool(checked)
+
+        if index is None:
+            group.set_all_checked(checked)
+            if group.expanded:
+                for child in range(len(group)):
+                    self.row_changed(self._get_path(group, child), self._make_iter(group, child))
+        else:
+            group.set_checked(index, checked)
+            self.row_changed(self._get_path(group, index), iter)
+
+        self.row_changed(self._get_group_path(group), self._make_iter(group))
+
+    def get_crufts(self, iter):
+        '''Return the cruft of a cruft row, or the crufts of a plugin row.'''
+        group, index = self._resolve(iter)
+        if group is None:
+            return []
+        if index is None:
+            return list(group.crufts)
+        return [group.crufts[index]]
+
+    def cruft_changed(self, plugin, cruft):
+        '''Tell the view that the values of a cruft changed.'''
+        group = self._groups_by_plugin.get(plugin)
+        if group is None:
+            return
+
+        index = group.index(cruft)
+        if index is not None and group.expanded:
+            self.row_changed(self._get_path(group, index), self._make_iter(group, index))
+
+    def has_checked(self):
+        return any(group.n_checked for group in self._groups)
+
+    def get_checked_crufts(self):
+        '''Return [(plugin, [checked crufts])] for the plugins with checked
+        crufts, in display order.
+        '''
+        checked = []
+        for group in self._groups:
+            if group.n_checked:
+                checked.append((group.plugin, group.get_checked_crufts()))
+        return checked
+
+    def remove_cruft(self, plugin, cruft):
+        '''Remove the row of a cruft. Removals are batched and applied from
+        an idle callback, so cleaning many crufts stays linear.
+        '''
+        group = self._groups_by_plugin.get(plugin)
+        if group is None:
+            return
+
+        index = group.index(cruft)
+        if index is not None:
+            group.pending.add(index)
+            if self._compact_source is None:
+                self._compact_source = GLib.idle_add(self.compact)
+
+    def compact(self):
+        self._compact_source = None
+
+        for group in self._groups:
+            if not group.pending:
+                continue
+
+            group_index = self._groups.index(group)
+            removed = group.compact()
+            if group.expanded:
+                # The view knows these rows, tell it about every one, last
+                # first so that the paths of the others stay valid.
+                for index in removed:
+                    self.row_deleted(Gtk.TreePath.new_from_indices([group_index, index]))
+
+            iter = self._make_iter(group)
+            group_path = Gtk.TreePath.new_from_indices([group_index])
+            if not len(group):
+                self.row_has_child_toggled(group_path, iter)
+            self.row_changed(group_path, iter)
+
+        return False
+
+    def set_expanded(self, iter, expanded):
+        '''To be called by the view before a plugin row is expanded and
+        after it is collapsed.
+        '''
+        group, index = self._resolve(iter)
+        if group is None or index is not None:
+            return
+
+        if expanded and group.pending:
+            self.compact()
+        group.expanded = expanded
@@ -1,11 +1,83 @@
 import logging
 import os
-import shutil
+import re
+import sqlite3
+import time
 
-from ubuntucleaner.janitor import CacheObject, JanitorPlugin
+from ubuntucleaner.janitor import CacheObject, CruftObject, JanitorPlugin
+from ubuntucleaner.utils.files import (PRUNED_DIRECTORIES, as_size, filesizeformat, find_directories,
+                                       iter_files, map_by_device, remove_path)
 
 log = logging.getLogger('RustBuildCachePlugin')
 
+# "<crate>-<version>" as used for the .crate archives and src directories.
+CRATE_PATTERN = re.compile(r'^(.+?)-(\d+\.\d+\.\d+.*)$')
+# Registry index and git repository directories end with a short hash.
+HASH_SUFFIX_PATTERN = re.compile(r'-[0-9a-f]{16}$')
+
+# The tables of the last-use database cargo keeps in $CARGO_HOME/.global-cache
+# since 1.78, timestamps are in seconds since the epoch.
+LAST_USE_QUERIES = (
+    ('registry', 'SELECT registry_index.name, registry_crate.name, registry_crate.timestamp '
+                 'FROM registry_crate JOIN registry_index ON registry_crate.registry_id = registry_index.id'),
+    ('registry', 'SELECT registry_index.name, registry_src.name, registry_src.timestamp '
+                 'FROM registry_src JOIN registry_index ON registry_src.registry_id = registry_index.id'),
+    ('git', 'SELECT name, NULL, timestamp FROM git_db'),
+    ('git', 'SELECT git_db.name, NULL, git_checkout.timestamp '
+            'FROM git_checkout JOIN git_db ON git_checkout.git_id = git_db.id'),
+)
+
+
+def read_cargo_last_use(path):
+    '''Return {(kind, directory, crate): last use} from cargo's last-use
+    database, kind being "registry" or "git". Archives and extracted
+    sources of a crate share their key, git checkouts share the one of
+    their database (with crate None). Returns {} if the database is
+    missing or unreadable.
+    '''
+    if not os.path.isfile(path):
+        return {}
+
+    last_uses = {}
+    try:
+        connection = sqlite3.connect('file:%s?mode=ro' % path, uri=True)
+        try:
+            for kind, query in LAST_USE_QUERIES:
+                for directory, name, timestamp in connection.execute(query):
+                    if name and name.endswith('.crate'):
+                        name = name[:-len('.crate')]
+                    key = (kind, directory, name)
+                    last_uses[key] = max(last_uses.get(key, 0), timestamp or 0)
+        finally:
+            connection.close()
+    except sqlite3.Error as e:
+        log.warning('Cannot read the cargo last-use database %s: %s', path, e)
+        return {}
+
+    return last_uses
+
+
+class CargoCrateObject(CruftObject):
+    '''A crate (its .crate archive and extracted sources) or a git
+    dependency (its database and checkouts), removed together.
+    '''
+
+    __slots__ = ('paths',)
+
+    def __init__(self, name, paths, size):
+        self.name = name
+        self.paths = paths
+        self.size = as_size(size)
+
+    def get_path(self):
+        return self.paths[0]
+
+    def get_paths(self):
+        return self.paths
+
+    def get_size_display(self):
+        return filesizeformat(self.size)
+
 
 class RustBuildCachePlugin(JanitorPlugin):
     __title__ = _('Rust Build Cache')
@@ -14,9 +86,6 @@ class RustBuildCachePlugin(JanitorPlugin):
     cache_paths = (
         '~/.cache/sccache',
         '~/.cache/rust',
-        '~/.cargo/registry/cache',
-        '~/.cargo/registry/src',
-        '~/.cargo/git/db',
         '~/.rustup/downloads',
         '~/.rustup/tmp',
     )
@@ -24,11 +93,24 @@ class RustBuildCachePlugin(JanitorPlugin):
         '~/.cargo',
         '~/.rustup',
     )
+    # Registry crates and git dependencies are reported one by one, and so
+    # are the target/ directories of the projects found below the project
+    # roots. In the [RustBuildCachePlugin] section:
+    #   project_roots = ~/src:~/work   where to look for Cargo projects
+    #   max_age_days = N               only offer what was not used (or
+    #                                  built) for N days
+    cargo_home = '~/.cargo'
+    project_roots = ('~/src', '~/projects')
+    max_workers = 4
 
     @classmethod
     def is_active(cls):
         return cls.__utactive__ and any(os.path.exists(os.path.expanduser(path)) for path in cls.install_paths)
 
+    @classmethod
+    def get_cargo_home(cls):
+        return os.path.expanduser(os.environ.get('CARGO_HOME', cls.cargo_home))
+
     @classmethod
     def _discover_cache_paths(cls):
         paths = []
@@ -47,13 +129,155 @@ class RustBuildCachePlugin(JanitorPlugin):
 
         return deduped
 
+    @staticmethod
+    def _list_dir(path):
+        try:
+            return sorted(os.listdir(path))
+        except OSError:
+            return []
+
+    @classmethod
+    def _discover_crates(cls, cargo_home):
+        '''Return {(kind, directory, crate): [paths]} grouping the .crate
+        archive of every registry crate with its extracted sources, and the
+        database of every git dependency with its checkouts.
+        '''
+        groups = {}
+
+        for kind, subdir in (('cache', os.path.join('registry', 'cache')),
+                             ('src', os.path.join('registry', 'src'))):
+            root = os.path.join(cargo_home, subdir)
+            for index in cls._list_dir(root):
+                for name in cls._list_dir(os.path.join(root, index)):
+                    crate = name
+                    if kind == 'cache':
+                        if not name.endswith('.crate'):
+                            continue
+                        crate = name[:-len('.crate')]
+                    groups.setdefault(('registry', index, crate), []).append(os.path.join(root, index, name))
+
+        for subdir in ('db', 'checkouts'):
+            root = os.path.join(cargo_home, 'git', subdir)
+            for name in cls._list_dir(root):
+                groups.setdefault(('git', name, None), []).append(os.path.join(root, name))
+
+        return groups
+
+    @staticmethod
+    def _format_name(key, last_used):
+        kind, directory, crate = key
+        directory = HASH_SUFFIX_PATTERN.sub('', directory)
+
+        if crate:
+            match = CRATE_PATTERN.match(crate)
+            if match:
+                crate = '%s %s' % match.groups()
+            name = '%s (%s' % (crate, directory)
+        else:
+            name = '%s (git' % directory
+
+        if last_used:
+            name += _(', last used %s') % time.strftime('%Y-%m-%d', time.localtime(last_used))
+        return name + ')'
+
+    def _get_crate_cruft(self, cargo_home, cutoff):
+        '''Size every crate group in one walk of the registry and git trees.
+        The last use comes from cargo's database when it tracks the crate,
+        otherwise from the latest access or modification time seen.
+        '''
+        last_uses = read_cargo_last_use(os.path.join(cargo_home, '.global-cache'))
+        crufts = []
+
+        for key, paths in sorted(self._discover_crates(cargo_home).items(), key=lambda item: item[1][0]):
+            size = 0
+            last_used = last_uses.get(key, 0)
+            tracked = bool(last_used)
+            for path in paths:
+                for file_path, st in iter_files(path, self.cancellable):
+                    size += st.st_size
+                    if not tracked:
+                        last_used = max(last_used, st.st_atime, st.st_mtime)
+
+            if cutoff and last_used >= cutoff:
+                continue
+
+            crufts.append(CargoCrateObject(self._format_name(key, last_used), paths, size))
+
+        return crufts
+
+    @classmethod
+    def _discover_project_roots(cls):
+        roots = cls.get_setting('project_roots', None)
+        if roots is None:
+            roots = cls.project_roots
+        else:
+            roots = roots.split(os.pathsep)
+
+        return [os.path.expanduser(root.strip()) for root in roots
+                if root.strip() and os.path.isdir(os.path.expanduser(root.strip()))]
+
+    @staticmethod
+    def _is_cargo_project(path, names):
+        if 'Cargo.toml' not in names or 'target' not in names:
+            return False
+
+        # Only trust target/ directories that cargo itself created.
+        target = os.path.join(path, 'target')
+        return os.path.exists(os.path.join(target, 'CACHEDIR.TAG')) or \
+            os.path.exists(os.path.join(target, '.rustc_info.json'))
+
+    @classmethod
+    def _discover_targets(cls, cancellable=None):
+        '''Return the target/ directories of the Cargo projects found below
+        the project roots. Workspace members share the target/ of their
+        workspace, so they have none of their own.
+        '''
+        projects = find_directories(cls._discover_project_roots(),
+                                    cls._is_cargo_project,
+                                    prune=PRUNED_DIRECTORIES | {'target'},
+                                    max_workers=cls.max_workers,
+                                    cancellable=cancellable)
+        return [os.path.join(project, 'target') for project in projects]
+
+    def _scan_target(self, path):
+        '''Return (size, last build time) of a target/ directory in a single
+        walk, the last build being the latest modification seen in it.
+        '''
+        size = 0
+        last_build = 0
+        for file_path, st in iter_files(path, self.cancellable):
+            size += st.st_size
+            last_build = max(last_build, st.st_mtime)
+        return size, last_build
+
+    def _get_target_cruft(self, cutoff):
+        targets = self._discover_targets(self.cancellable)
+        if not targets:
+            return []
+
+        crufts = []
+        home = os.path.expanduser('~')
+        scans = map_by_device(self._scan_target, targets,
+                              max_workers=self.max_workers, cancellable=self.cancellable)
+        for path, (size, last_build) in zip(targets, scans):
+            if not size or (cutoff and last_build >= cutoff):
+                continue
+
+            name = os.path.dirname(path)
+            if name.startswith(home + os.sep):
+                name = '~' + name[len(home):]
+            name = _('%s (last built %s)') % (name, time.strftime('%Y-%m-%d', time.localtime(last_build)))
+            crufts.append(CacheObject(name, path, size))
+
+        return crufts
+
     def get_cruft(self):
         count = 0
         total_size = 0
 
         for path in self._discover_cache_paths():
             try:
-                size = self._du(path)
+                size = self.measure_path(path)
                 count += 1
                 total_size += int(size)
                 self.emit('find_object',
@@ -64,15 +288,45 @@ class RustBuildCachePlugin(JanitorPlugin):
                 self.emit('scan_error', path)
                 return
 
+        max_age_days = self.get_setting('max_age_days', 0, type=int)
+        cutoff = time.time() - max_age_days * 24 * 60 * 60 if max_age_days else 0
+        cargo_home = self.get_cargo_home()
+
+        try:
+            for cruft in self._get_crate_cruft(cargo_home, cutoff):
+                count += 1
+                total_size += cruft.get_size()
+                self.emit('find_object', cruft, count)
+        except Exception:
+            log.exception('Failed to scan cargo home: %s', cargo_home)
+            self.emit('scan_error', cargo_home)
+            return
+
+        try:
+            for cruft in self._get_target_cruft(cutoff):
+                count += 1
+                total_size += cruft.get_size()
+                self.emit('find_object', cruft, count)
+        except Exception:
+            log.exception('Failed to scan Rust projects')
+            self.emit('scan_error', ', '.join(self._discover_project_roots()))
+            return
+
         self.emit('scan_finished', True, count, total_size)
 
     def clean_cruft(self, cruft_list=[], parent=None):
         for index, cruft in enumerate(cruft_list):
+            if isinstance(cruft, CargoCrateObject):
+                paths = cruft.get_paths()
+            else:
+                paths = [cruft.get_path()]
+
             try:
-                if os.path.isdir(cruft.get_path()):
-                    shutil.rmtree(cruft.get_path())
-                else:
-                    os.remove(cruft.get_path())
+                for path in paths:
+                    if os.path.isdir(path) and not os.path.islink(path):
+                        remove_path(path, self.cancellable)
+                    elif os.path.lexists(path):
+                        os.remove(path)
                 self.emit('object_cleaned', cruft, index + 1)
             except Exception:
                 log.exception('Failed to clean Rust cache resource: %s', cruft.get_name())
@@ -85,21 +339,3 @@ class RustBuildCachePlugin(JanitorPlugin):
         if count:
             return '[%d] %s' % (count, self.__title__)
         return '%s (No Rust cache to be cleaned)' % self.__title__
-
-    @staticmethod
-    def _du(path):
-        if os.path.isfile(path):
-            try:
-                return os.path.getsize(path)
-            except OSError:
-                return 0
-
-        total_size = 0
-        for root, _, files in os.walk(path):
-            for filename in files:
-                full_path = os.path.join(root, filename)
-                try:
-                    total_size += os.path.getsize(full_path)
-                except OSError:
-                    pass
-        return total_size
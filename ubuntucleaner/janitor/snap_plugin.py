@@ -1,13 +1,38 @@
+import json
 import logging
 import os
-import shutil
 import subprocess
 
-from ubuntucleaner.janitor import CacheObject, JanitorPlugin
+from ubuntucleaner.janitor import CacheObject, CruftObject, JanitorPlugin
+from ubuntucleaner.daemon.dbusproxy import proxy
+from ubuntucleaner.utils.files import as_size, filesizeformat, remove_path
 
 log = logging.getLogger('SnapCachePlugin')
 
 
+class SnapRevisionObject(CruftObject):
+    __slots__ = ('snap_name', 'revision')
+
+    def __init__(self, name, snap_name, revision, path, size):
+        self.name = name
+        self.snap_name = snap_name
+        self.revision = revision
+        self.path = path
+        self.size = as_size(size)
+
+    def get_path(self):
+        return self.path
+
+    def get_snap_name(self):
+        return self.snap_name
+
+    def get_revision(self):
+        return self.revision
+
+    def get_size_display(self):
+        return filesizeformat(self.size)
+
+
 class SnapCachePlugin(JanitorPlugin):
     __title__ = _('Snap Cache')
     __category__ = 'system'
@@ -17,10 +42,14 @@ class SnapCachePlugin(JanitorPlugin):
         '/var/cache/snapd',
         '/var/lib/snapd/cache',
     )
+    snapd_state = '/var/lib/snapd/state.json'
+    snaps_dir = '/var/lib/snapd/snaps'
+    snap_mount_dir = '/snap'
 
     @classmethod
     def is_active(cls):
-        return cls.__utactive__ and bool(cls._discover_cache_paths())
+        return cls.__utactive__ and (bool(cls._discover_cache_paths()) or
+                                     os.path.isdir(cls.snaps_dir))
 
     @classmethod
     def _discover_cache_paths(cls):
@@ -32,6 +61,63 @@ class SnapCachePlugin(JanitorPlugin):
 
         return paths
 
+    @classmethod
+    def _read_current_revisions(cls):
+        '''Return {snap name: current revision}, read once from the snapd
+        state. The state is only readable by root, so fall back to the
+        /snap/<name>/current symlinks which snapd keeps for every snap.
+        '''
+        try:
+            with open(cls.snapd_state) as f:
+                snaps = json.load(f).get('data', {}).get('snaps', {})
+            return dict((name, str(info['current']))
+                        for name, info in snaps.items() if info.get('current'))
+        except (OSError, ValueError, AttributeError) as e:
+            log.debug('Cannot read snapd state, use %s instead: %s', cls.snap_mount_dir, e)
+
+        current = {}
+        try:
+            with os.scandir(cls.snap_mount_dir) as entries:
+                for entry in entries:
+                    try:
+                        current[entry.name] = os.readlink(os.path.join(entry.path, 'current'))
+                    except OSError:
+                        continue
+        except OSError as e:
+            log.warning('Cannot list mounted snaps: %s', e)
+
+        return current
+
+    @classmethod
+    def _find_disabled_revisions(cls):
+        '''Return [(snap name, revision, path, size)] for every snap file
+        which is not the current revision of its snap, sizes are taken from
+        the same scan of the snaps directory.
+        '''
+        current = cls._read_current_revisions()
+        disabled = []
+
+        try:
+            with os.scandir(cls.snaps_dir) as entries:
+                for entry in entries:
+                    if not entry.name.endswith('.snap') or not entry.is_file(follow_symlinks=False):
+                        continue
+
+                    name, sep, revision = entry.name[:-len('.snap')].rpartition('_')
+                    if not sep or name not in current or current[name] == revision:
+                        continue
+
+                    try:
+                        size = entry.stat(follow_symlinks=False).st_size
+                    except OSError:
+                        size = 0
+                    disabled.append((name, revision, entry.path, size))
+        except OSError as e:
+            log.warning('Cannot list snap revisions: %s', e)
+
+        disabled.sort()
+        return disabled
+
     @classmethod
     def _remove_with_root(cls, path):
         command = ['pkexec', 'rm', '-rf', '--', path]
@@ -59,7 +145,7 @@ class SnapCachePlugin(JanitorPlugin):
 
         for path in self._discover_cache_paths():
             try:
-                size = self._du(path)
+                size = self.measure_path(path)
                 count += 1
                 total_size += int(size)
                 self.emit('find_object',
@@ -70,10 +156,44 @@ class SnapCachePlugin(JanitorPlugin):
                 self.emit('scan_error', path)
                 return
 
+        for name, revision, path, size in self._find_disabled_revisions():
+            count += 1
+            total_size += size
+            self.emit('find_object',
+                      SnapRevisionObject(_('%s (revision %s)') % (name, revision),
+                                         name, revision, path, size),
+                      count)
+
         self.emit('scan_finished', True, count, total_size)
 
+    def _remove_revisions(self, revisions, count):
+        '''Remove the selected revisions with one daemon call each, so that
+        a stop takes effect between two of them. The clean action is
+        auth_admin_keep, the user still authenticates only once. A revision
+        that fails is reported and the others are still removed.
+        '''
+        for cruft in revisions:
+            self.check_cancelled()
+            key = '%s_%s' % (cruft.get_snap_name(), cruft.get_revision())
+            try:
+                removed = key in (proxy.remove_snap_revisions([key], timeout=600) or ())
+            except Exception:
+                log.exception('Failed to remove snap revision: %s', key)
+                removed = False
+
+            count += 1
+            if removed:
+                self.emit('object_cleaned', cruft, count)
+            else:
+                self.emit('clean_error', cruft.get_name())
+
     def clean_cruft(self, cruft_list=[], parent=None):
-        for index, cruft in enumerate(cruft_list):
+        revisions = [cruft for cruft in cruft_list if isinstance(cruft, SnapRevisionObject)]
+        cruft_list = [cruft for cruft in cruft_list if not isinstance(cruft, SnapRevisionObject)]
+
+        self._remove_revisions(revisions, 0)
+
+        for index, cruft in enumerate(cruft_list, len(revisions)):
             try:
                 path = cruft.get_path()
                 if not os.path.exists(path):
@@ -83,7 +203,7 @@ class SnapCachePlugin(JanitorPlugin):
                 deleted = False
                 try:
                     if os.path.isdir(path):
-                        shutil.rmtree(path)
+                        remove_path(path, self.cancellable)
                     else:
                         os.remove(path)
                     deleted = True
@@ -105,21 +225,3 @@ class SnapCachePlugin(JanitorPlugin):
         if count:
             return '[%d] %s' % (count, self.__title__)
         return '%s (No snap cache to be cleaned)' % self.__title__
-
-    @staticmethod
-    def _du(path):
-        if os.path.isfile(path):
-            try:
-                return os.path.getsize(path)
-            except OSError:
-                return 0
-
-        total_size = 0
-        for root, _, files in os.walk(path):
-            for filename in files:
-                full_path = os.path.join(root, filename)
-                try:
-                    total_size += os.path.getsize(full_path)
-                except OSError:
-                    pass
-        return total_size
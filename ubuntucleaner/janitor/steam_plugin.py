@@ -1,12 +1,58 @@
+import glob
 import logging
 import os
-import shutil
+import re
+from collections import OrderedDict
 
 from ubuntucleaner.janitor import CacheObject, JanitorPlugin
+from ubuntucleaner.utils.files import map_by_device, remove_path
 
 
 log = logging.getLogger('SteamCachePlugin')
 
+VDF_TOKEN = re.compile(r'"((?:[^"\\]|\\.)*)"|([{}])|//[^\n]*|(\S+)')
+
+
+def parse_vdf(text):
+    '''Parse the KeyValues text format of Steam (libraryfolders.vdf,
+    appmanifest_*.acf) into nested dicts. Keys are lower cased, as Steam
+    itself does not care about their case.
+    '''
+    root = {}
+    stack = [root]
+    key = None
+
+    for match in VDF_TOKEN.finditer(text):
+        quoted, brace, bare = match.groups()
+        if brace == '{':
+            child = {}
+            if key is not None:
+                stack[-1][key] = child
+            stack.append(child)
+            key = None
+        elif brace == '}':
+            if len(stack) > 1:
+                stack.pop()
+            key = None
+        elif quoted is not None or bare is not None:
+            token = quoted if quoted is not None else bare
+            token = token.replace('\\\\', '\\').replace('\\"', '"')
+            if key is None:
+                key = token.lower()
+            else:
+                stack[-1][key] = token
+                key = None
+
+    return root
+
+
+def read_vdf(path):
+    try:
+        with open(path, encoding='utf-8', errors='replace') as f:
+            return parse_vdf(f.read())
+    except OSError:
+        return {}
+
 
 class SteamCachePlugin(JanitorPlugin):
     __title__ = _('Steam Cache')
@@ -23,6 +69,12 @@ class SteamCachePlugin(JanitorPlugin):
         'httpcache',
         'logs',
     )
+    # Relative to the steamapps directory of every library.
+    library_targets = (
+        'temp',
+        'downloading',
+    )
+    max_workers = 4
 
     @classmethod
     def is_active(cls):
@@ -30,24 +82,93 @@ class SteamCachePlugin(JanitorPlugin):
 
     @classmethod
     def _discover_roots(cls):
+        # ~/.steam/steam is usually a symlink to ~/.local/share/Steam.
         roots = []
         for root in cls.cache_roots:
-            expanded_root = os.path.expanduser(root)
-            if os.path.exists(expanded_root):
+            expanded_root = os.path.realpath(os.path.expanduser(root))
+            if os.path.exists(expanded_root) and expanded_root not in roots:
                 roots.append(expanded_root)
         return roots
 
+    @classmethod
+    def _discover_libraries(cls):
+        '''Return the library folders listed in libraryfolders.vdf, the Steam
+        roots first.
+        '''
+        libraries = OrderedDict()
+        for root in cls._discover_roots():
+            libraries[root] = None
+
+            folders = read_vdf(os.path.join(root, 'steamapps', 'libraryfolders.vdf'))
+            folders = folders.get('libraryfolders', {})
+            for key, value in folders.items():
+                # Since 2021 every library is a block with a "path" key,
+                # before that numbered keys were paths themselves.
+                if isinstance(value, dict):
+                    path = value.get('path')
+                elif key.isdigit():
+                    path = value
+                else:
+                    continue
+
+                if path and os.path.isdir(os.path.join(path, 'steamapps')):
+                    libraries[os.path.realpath(path)] = None
+
+        return list(libraries)
+
+    @staticmethod
+    def _read_app_names(steamapps):
+        names = {}
+        for manifest in glob.glob(os.path.join(steamapps, 'appmanifest_*.acf')):
+            state = read_vdf(manifest).get('appstate', {})
+            if state.get('appid'):
+                names[state['appid']] = state.get('name') or state['appid']
+        return names
+
     @classmethod
     def _discover_cache_paths(cls):
+        '''Return [(display name, path)] for the caches of the Steam roots and
+        of every library.
+        '''
         cache_paths = []
         for root_path in cls._discover_roots():
-            if not os.path.exists(root_path):
-                continue
-
             for target in cls.cache_targets:
                 path = os.path.join(root_path, target)
                 if os.path.exists(path):
-                    cache_paths.append(path)
+                    cache_paths.append((target, path))
+
+        libraries = cls._discover_libraries()
+        steamapps = [os.path.join(library, 'steamapps') for library in libraries]
+        app_names = {}
+        for path in steamapps:
+            app_names.update(cls._read_app_names(path))
+
+        # Proton prefixes hold the saves of games which do not use Steam
+        # Cloud, so the ones of uninstalled games are only offered with
+        # "orphan_compatdata = true" in the [SteamCachePlugin] section.
+        orphan_compatdata = cls.get_setting('orphan_compatdata', False, type=bool)
+
+        for library, path in zip(libraries, steamapps):
+            for target in cls.library_targets:
+                target_path = os.path.join(path, target)
+                if os.path.isdir(target_path) and os.listdir(target_path):
+                    cache_paths.append(('%s (%s)' % (target, library), target_path))
+
+            shadercache = os.path.join(path, 'shadercache')
+            if os.path.isdir(shadercache):
+                for app_id in sorted(os.listdir(shadercache)):
+                    cache_paths.append(('shadercache/%s' % app_names.get(app_id, app_id),
+                                        os.path.join(shadercache, app_id)))
+
+            compatdata = os.path.join(path, 'compatdata')
+            if orphan_compatdata and os.path.isdir(compatdata):
+                for app_id in sorted(os.listdir(compatdata)):
+                    # Non-Steam shortcuts have no manifest, their ids do not
+                    # fit in 31 bits.
+                    if not app_id.isdigit() or int(app_id) >= 2 ** 31 or app_id in app_names:
+                        continue
+                    cache_paths.append((_('compatdata/%s (not installed)') % app_id,
+                                        os.path.join(compatdata, app_id)))
 
         return cache_paths
 
@@ -55,42 +176,35 @@ class SteamCachePlugin(JanitorPlugin):
         count = 0
         total_size = 0
 
-        for path in self._discover_cache_paths():
-            try:
-                count += 1
-                size = self._get_path_size(path)
-
-                total_size += int(size)
-                self.emit('find_object',
-                          CacheObject(os.path.basename(path), path, size),
-                          count)
-            except Exception:
-                log.exception("Error while scanning Steam cache path: %s", path)
-                self.emit('scan_error', str(path))
-                return
+        try:
+            cache_paths = self._discover_cache_paths()
+
+            # Libraries usually live on their own disk, every disk is walked
+            # by as many threads as it handles well.
+            paths = [path for name, path in cache_paths]
+            sizes = dict(zip(paths, map_by_device(self.measure_path, paths,
+                                                  max_workers=self.max_workers,
+                                                  cancellable=self.cancellable)))
+        except Exception as e:
+            log.exception("Error while scanning Steam libraries")
+            self.emit('scan_error', str(e))
+            return
+
+        for name, path in cache_paths:
+            count += 1
+            size = sizes[path]
+            total_size += size
+            self.emit('find_object',
+                      CacheObject(name, path, size),
+                      count)
 
         self.emit('scan_finished', True, count, total_size)
 
-    @staticmethod
-    def _get_path_size(path):
-        if os.path.isfile(path):
-            return os.path.getsize(path)
-
-        total_size = 0
-        for root, _, files in os.walk(path):
-            for file_name in files:
-                file_path = os.path.join(root, file_name)
-                try:
-                    total_size += os.path.getsize(file_path)
-                except OSError:
-                    log.debug('Cannot read file size: %s', file_path)
-        return total_size
-
     def clean_cruft(self, cruft_list=[], parent=None):
         for index, cruft in enumerate(cruft_list):
             try:
                 if os.path.isdir(cruft.get_path()):
-                    shutil.rmtree(cruft.get_path())
+                    remove_path(cruft.get_path(), self.cancellable)
                 else:
                     os.remove(cruft.get_path())
                 self.emit('object_cleaned', cruft, index + 1)
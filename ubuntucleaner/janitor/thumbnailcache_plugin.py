@@ -1,5 +1,55 @@
+import os
+import json
+import struct
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote, urlparse
+
 from ubuntucleaner.utils import system
-from ubuntucleaner.janitor import JanitorCachePlugin
+from ubuntucleaner.janitor import CacheEntriesObject, JanitorCachePlugin
+from ubuntucleaner.settings.constants import CACHE_ROOT
+from ubuntucleaner.utils.files import iter_files
+
+log = logging.getLogger('ThumbnailCachePlugin')
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_CHUNK_HEADER = struct.Struct('>I4s')
+
+
+def read_png_text(path, limit=8192):
+    '''Return the tEXt chunks found before the image data of a PNG file,
+    reading at most limit bytes. Thumbnailers write Thumb::URI and
+    Thumb::MTime there, so the first few KB are enough.
+    '''
+    try:
+        with open(path, 'rb') as f:
+            data = f.read(limit)
+    except OSError:
+        return {}
+
+    if not data.startswith(PNG_SIGNATURE):
+        return {}
+
+    texts = {}
+    offset = len(PNG_SIGNATURE)
+    while offset + PNG_CHUNK_HEADER.size <= len(data):
+        length, chunk_type = PNG_CHUNK_HEADER.unpack_from(data, offset)
+        if chunk_type in (b'IDAT', b'IEND'):
+            break
+
+        start = offset + PNG_CHUNK_HEADER.size
+        end = start + length
+        if end > len(data):
+            break
+
+        if chunk_type == b'tEXt':
+            key, _, value = data[start:end].partition(b'\0')
+            texts[key.decode('latin-1')] = value.decode('latin-1')
+
+        # Skip the chunk data and its CRC.
+        offset = end + 4
+
+    return texts
 
 
 class ThumbnailCachePlugin(JanitorCachePlugin):
@@ -10,3 +60,185 @@ class ThumbnailCachePlugin(JanitorCachePlugin):
         root_path = '~/.thumbnails'
     else:
         root_path = '~/.cache/thumbnails'
+
+    # Opt-in with "stale_mode = true" in the [ThumbnailCachePlugin]
+    # section to only offer the thumbnails whose source file is gone or
+    # was modified since the thumbnail was made.
+    verdict_cache = os.path.join(CACHE_ROOT, 'thumbnails.json')
+    max_workers = 8
+    # Sources on removable media are only missing until it is plugged.
+    removable_roots = ('/media/', '/mnt/', '/run/media/')
+
+    def get_cruft(self):
+        if self.get_setting('stale_mode', False, type=bool):
+            self.get_stale_cruft()
+        else:
+            JanitorCachePlugin.get_cruft(self)
+
+    def _list_thumbnails(self):
+        '''Return {size bucket: [(path, mtime_ns, size)]} for every PNG under
+        the thumbnail root, the bucket being its top level directory.
+        '''
+        root_path = self.get_path()
+        buckets = {}
+
+        for bucket in sorted(os.listdir(root_path)):
+            bucket_path = os.path.join(root_path, bucket)
+            if not os.path.isdir(bucket_path):
+                continue
+
+            thumbnails = [(path, st.st_mtime_ns, st.st_size)
+                          for path, st in iter_files(bucket_path, self.cancellable)
+                          if path.endswith('.png')]
+            if thumbnails:
+                buckets[bucket] = thumbnails
+
+        return buckets
+
+    def _load_verdicts(self):
+        try:
+            with open(self.verdict_cache) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_verdicts(self, verdicts):
+        try:
+            os.makedirs(os.path.dirname(self.verdict_cache), exist_ok=True)
+            temp_path = self.verdict_cache + '.tmp'
+            with open(temp_path, 'w') as f:
+                json.dump(verdicts, f)
+            os.replace(temp_path, self.verdict_cache)
+        except OSError as e:
+            log.warning('Cannot save thumbnail verdicts: %s', e)
+
+    @staticmethod
+    def _read_source(path):
+        '''Return (source path, source mtime) of a thumbnail, source path is
+        None for non local or missing URIs.
+        '''
+        texts = read_png_text(path)
+        uri = urlparse(texts.get('Thumb::URI', ''))
+        if uri.scheme != 'file':
+            return None, None
+
+        try:
+            mtime = int(float(texts['Thumb::MTime']))
+        except (KeyError, ValueError):
+            mtime = None
+
+        return unquote(uri.path), mtime
+
+    @classmethod
+    def _stat_directory(cls, item):
+        '''List a source directory once and stat only the wanted names found
+        in it. Returns {name: mtime} for the existing ones, or None if the
+        directory cannot be read (so its thumbnails are kept).
+        '''
+        directory, names = item
+        try:
+            present = names.intersection(os.listdir(directory))
+        except FileNotFoundError:
+            if directory.startswith(cls.removable_roots):
+                return None
+            return {}
+        except OSError:
+            return None
+
+        mtimes = {}
+        for name in present:
+            try:
+                mtimes[name] = int(os.stat(os.path.join(directory, name)).st_mtime)
+            except OSError:
+                mtimes[name] = None
+
+        return mtimes
+
+    def _find_stale(self, thumbnails):
+        '''Return the thumbnails of [(path, mtime_ns, size)] whose source is
+        missing or changed. Parsed PNG headers are cached by thumbnail mtime
+        so unchanged thumbnails are not read again on the next run.
+        '''
+        cached = self._load_verdicts()
+        verdicts = {}
+        to_read = []
+
+        for path, mtime_ns, size in thumbnails:
+            verdict = cached.get(path)
+            if verdict and verdict[0] == mtime_ns:
+                verdicts[path] = verdict
+            else:
+                to_read.append((path, mtime_ns))
+
+        # The workers check for a stop, so that the queued reads end at once.
+        def read_source(path):
+            self.check_cancelled()
+            return self._read_source(path)
+
+        def stat_directory(item):
+            self.check_cancelled()
+            return self._stat_directory(item)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            sources = executor.map(read_source, [path for path, mtime_ns in to_read])
+            for (path, mtime_ns), (source, source_mtime) in zip(to_read, sources):
+                verdicts[path] = [mtime_ns, source, source_mtime]
+
+        self._save_verdicts(verdicts)
+
+        # List every source directory once, so missing sources cost no
+        # stat and existing ones are checked in parallel per directory.
+        wanted = {}
+        for mtime_ns, source, source_mtime in verdicts.values():
+            if source:
+                wanted.setdefault(os.path.dirname(source), set()).add(os.path.basename(source))
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            directories = dict(zip(wanted, executor.map(stat_directory, wanted.items())))
+
+        stale = []
+        for path, mtime_ns, size in thumbnails:
+            source, source_mtime = verdicts[path][1:]
+            if not source:
+                continue
+
+            mtimes = directories[os.path.dirname(source)]
+            if mtimes is None:
+                continue
+
+            name = os.path.basename(source)
+            if name not in mtimes or \
+                    (source_mtime is not None and mtimes[name] not in (None, source_mtime)):
+                stale.append((path, size))
+
+        return stale
+
+    def get_stale_cruft(self):
+        count = 0
+        total_size = 0
+
+        try:
+            buckets = self._list_thumbnails()
+            all_thumbnails = [thumbnail for bucket in buckets.values() for thumbnail in bucket]
+            stale = dict(self._find_stale(all_thumbnails))
+
+            for bucket, thumbnails in sorted(buckets.items()):
+                entries = [path for path, mtime_ns, size in thumbnails if path in stale]
+                if not entries:
+                    continue
+
+                size = sum(stale[path] for path in entries)
+                count += 1
+                total_size += size
+                self.emit('find_object',
+                          CacheEntriesObject(_('%s (%d stale thumbnails)') % (bucket, len(entries)),
+                                             os.path.join(self.get_path(), bucket),
+                                             size,
+                                             entries),
+                          count)
+        except Exception as e:
+            log.exception('Failed to scan stale thumbnails')
+            self.emit('scan_error', str(e))
+            return
+
+        self.emit('scan_finished', True, count, total_size)
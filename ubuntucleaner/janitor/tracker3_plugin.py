@@ -1,27 +1,96 @@
+import glob
 import logging
 import os
-import shutil
+import sqlite3
+import struct
+import subprocess
 
-from ubuntucleaner.janitor import CacheObject, JanitorPlugin
+from ubuntucleaner.janitor import CacheEntriesObject, CacheObject, CruftObject, JanitorPlugin
+from ubuntucleaner.utils.files import as_size, filesizeformat, remove_path
 
 log = logging.getLogger('Tracker3CachePlugin')
 
+# Page size at offset 16 (1 meaning 65536) and freelist page count at
+# offset 36 of the SQLite database header.
+SQLITE_HEADER = b'SQLite format 3\x00'
+SQLITE_PAGE_SIZE = struct.Struct('>H')
+SQLITE_FREELIST_COUNT = struct.Struct('>I')
+
+
+def get_sqlite_free_size(path):
+    '''Return the bytes held by free pages in a SQLite database, which a
+    VACUUM gives back, read from its header without opening it.
+    '''
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(100)
+    except OSError:
+        return 0
+
+    if len(header) < 100 or not header.startswith(SQLITE_HEADER):
+        return 0
+
+    page_size = SQLITE_PAGE_SIZE.unpack_from(header, 16)[0]
+    if page_size == 1:
+        page_size = 65536
+    return SQLITE_FREELIST_COUNT.unpack_from(header, 36)[0] * page_size
+
+
+class TrackerDatabaseObject(CruftObject):
+    '''The databases of one tracker3 miner, either compacted in place
+    (checkpoint of the -wal file and VACUUM) or deleted with the whole
+    miner directory so that the miner indexes again.
+    '''
+
+    __slots__ = ('databases', 'compact')
+
+    def __init__(self, name, path, size, databases, compact):
+        self.name = name
+        self.path = path
+        self.size = as_size(size)
+        self.databases = databases
+        self.compact = compact
+
+    def get_path(self):
+        return self.path
+
+    def get_databases(self):
+        return self.databases
+
+    def is_compact(self):
+        return self.compact
+
+    def get_size_display(self):
+        return filesizeformat(self.size)
+
 
 class Tracker3CachePlugin(JanitorPlugin):
     __title__ = _('Tracker3 Cache')
     __category__ = 'system'
 
     cache_paths = (
-        '~/.cache/tracker3',
         '~/.cache/tracker',
         '~/.cache/gnome-software',
+    )
+    # Every subdirectory holding *.db files is the store of one miner, e.g.
+    # ~/.cache/tracker3/files for tracker-miner-fs-3.
+    database_roots = (
+        '~/.cache/tracker3',
         '~/.local/share/tracker3',
         '~/.local/share/Tracker3',
     )
+    miner_units = (
+        'tracker-miner-fs-3.service',
+        'tracker-extract-3.service',
+        'tracker-miner-rss-3.service',
+        'tracker-writeback-3.service',
+    )
 
     @classmethod
     def is_active(cls):
-        return cls.__utactive__ and bool(cls._discover_cache_paths())
+        return cls.__utactive__ and (bool(cls._discover_cache_paths()) or
+                                     bool(cls._discover_miners()) or
+                                     bool(cls._discover_remainders()))
 
     @classmethod
     def _discover_cache_paths(cls):
@@ -40,13 +109,69 @@ class Tracker3CachePlugin(JanitorPlugin):
             discovered.append(expanded)
         return discovered
 
+    @classmethod
+    def _discover_miners(cls):
+        '''Return [(display name, miner directory, [databases])], listing only
+        the database roots and their direct subdirectories.
+        '''
+        miners = []
+        for root in cls.database_roots:
+            root = os.path.expanduser(root)
+            try:
+                children = sorted(os.listdir(root))
+            except OSError:
+                continue
+
+            for child in children:
+                path = os.path.join(root, child)
+                databases = sorted(glob.glob(os.path.join(glob.escape(path), '*.db')))
+                if databases:
+                    miners.append(('%s/%s' % (os.path.basename(root), child), path, databases))
+
+        return miners
+
+    @classmethod
+    def _discover_remainders(cls):
+        '''Return [(display name, database root, [entries])] for what the
+        database roots hold besides the miner directories.
+        '''
+        miners = set(path for name, path, databases in cls._discover_miners())
+        remainders = []
+        for root in cls.database_roots:
+            root = os.path.expanduser(root)
+            try:
+                children = sorted(os.listdir(root))
+            except OSError:
+                continue
+
+            entries = [os.path.join(root, child) for child in children
+                       if os.path.join(root, child) not in miners]
+            if entries:
+                remainders.append((os.path.basename(root), root, entries))
+
+        return remainders
+
+    @staticmethod
+    def _get_reclaimable_size(databases):
+        '''Return the bytes a checkpoint and VACUUM would give back: the -wal
+        files, truncated by the checkpoint, plus the free pages.
+        '''
+        size = 0
+        for database in databases:
+            try:
+                size += os.path.getsize(database + '-wal')
+            except OSError:
+                pass
+            size += get_sqlite_free_size(database)
+        return size
+
     def get_cruft(self):
         count = 0
         total_size = 0
 
         for path in self._discover_cache_paths():
             try:
-                size = self._du(path)
+                size = self.measure_path(path)
                 count += 1
                 total_size += int(size)
                 self.emit('find_object',
@@ -57,24 +182,125 @@ class Tracker3CachePlugin(JanitorPlugin):
                 self.emit('scan_error', path)
                 return
 
+        for name, path, databases in self._discover_miners():
+            try:
+                reclaimable = self._get_reclaimable_size(databases)
+                if reclaimable:
+                    # Not added to the total, deleting gives this back too.
+                    count += 1
+                    self.emit('find_object',
+                              TrackerDatabaseObject(_('%s (compact databases)') % name,
+                                                    path, reclaimable, databases, True),
+                              count)
+
+                size = self.measure_path(path)
+                count += 1
+                total_size += size
+                self.emit('find_object',
+                          TrackerDatabaseObject(_('%s (delete databases and index again)') % name,
+                                                path, size, databases, False),
+                          count)
+            except Exception:
+                log.exception('Failed to scan tracker3 databases: %s', path)
+                self.emit('scan_error', path)
+                return
+
+        for name, path, entries in self._discover_remainders():
+            try:
+                seen_inodes = set()
+                size = sum(self.measure_path(entry, seen_inodes=seen_inodes) for entry in entries)
+                count += 1
+                total_size += size
+                self.emit('find_object',
+                          CacheEntriesObject(_('%s (other files)') % name, path, size, entries),
+                          count)
+            except Exception:
+                log.exception('Failed to scan tracker3 path: %s', path)
+                self.emit('scan_error', path)
+                return
+
         self.emit('scan_finished', True, count, total_size)
 
-    def clean_cruft(self, cruft_list=[], parent=None):
-        for index, cruft in enumerate(cruft_list):
+    @classmethod
+    def _get_active_miners(cls):
+        active = []
+        for unit in cls.miner_units:
             try:
-                if not os.path.exists(cruft.get_path()):
-                    self.emit('object_cleaned', cruft, index + 1)
-                    continue
+                result = subprocess.run(['systemctl', '--user', 'is-active', '--quiet', unit])
+            except OSError:
+                return []
+            if result.returncode == 0:
+                active.append(unit)
+        return active
 
-                if os.path.isdir(cruft.get_path()):
-                    shutil.rmtree(cruft.get_path())
-                else:
-                    os.remove(cruft.get_path())
-                self.emit('object_cleaned', cruft, index + 1)
-            except Exception:
-                log.exception('Failed to clean tracker3 cache: %s', cruft.get_name())
-                self.emit('clean_error', cruft.get_name())
-                break
+    @staticmethod
+    def _control_miners(action, units):
+        if not units:
+            return
+        try:
+            subprocess.run(['systemctl', '--user', action] + list(units),
+                           stdout=subprocess.PIPE,
+                           stderr=subprocess.PIPE)
+        except OSError as e:
+            log.warning('Cannot %s tracker3 miners: %s', action, e)
+
+    @staticmethod
+    def _compact_databases(databases):
+        for database in databases:
+            connection = sqlite3.connect(database)
+            try:
+                connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+                connection.execute('VACUUM')
+            finally:
+                connection.close()
+
+    def clean_cruft(self, cruft_list=[], parent=None):
+        databases = [cruft for cruft in cruft_list if isinstance(cruft, TrackerDatabaseObject)]
+        deleted = set(cruft.get_path() for cruft in databases if not cruft.is_compact())
+
+        # The miners keep their databases open, stop them while they are
+        # compacted or deleted and start them again afterwards.
+        if databases or any(isinstance(cruft, CacheEntriesObject) for cruft in cruft_list):
+            stopped = self._get_active_miners()
+        else:
+            stopped = []
+        self._control_miners('stop', stopped)
+
+        try:
+            for index, cruft in enumerate(cruft_list):
+                try:
+                    if isinstance(cruft, TrackerDatabaseObject) and cruft.is_compact():
+                        # Nothing to compact in a miner directory being deleted.
+                        if cruft.get_path() not in deleted:
+                            self._compact_databases(cruft.get_databases())
+                        self.emit('object_cleaned', cruft, index + 1)
+                        continue
+
+                    if isinstance(cruft, CacheEntriesObject):
+                        for entry in cruft.get_entries():
+                            self.check_cancelled()
+                            if os.path.isdir(entry) and not os.path.islink(entry):
+                                remove_path(entry, self.cancellable)
+                            elif os.path.lexists(entry):
+                                os.remove(entry)
+                        self.emit('object_cleaned', cruft, index + 1)
+                        continue
+
+                    if not os.path.exists(cruft.get_path()):
+                        self.emit('object_cleaned', cruft, index + 1)
+                        continue
+
+                    if os.path.isdir(cruft.get_path()):
+                        remove_path(cruft.get_path(), self.cancellable)
+                    else:
+                        os.remove(cruft.get_path())
+                    self.emit('object_cleaned', cruft, index + 1)
+                except Exception:
+                    log.exception('Failed to clean tracker3 cache: %s', cruft.get_name())
+                    self.emit('clean_error', cruft.get_name())
+                    break
+        finally:
+            self._control_miners('start', stopped)
 
         self.emit('all_cleaned', True)
 
@@ -82,21 +308,3 @@ class Tracker3CachePlugin(JanitorPlugin):
         if count:
             return '[%d] %s' % (count, self.__title__)
         return '%s (No tracker3 cache to be cleaned)' % self.__title__
-
-    @staticmethod
-    def _du(path):
-        if os.path.isfile(path):
-            try:
-                return os.path.getsize(path)
-            except OSError:
-                return 0
-
-        total_size = 0
-        for root, _, files in os.walk(path):
-            for filename in files:
-                full_path = os.path.join(root, filename)
-                try:
-                    total_size += os.path.getsize(full_path)
-                except OSError:
-                    pass
-        return total_size
@@ -23,6 +23,7 @@ DATA_DIR = '/usr/share/ubuntu-cleaner/'
 APP = applize(PACKAGE)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 CONFIG_ROOT = os.path.join(GLib.get_user_config_dir(), 'ubuntu-cleaner')
+CACHE_ROOT = os.path.join(GLib.get_user_cache_dir(), 'ubuntu-cleaner')
 IS_INSTALLED = True
 
 if not os.path.exists(CONFIG_ROOT):
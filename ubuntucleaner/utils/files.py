@@ -1,4 +1,17 @@
+import os
+import re
+import sys
+import math
+import stat
+import time
+import fcntl
+import random
+import struct
 import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 from gettext import ngettext
 from gettext import gettext as _
@@ -6,12 +19,109 @@ from gettext import gettext as _
 
 log = logging.getLogger('utils.files')
 
+# Directories never worth descending into when looking for projects.
+PRUNED_DIRECTORIES = frozenset(('.git', '.hg', '.svn', 'node_modules'))
+# Files between two progress calls of get_path_size.
+PROGRESS_ENTRIES = 1024
+
+# Walks run at once on one device, see get_device_workers().
+ROTATIONAL_WORKERS = 1
+SOLID_STATE_WORKERS = 4
+NVME_WORKERS = 8
+DEFAULT_WORKERS = 4
+
+# Filesystems whose files can share extents (reflinks, snapshots).
+REFLINK_FILESYSTEMS = frozenset(('btrfs', 'xfs'))
+# _IOWR('f', 11, struct fiemap) and the layouts of struct fiemap and
+# struct fiemap_extent from linux/fiemap.h.
+FS_IOC_FIEMAP = 0xC020660B
+FIEMAP_HEADER = struct.Struct('=QQLLLL')
+FIEMAP_EXTENT = struct.Struct('=QQQ16xL12x')
+FIEMAP_MAX_OFFSET = 2 ** 64 - 1
+FIEMAP_EXTENT_LAST = 0x1
+FIEMAP_EXTENT_SHARED = 0x2000
+FIEMAP_BATCH = 128
+
+
+class Cancelled(BaseException):
+    """
+    Raised in a worker thread once its Cancellable is cancelled. Like
+    KeyboardInterrupt it is not an Exception, so that the "except Exception"
+    of the plugins do not report a cancelled scan as an error.
+    """
+
+
+class Cancellable(object):
+    """
+    A cancellation token shared between the UI and a worker thread. The
+    walkers and deleters below check it between entries.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    def is_cancelled(self):
+        return self._event.is_set()
+
+    def check(self):
+        if self._event.is_set():
+            raise Cancelled()
+
+
+def _check(cancellable):
+    if cancellable is not None:
+        cancellable.check()
+
+
+class ApproximateSize(int):
+    """
+    A size estimated by estimate_path_size, error being the bound of its
+    error in bytes.
+    """
+
+    def __new__(cls, size, error):
+        value = int.__new__(cls, size)
+        value.error = int(error)
+        return value
+
+
+class ExclusiveSize(int):
+    """
+    The bytes held by the extents of a tree that no other file shares,
+    shared being the bytes of its shared extents, see get_exclusive_size.
+    """
+
+    def __new__(cls, size, shared):
+        value = int.__new__(cls, size)
+        value.shared = int(shared)
+        return value
+
+
+def as_size(value):
+    """
+    Returns value (an int, a float or the output of du) as an int, keeping
+    an ApproximateSize or an ExclusiveSize as is.
+    """
+    if isinstance(value, int):
+        return value
+    return int(value)
+
 
 def filesizeformat(bytes):
     """
     Formats the value like a 'human-readable' file size (i.e. 13 KB, 4.1 MB,
-    102 bytes, etc).
+    102 bytes, etc). An ApproximateSize is prefixed with "~" and the shared
+    bytes of an ExclusiveSize follow it.
     """
+    if getattr(bytes, 'error', 0):
+        return "~" + filesizeformat(int(bytes))
+    if getattr(bytes, 'shared', 0):
+        return _("%(size)s (+%(shared)s shared)") % {'size': filesizeformat(int(bytes)),
+                                                     'shared': filesizeformat(bytes.shared)}
+
     try:
         bytes = float(bytes)
     except TypeError:
@@ -24,3 +134,601 @@ def filesizeformat(bytes):
     if bytes < 1024 * 1024 * 1024:
         return _("%.1f MB") % (bytes / (1024 * 1024))
     return _("%.1f GB") % (bytes / (1024 * 1024 * 1024))
+
+
+def iter_files(path, cancellable=None):
+    """
+    Yields (path, stat) for every file below path (or for path itself if it
+    is not a directory) in a single os.scandir pass, without following
+    symlinks. Unreadable entries are skipped.
+
+    Raises Cancelled once cancellable is cancelled.
+    """
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return
+
+    if not stat.S_ISDIR(st.st_mode):
+        yield path, st
+        return
+
+    stack = [path]
+    while stack:
+        try:
+            iterator = os.scandir(stack.pop())
+        except OSError:
+            continue
+
+        with iterator:
+            for entry in iterator:
+                _check(cancellable)
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                        continue
+
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+
+                yield entry.path, st
+
+
+def get_path_size(path, seen_inodes=None, cancellable=None, progress=None):
+    """
+    Returns the apparent size in bytes of a file or a directory tree, walking
+    it in-process with os.scandir instead of forking `du`. Symlinks are not
+    followed.
+
+    If seen_inodes is a set, files whose (st_dev, st_ino) is already in it
+    are skipped and new ones are added, so hardlinked trees (OSTree
+    checkouts, pnpm stores...) are only counted once.
+
+    progress(size, entries) is called with the bytes and files counted so
+    far every PROGRESS_ENTRIES files and once at the end. The walk holds a
+    slot of the device of path, see DeviceSlots.
+    """
+    total_size = 0
+    entries = 0
+    with device_slots.hold(path, cancellable):
+        for file_path, st in iter_files(path, cancellable):
+            entries += 1
+            if progress is not None and not entries % PROGRESS_ENTRIES:
+                progress(total_size, entries)
+
+            if seen_inodes is not None and st.st_nlink > 1:
+                key = (st.st_dev, st.st_ino)
+                if key in seen_inodes:
+                    continue
+                seen_inodes.add(key)
+
+            total_size += st.st_size
+
+    if progress is not None:
+        progress(total_size, entries)
+
+    return total_size
+
+
+def _unescape_mount_path(path):
+    return re.sub(r'\\([0-7]{3})', lambda match: chr(int(match.group(1), 8)), path)
+
+
+def _get_mount(path):
+    """
+    Returns (mount point, filesystem type, source) of the mount holding
+    path, read from /proc/self/mountinfo, None if it is unknown.
+    """
+    path = os.path.realpath(path)
+    mount_point = ''
+    found = None
+    try:
+        with open('/proc/self/mountinfo') as f:
+            for line in f:
+                mount, separator, source = line.partition(' - ')
+                mount = mount.split()
+                source = source.split()
+                if not separator or len(mount) < 5 or not source:
+                    continue
+
+                candidate = _unescape_mount_path(mount[4])
+                if (path == candidate or path.startswith(candidate.rstrip('/') + '/')) and \
+                        len(candidate) >= len(mount_point):
+                    mount_point = candidate
+                    found = (candidate, source[0], source[1] if len(source) > 1 else None)
+    except OSError:
+        return None
+
+    return found
+
+
+def get_filesystem_type(path):
+    """
+    Returns the type of the filesystem holding path ('btrfs', 'ext4'...),
+    None if it is unknown.
+    """
+    mount = _get_mount(path)
+    return mount[1] if mount else None
+
+
+def get_device_workers(device, path=None):
+    """
+    Returns how many walks should run at once on device (an st_dev): one
+    on a rotational disk, where concurrent walks only make the head seek,
+    more on SSDs and most on NVMe drives, read from
+    /sys/dev/block/<major>:<minor>/queue/rotational.
+
+    Devices without a block device of their own (btrfs subvolumes, major 0)
+    are looked up by the source of the mount of path.
+    """
+    if device is None:
+        return DEFAULT_WORKERS
+
+    if not os.major(device):
+        mount = _get_mount(path) if path is not None else None
+        if not mount or not mount[2] or not mount[2].startswith('/dev/'):
+            return DEFAULT_WORKERS
+        try:
+            device = os.stat(mount[2]).st_rdev
+        except OSError:
+            return DEFAULT_WORKERS
+
+    sys_path = os.path.realpath('/sys/dev/block/%d:%d' % (os.major(device), os.minor(device)))
+    # A partition has no queue of its own, its disk is its parent.
+    for disk in (sys_path, os.path.dirname(sys_path)):
+        try:
+            with open(os.path.join(disk, 'queue', 'rotational')) as f:
+                rotational = f.read().strip()
+        except OSError:
+            continue
+
+        if rotational == '1':
+            return ROTATIONAL_WORKERS
+        if os.path.basename(disk).startswith('nvme'):
+            return NVME_WORKERS
+        return SOLID_STATE_WORKERS
+
+    return DEFAULT_WORKERS
+
+
+class DeviceSlots(object):
+    """
+    Limits the walks running at once on every device to its
+    get_device_workers(), whichever plugin or thread they come from, so
+    that the plugins scanning one HDD take turns while the walks of other
+    devices go on. A thread holding the slot of a device walks it again
+    without waiting.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._semaphores = {}
+        self._workers = {}
+        self._local = threading.local()
+
+    @staticmethod
+    def get_device(path):
+        try:
+            return os.lstat(path).st_dev
+        except OSError:
+            return None
+
+    def get_workers(self, device, path=None):
+        with self._lock:
+            if device not in self._workers:
+                self._workers[device] = get_device_workers(device, path)
+                self._semaphores[device] = threading.Semaphore(self._workers[device])
+            return self._workers[device]
+
+    def is_held(self, device):
+        return device in getattr(self._local, 'held', ())
+
+    @contextmanager
+    def hold(self, path, cancellable=None):
+        """
+        Waits for a slot of the device of path, raises Cancelled if
+        cancellable is cancelled meanwhile.
+        """
+        device = self.get_device(path)
+        if device is None or self.is_held(device):
+            yield
+            return
+
+        self.get_workers(device, path)
+        semaphore = self._semaphores[device]
+        while not semaphore.acquire(timeout=0.1):
+            _check(cancellable)
+
+        held = self._local.__dict__.setdefault('held', set())
+        held.add(device)
+        try:
+            yield
+        finally:
+            held.discard(device)
+            semaphore.release()
+
+
+device_slots = DeviceSlots()
+
+
+def map_by_device(func, items, key=None, max_workers=None, cancellable=None):
+    """
+    Returns [func(item) for item in items], the items being grouped by the
+    device of their path (key(item), or the item itself) and every group
+    run by a pool of its own of get_device_workers() threads (at most
+    max_workers), holding a slot of its device. The devices are walked
+    in parallel, each by the number of walkers it handles well.
+
+    Items on a device whose slot the calling thread holds are run in it.
+    """
+    groups = OrderedDict()
+    for index, item in enumerate(items):
+        path = key(item) if key else item
+        groups.setdefault(device_slots.get_device(path), []).append(index)
+
+    def call(item):
+        with device_slots.hold(key(item) if key else item, cancellable):
+            return func(item)
+
+    results = [None] * len(items)
+    executors = []
+    futures = []
+    try:
+        for device, indexes in groups.items():
+            if device is not None and device_slots.is_held(device):
+                for index in indexes:
+                    results[index] = func(items[index])
+                continue
+
+            workers = device_slots.get_workers(device, key(items[indexes[0]]) if key else items[indexes[0]])
+            if max_workers:
+                workers = min(workers, max_workers)
+            executor = ThreadPoolExecutor(max_workers=min(workers, len(indexes)))
+            executors.append(executor)
+            futures.extend((index, executor.submit(call, items[index])) for index in indexes)
+
+        for index, future in futures:
+            results[index] = future.result()
+    finally:
+        for index, future in futures:
+            future.cancel()
+        for executor in executors:
+            executor.shutdown()
+
+    return results
+
+
+def _scan_links(path, cancellable=None):
+    size = 0
+    linked = {}
+    for file_path, st in iter_files(path, cancellable):
+        if not stat.S_ISREG(st.st_mode):
+            continue
+        if st.st_nlink == 1:
+            size += st.st_size
+            continue
+
+        key = (st.st_dev, st.st_ino)
+        if key in linked:
+            linked[key][2] += 1
+        else:
+            linked[key] = [st.st_size, st.st_nlink, 1]
+    return size, linked
+
+
+def get_unshared_sizes(paths, other_links=0, max_workers=None, cancellable=None):
+    """
+    Returns the apparent sizes of the trees of paths, counting only what
+    removing all of them frees: a hardlinked file counts if all its links
+    are inside the trees, other_links aside, and then only for the last
+    tree holding it. The trees are walked by map_by_device().
+    """
+    scans = map_by_device(lambda path: _scan_links(path, cancellable), paths,
+                          max_workers=max_workers, cancellable=cancellable)
+
+    links = {}
+    for size, linked in scans:
+        for key, (file_size, nlink, found) in linked.items():
+            links[key] = links.get(key, 0) + found
+
+    sizes = []
+    seen_inodes = set()
+    for size, linked in reversed(scans):
+        for key, (file_size, nlink, found) in linked.items():
+            if key not in seen_inodes and nlink <= links[key] + other_links:
+                size += file_size
+        seen_inodes.update(linked)
+        sizes.append(size)
+    sizes.reverse()
+    return sizes
+
+
+def iter_extents(fd):
+    """
+    Yields (logical, physical, length, flags) for the extents of an open
+    file, using the FIEMAP ioctl.
+    """
+    buffer = bytearray(FIEMAP_HEADER.size + FIEMAP_BATCH * FIEMAP_EXTENT.size)
+    start = 0
+    while True:
+        FIEMAP_HEADER.pack_into(buffer, 0, start, FIEMAP_MAX_OFFSET - start, 0, 0, FIEMAP_BATCH, 0)
+        fcntl.ioctl(fd, FS_IOC_FIEMAP, buffer)
+
+        mapped = FIEMAP_HEADER.unpack_from(buffer, 0)[3]
+        if not mapped:
+            return
+
+        for index in range(mapped):
+            logical, physical, length, flags = FIEMAP_EXTENT.unpack_from(
+                buffer, FIEMAP_HEADER.size + index * FIEMAP_EXTENT.size)
+            yield logical, physical, length, flags
+            if flags & FIEMAP_EXTENT_LAST:
+                return
+
+        start = logical + length
+
+
+def get_exclusive_size(path, seen_inodes=None, cancellable=None, progress=None):
+    """
+    Returns the ExclusiveSize of a file or a directory tree on a reflink
+    filesystem: the bytes of the extents flagged as not shared, which
+    removing the tree frees, and the bytes of the shared ones, each shared
+    extent counted once. Extents only shared inside the tree are counted
+    as shared too, so the exclusive size errs on the low side.
+
+    Files whose extents cannot be read count with their apparent size.
+    seen_inodes and progress are used as by get_path_size.
+    """
+    if seen_inodes is None:
+        seen_inodes = set()
+    exclusive_size = 0
+    shared_size = 0
+    shared_extents = set()
+    entries = 0
+
+    with device_slots.hold(path, cancellable):
+        for file_path, st in iter_files(path, cancellable):
+            entries += 1
+            if progress is not None and not entries % PROGRESS_ENTRIES:
+                progress(exclusive_size, entries)
+
+            if st.st_nlink > 1:
+                key = (st.st_dev, st.st_ino)
+                if key in seen_inodes:
+                    continue
+                seen_inodes.add(key)
+
+            if not stat.S_ISREG(st.st_mode) or not st.st_size:
+                continue
+
+            try:
+                fd = os.open(file_path, os.O_RDONLY | os.O_NOFOLLOW | os.O_NONBLOCK)
+            except OSError:
+                exclusive_size += st.st_size
+                continue
+
+            try:
+                for logical, physical, length, flags in iter_extents(fd):
+                    if not flags & FIEMAP_EXTENT_SHARED:
+                        exclusive_size += length
+                    elif (physical, length) not in shared_extents:
+                        shared_extents.add((physical, length))
+                        shared_size += length
+            except OSError:
+                exclusive_size += st.st_size
+            finally:
+                os.close(fd)
+
+    if progress is not None:
+        progress(exclusive_size, entries)
+
+    return ExclusiveSize(exclusive_size, shared_size)
+
+
+class _Estimate(object):
+    """State shared by the directories of one estimate_path_size call."""
+
+    def __init__(self, deadline, cancellable):
+        self.deadline = deadline
+        self.cancellable = cancellable
+        self.bytes = 0
+        self.directories = 0
+        self.extrapolated = False
+
+    def expired(self):
+        return time.monotonic() > self.deadline
+
+    def get_directory_mean(self):
+        if not self.directories:
+            return 0
+        return self.bytes / self.directories
+
+
+def _estimate_tree(path, state):
+    """
+    Returns (estimated size, variance) of the tree below path. Entries are
+    listed and sized until the deadline and directories are walked in a
+    random order. Directories left at the deadline are extrapolated from
+    the sizes of their walked siblings. The unlisted rest of a directory is
+    counted as much again as its listed part, fully uncertain.
+    """
+    size = 0
+    variance = 0
+    directories = []
+    truncated = False
+    try:
+        with os.scandir(path) as iterator:
+            for entry in iterator:
+                _check(state.cancellable)
+                if state.expired():
+                    truncated = True
+                    break
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        directories.append(entry.path)
+                        continue
+                    size += entry.stat(follow_symlinks=False).st_size
+                except OSError:
+                    continue
+    except OSError:
+        pass
+
+    state.bytes += size
+    state.directories += 1
+
+    # Seeded by the path so that the same tree gives the same estimate.
+    random.Random(path).shuffle(directories)
+    subtrees = []
+    for directory in directories:
+        if state.expired():
+            break
+        subtree_size, subtree_variance = _estimate_tree(directory, state)
+        subtrees.append(subtree_size)
+        variance += subtree_variance
+
+    size += sum(subtrees)
+    left = len(directories) - len(subtrees)
+    if left:
+        state.extrapolated = True
+        if len(subtrees) >= 2:
+            mean = sum(subtrees) / len(subtrees)
+            sample_variance = sum((subtree - mean) ** 2 for subtree in subtrees) / (len(subtrees) - 1)
+            size += left * mean
+            variance += left ** 2 * sample_variance / len(subtrees) * left / len(directories)
+        else:
+            # Too few siblings to extrapolate from, use the mean of all the
+            # directories seen so far and count it as fully uncertain.
+            mean = subtrees[0] if subtrees else state.get_directory_mean()
+            size += left * mean
+            variance += (left * mean) ** 2
+
+    if truncated:
+        state.extrapolated = True
+        variance += size ** 2
+        size *= 2
+
+    return size, variance
+
+
+def estimate_path_size(path, time_budget=0.5, cancellable=None):
+    """
+    Returns the apparent size of a file or a directory tree, walking it for
+    at most time_budget seconds, waiting for the device included. If the
+    walk does not end in time the rest of the tree is extrapolated and an
+    ApproximateSize is returned, its error being twice the standard
+    deviation of the estimate (about 95% of the estimates are within it).
+    Hardlinks are counted for every link.
+    """
+    deadline = time.monotonic() + time_budget
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return 0
+
+    if not stat.S_ISDIR(st.st_mode):
+        return st.st_size
+
+    with device_slots.hold(path, cancellable):
+        state = _Estimate(deadline, cancellable)
+        size, variance = _estimate_tree(path, state)
+    if not state.extrapolated:
+        return int(size)
+    return ApproximateSize(round(size), max(1, math.ceil(2 * math.sqrt(variance))))
+
+
+def _find_in_tree(top, depth, match, prune, max_depth, cancellable=None):
+    found = []
+    with device_slots.hold(top, cancellable):
+        stack = [(top, depth)]
+        while stack:
+            _check(cancellable)
+            path, depth = stack.pop()
+            try:
+                with os.scandir(path) as iterator:
+                    entries = list(iterator)
+            except OSError:
+                continue
+
+            if match(path, set(entry.name for entry in entries)):
+                found.append(path)
+
+            if depth >= max_depth:
+                continue
+
+            for entry in entries:
+                if entry.name in prune:
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append((entry.path, depth + 1))
+                except OSError:
+                    continue
+
+    return found
+
+
+def find_directories(roots, match, prune=PRUNED_DIRECTORIES, max_depth=6, max_workers=4,
+                     cancellable=None):
+    """
+    Returns the sorted directories below roots (down to max_depth levels)
+    for which match(path, names) is true, names being the set of entry
+    names of the directory. Directories named in prune and symlinks are not
+    descended into. The subtrees of every root are walked in parallel, by at
+    most max_workers threads per device.
+
+    Raises Cancelled once cancellable is cancelled.
+    """
+    found = []
+    subtrees = []
+    for root in roots:
+        found.extend(_find_in_tree(root, max_depth, match, prune, max_depth, cancellable))
+        if max_depth < 1:
+            continue
+
+        try:
+            with os.scandir(root) as iterator:
+                for entry in iterator:
+                    if entry.name not in prune and entry.is_dir(follow_symlinks=False):
+                        subtrees.append(entry.path)
+        except OSError:
+            continue
+
+    for paths in map_by_device(lambda top: _find_in_tree(top, 1, match, prune, max_depth, cancellable),
+                               subtrees, max_workers=max_workers, cancellable=cancellable):
+        found.extend(paths)
+
+    return sorted(set(found))
+
+
+def remove_path(path, cancellable=None, onerror=None):
+    """
+    Removes a file, a symlink or a directory tree without following
+    symlinks, like shutil.rmtree but checking cancellable between entries:
+    a cancelled removal raises Cancelled and leaves the rest of the tree.
+
+    onerror(function, path, exc_info) is called for the entries which
+    cannot be removed, as by shutil.rmtree, errors are raised otherwise.
+    """
+    def remove(function, path):
+        try:
+            function(path)
+        except OSError:
+            if onerror is None:
+                raise
+            onerror(function, path, sys.exc_info())
+
+    if os.path.islink(path) or not os.path.isdir(path):
+        remove(os.remove, path)
+        return
+
+    for root, dirs, files in os.walk(path, topdown=False):
+        for name in files:
+            _check(cancellable)
+            remove(os.remove, os.path.join(root, name))
+        for name in dirs:
+            # Symlinks to directories are listed but not walked.
+            if os.path.islink(os.path.join(root, name)):
+                _check(cancellable)
+                remove(os.remove, os.path.join(root, name))
+        remove(os.rmdir, root)
@@ -1,6 +1,8 @@
 import logging
 import os
 import random
+import threading
+from collections import OrderedDict
 
 from gi.repository import GdkPixbuf, Gio, Gtk
 
@@ -13,6 +15,44 @@ DEFAULT_SIZE = 24
 DEFAULT_ICON = 'application-x-executable'
 
 
+class PixbufCache(object):
+    '''A bounded least recently used cache of the pixbufs loaded from the
+    icon theme, so that result rows sharing an icon do not look it up and
+    load it again.
+    '''
+
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self._pixbufs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, loader):
+        with self._lock:
+            if key in self._pixbufs:
+                self._pixbufs.move_to_end(key)
+                return self._pixbufs[key]
+
+        pixbuf = loader()
+
+        with self._lock:
+            self._pixbufs[key] = pixbuf
+            while len(self._pixbufs) > self.max_size:
+                self._pixbufs.popitem(last=False)
+
+        return pixbuf
+
+    def clear(self):
+        with self._lock:
+            self._pixbufs.clear()
+
+    def __len__(self):
+        return len(self._pixbufs)
+
+
+pixbuf_cache = PixbufCache()
+icontheme.connect('changed', lambda theme: pixbuf_cache.clear())
+
+
 def _icon_exists(name, size=DEFAULT_SIZE):
     try:
         return icontheme.lookup_icon(name, size, Gtk.IconLookupFlags.USE_BUILTIN) is not None
@@ -30,6 +70,7 @@ def get_from_name(name=DEFAULT_ICON,
     if force_reload:
         global icontheme
         icontheme = Gtk.IconTheme.get_default()
+        pixbuf_cache.clear()
 
     if only_path:
         path = icontheme.lookup_icon(name, size, Gtk.IconLookupFlags.USE_BUILTIN)
@@ -89,6 +130,31 @@ def get_from_mime_type(mime, size=DEFAULT_SIZE):
         return get_from_name(size=size)
 
 
+def get_from_key(key):
+    '''Return the pixbuf of an icon key, as stored in the result view:
+    ('name', name, alter, size), ('mime', mime, size) or ('path', path,
+    size). Keys go through the pixbuf cache, paths are first mapped to the
+    key of their folder or mime type icon.
+    '''
+    if key[0] == 'path':
+        key = guess_key_from_path(key[1], key[2])
+
+    if key[0] == 'mime':
+        return pixbuf_cache.get(key, lambda: get_from_mime_type(key[1], key[2]))
+
+    return pixbuf_cache.get(key, lambda: get_from_name(key[1], alter=key[2], size=key[3]))
+
+
+def get_cached_from_name(name=DEFAULT_ICON, alter=DEFAULT_ICON, size=DEFAULT_SIZE):
+    '''Like get_from_name(), through the pixbuf cache.'''
+    return get_from_key(('name', name, alter, size))
+
+
+def get_cached_from_mime_type(mime, size=DEFAULT_SIZE):
+    '''Like get_from_mime_type(), through the pixbuf cache.'''
+    return get_from_key(('mime', mime, size))
+
+
 def get_from_file(file, size=DEFAULT_SIZE, only_path=False):
     try:
         return GdkPixbuf.Pixbuf.new_from_file_at_size(file, size, size)
@@ -115,17 +181,27 @@ def get_from_app(app, size=DEFAULT_SIZE):
         return get_from_name(size=size)
 
 
-def guess_from_path(filepath, size=DEFAULT_SIZE):
+def guess_mime_type(filepath):
+    '''Guess the content type of a file from its name only, so that the file
+    is never opened.
+    '''
+    mime_type, uncertain = Gio.content_type_guess(os.path.basename(filepath), None)
+    return mime_type
+
+
+def guess_key_from_path(filepath, size=DEFAULT_SIZE):
     if os.path.isdir(filepath):
-        return get_from_name('folder', size)
+        return ('name', 'folder', DEFAULT_ICON, size)
 
     try:
-        with open(filepath, 'rb') as f:
-            mime_type, result = Gio.content_type_guess(filepath, f.read(10))
-        return get_from_mime_type(mime_type, size)
+        return ('mime', guess_mime_type(filepath), size)
     except Exception as e:
-        log.error('guess_from_path failed: %s' % e)
-        return get_from_name(size=size)
+        log.error('guess_key_from_path failed: %s' % e)
+        return ('name', DEFAULT_ICON, DEFAULT_ICON, size)
+
+
+def guess_from_path(filepath, size=DEFAULT_SIZE):
+    return get_from_key(guess_key_from_path(filepath, size))
 
 
 if __name__ == '__main__':
@@ -8,11 +8,11 @@ import aptdaemon.errors
 from aptdaemon.enums import *
 from aptdaemon.gtk3widgets import AptErrorDialog, AptProgressDialog, AptConfirmDialog
 
-from gi.repository import Gtk, Gdk
+from gi.repository import Gtk
 
 from defer import inline_callbacks
 
-from ubuntucleaner.gui.gtk import post_ui
+from ubuntucleaner.gui.gtk import post_dialog
 from ubuntucleaner.settings.debug import log_func
 
 log = logging.getLogger('package')
@@ -64,11 +64,9 @@ class NewAptProgressDialog(AptProgressDialog):
         if close:
             self.hide()
             if status == EXIT_FAILED and show_error:
-                Gdk.threads_enter()
                 err_dia = AptErrorDialog(self._transaction.error, self)
                 err_dia.run()
                 err_dia.hide()
-                Gdk.threads_leave()
         self.emit("finished")
 
 
@@ -93,7 +91,7 @@ class AptWorker(object):
         trans.simulate(reply_handler=lambda: self._confirm_deps(trans),
                        error_handler=self._on_error)
 
-    @post_ui
+    @post_dialog
     def _confirm_deps(self, trans):
         if [pkgs for pkgs in trans.dependencies if pkgs]:
             dia = AptConfirmDialog(trans, parent=self.parent)
@@ -118,7 +116,7 @@ class AptWorker(object):
                 reply_handler=lambda: True,
                 error_handler=self._on_error)
 
-    @post_ui
+    @post_dialog
     def _on_error(self, error):
         try:
             raise error